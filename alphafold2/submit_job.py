@@ -6,33 +6,63 @@ from __future__ import annotations
 
 import argparse
 import base64
+import hashlib
+import importlib.util
 import io
 import json
 import os
+import re
 import sys
 import tarfile
 import time
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import certifi
 import requests
 
 
+def _load_fasta_module() -> Any:
+    # the portal's FASTA module is the one parser for both; it is standard library only, so it is loaded from
+    # its file instead of through the portal package (whose dependencies the CLI does not need)
+    path = Path(__file__).resolve().parent.parent / "portal" / "backend" / "app" / "fasta.py"
+    spec = importlib.util.spec_from_file_location("alphafold_fasta", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # dataclasses resolve their module while the file executes
+    spec.loader.exec_module(module)
+    return module
+
+
+_fasta = _load_fasta_module()
+FASTA_SUFFIXES = _fasta.FASTA_SUFFIXES
+FastaError = _fasta.FastaError
+WorkUnit = _fasta.WorkUnit
+balanced_batches = _fasta.balanced_batches
+dedupe_units = _fasta.dedupe_units
+parse_sequence_text = _fasta.parse_sequence_text
+read_fasta = _fasta.read_fasta
+work_units = _fasta.work_units
+
+
+def _single_sequence(records: Iterable[Any], source: str) -> str:
+    records = list(records)
+    if len(records) != 1:
+        raise SystemExit(
+            f"{source} holds {len(records)} records; use --batch-dir/--batch-manifest to fold them separately "
+            "or --fasta-path with --model-preset multimer for a complex"
+        )
+    return records[0].sequence
+
+
 def _read_sequence_from_fasta(fasta_path: Path) -> str:
     if not fasta_path.is_file():
         raise FileNotFoundError(f"FASTA not found: {fasta_path}")
-    seq_lines = []
-    with fasta_path.open("r", encoding="utf-8") as handle:
-        for line in handle:
-            line = line.strip()
-            if not line or line.startswith(">"):
-                continue
-            seq_lines.append(line)
-    if not seq_lines:
-        raise ValueError(f"No sequence content found in {fasta_path}")
-    return "".join(seq_lines)
+    try:
+        return _single_sequence(read_fasta(fasta_path), str(fasta_path))
+    except FastaError as exc:
+        raise SystemExit(f"Invalid FASTA: {exc}") from exc
 
 
 def _combine_with_certifi(user_ca_path: str) -> str:
@@ -77,7 +107,10 @@ def build_payload(args: argparse.Namespace) -> Tuple[Dict[str, Any], Optional[Di
     elif args.sequence_file:
         payload["sequence"] = _read_sequence_from_fasta(Path(args.sequence_file))
     elif args.sequence:
-        payload["sequence"] = args.sequence.strip()
+        try:
+            payload["sequence"] = _single_sequence(parse_sequence_text(args.sequence), "--sequence")
+        except FastaError as exc:
+            raise SystemExit(f"Invalid sequence: {exc}") from exc
     elif args.fasta_url:
         payload["fasta_url"] = args.fasta_url
     else:
@@ -106,6 +139,15 @@ def _create_upload_archive(upload_spec: Dict[str, Any]) -> Dict[str, Any]:
                 raise FileNotFoundError(f"FASTA directory not found: {dir_path}")
             tar.add(str(dir_path), arcname=dir_path.name)
             upload_meta = {"root": dir_path.name}
+        elif kind == "fasta_paths" and "texts" in upload_spec:
+            texts: Dict[str, str] = upload_spec["texts"]
+            for name, text in texts.items():
+                data = text.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+            upload_meta = {"file_names": list(texts)}
         elif kind == "fasta_paths":
             paths = upload_spec["paths"]
             missing = [str(p) for p in paths if not p.is_file()]
@@ -201,6 +243,235 @@ def save_archives(output: Dict[str, Any], destination: Path) -> None:
         print(f"[+] Saved archive to {path}")
 
 
+TERMINAL_STATES = {"COMPLETED", "COMPLETED_WITH_ERRORS", "FAILED", "CANCELLED", "TIMED_OUT"}
+
+
+def _write_base64(encoded: str, path: Path, chunk_chars: int = 4 << 20) -> int:
+    """Decode base64 straight to disk in chunks instead of materialising the whole archive."""
+    written = 0
+    with path.open("wb") as handle:
+        for start in range(0, len(encoded), chunk_chars):
+            data = base64.b64decode(encoded[start : start + chunk_chars])
+            handle.write(data)
+            written += len(data)
+    return written
+
+
+def _batch_inputs(args: argparse.Namespace) -> List[Path]:
+    paths: List[Path] = []
+    if args.batch_dir:
+        root = Path(args.batch_dir).expanduser()
+        if not root.is_dir():
+            raise SystemExit(f"Batch directory not found: {root}")
+        paths.extend(sorted(p for p in root.iterdir() if p.suffix.lower() in FASTA_SUFFIXES))
+    if args.batch_manifest:
+        manifest = Path(args.batch_manifest).expanduser()
+        with manifest.open("r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                path = Path(line).expanduser()
+                paths.append(path if path.is_absolute() else manifest.parent / path)
+    missing = [str(p) for p in paths if not p.is_file()]
+    if missing:
+        raise SystemExit(f"FASTA file(s) not found: {', '.join(missing)}")
+    if not paths:
+        raise SystemExit("No FASTA files found for batch submission")
+    return paths
+
+
+def _batch_work(args: argparse.Namespace) -> List[Tuple[str, str, List[WorkUnit]]]:
+    """Split inputs into work units, drop duplicates and pack them into length-balanced jobs."""
+    multimer = (args.model_preset or "").startswith("multimer")
+    units: List[WorkUnit] = []
+    for path in _batch_inputs(args):
+        try:
+            units.extend(work_units(read_fasta(path), multimer=multimer, name=path.stem))
+        except FastaError as exc:
+            raise SystemExit(f"Invalid FASTA: {exc}") from exc
+    unique = dedupe_units(units)
+    print(f"[batch] {len(units)} work units, {len(units) - len(unique)} duplicate(s) dropped")
+    work = []
+    for units_in_job in balanced_batches(unique, args.batch_residues):
+        digest = hashlib.sha256(",".join(sorted(unit.key for unit in units_in_job)).encode()).hexdigest()[:16]
+        name = units_in_job[0].name if len(units_in_job) == 1 else f"batch_{digest[:8]}"
+        work.append((f"{name}:{digest}", name, units_in_job))
+    return work
+
+
+class BatchJournal:
+    """Append-only JSON lines log of batch progress; replaying it makes a rerun resume."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            with path.open("r", encoding="utf-8") as handle:
+                for line in handle:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    self.entries.setdefault(record["key"], {}).update(record)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, key: str, **fields: Any) -> None:
+        record = {"key": key, "time": time.time(), **fields}
+        self.entries.setdefault(key, {}).update(record)
+        with self.path.open("a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def state(self, key: str) -> Optional[str]:
+        return self.entries.get(key, {}).get("state")
+
+    def job_id(self, key: str) -> Optional[str]:
+        return self.entries.get(key, {}).get("job_id")
+
+
+def _batch_payload(args: argparse.Namespace, name: str, units: List[WorkUnit]) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {}
+    if len(units) == 1 and len(units[0].records) == 1 and not args.upload_inputs:
+        payload["sequence"] = units[0].records[0].sequence
+    else:
+        payload["input_archive"] = _create_upload_archive(
+            {
+                "kind": "fasta_paths",
+                "texts": {unit.file_name: unit.to_fasta() for unit in units},
+                "archive_name": f"{name}.tar.gz",
+            }
+        )
+    if args.model_preset:
+        payload["model_preset"] = args.model_preset
+    if args.db_preset:
+        payload["db_preset"] = args.db_preset
+    if args.max_template_date:
+        payload["max_template_date"] = args.max_template_date
+    if args.extra_flags:
+        payload["alphafold_extra_flags"] = args.extra_flags
+    return payload
+
+
+def _status_once(api_key: str, endpoint_id: str, job_id: str, verify: Any) -> Dict[str, Any]:
+    url = f"https://api.runpod.ai/v2/{endpoint_id}/status/{job_id}"
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    response = requests.get(url, headers=headers, timeout=30, verify=verify)
+    response.raise_for_status()
+    return response.json()
+
+
+def _output_stem(key: str) -> str:
+    # work names can repeat across inputs (same file stem or record name in two manifest entries);
+    # the digest of the job's sequences cannot, and stays the same when a rerun resumes the journal
+    name, digest = key.rsplit(":", 1)
+    return f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_.') or 'job'}-{digest[:8]}"
+
+
+def _save_batch_output(output: Dict[str, Any], output_dir: Path, stem: str) -> List[str]:
+    archives = output.get("archives") or []
+    if not archives and output.get("archive_base64"):
+        archives = [{"name": f"{stem}.tar.gz", "base64": output["archive_base64"]}]
+    saved: List[str] = []
+    target_dir = output_dir if len(archives) <= 1 else output_dir / stem
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for archive in archives:
+        name = f"{stem}.tar.gz" if len(archives) == 1 else archive.get("name") or f"{time.time_ns()}.tar.gz"
+        path = target_dir / name
+        _write_base64(archive["base64"], path)
+        saved.append(str(path))
+    return saved
+
+
+def run_batch(args: argparse.Namespace, api_key: str, endpoint_id: str, verify: Any) -> int:
+    work = _batch_work(args)
+    output_dir = Path(args.output_dir).expanduser()
+    journal = BatchJournal(Path(args.journal).expanduser() if args.journal else output_dir / "journal.jsonl")
+
+    queue: List[Tuple[str, str, List[WorkUnit]]] = []
+    in_flight: Dict[str, Tuple[str, str]] = {}
+    done = 0
+    failures = 0
+    for key, name, units in work:
+        state = journal.state(key)
+        if state == "completed" or (state == "failed" and not args.retry_failed):
+            done += 1
+            failures += state == "failed"
+        elif state == "submitted" and journal.job_id(key):
+            in_flight[key] = (name, journal.job_id(key))
+        else:
+            queue.append((key, name, units))
+    print(f"[batch] {len(work)} jobs: {done} finished, {len(in_flight)} resumed in flight, {len(queue)} to submit")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+
+        def submit_one(item: Tuple[str, str, List[WorkUnit]]) -> Tuple[str, str, List[WorkUnit], Optional[str], Optional[str]]:
+            key, name, units = item
+            try:
+                return key, name, units, submit_job(api_key, endpoint_id, _batch_payload(args, name, units), verify), None
+            except Exception as exc:  # noqa: BLE001
+                return key, name, units, None, str(exc)
+
+        def finish_one(key: str, name: str, job_id: str) -> Tuple[str, str, Optional[Dict[str, Any]], Optional[str]]:
+            try:
+                result = _status_once(api_key, endpoint_id, job_id, verify)
+            except Exception as exc:  # noqa: BLE001
+                return key, name, None, str(exc)
+            status = result.get("status") or result.get("state")
+            if status not in TERMINAL_STATES:
+                return key, name, None, None
+            if status in {"COMPLETED", "COMPLETED_WITH_ERRORS"} and result.get("output"):
+                result["saved"] = _save_batch_output(result["output"], output_dir, _output_stem(key))
+                result.pop("output", None)
+            return key, name, result, None
+
+        while queue or in_flight:
+            free = max(args.concurrency - len(in_flight), 0)
+            submitting, queue = queue[:free], queue[free:]
+            # journal each submission as it returns, so an interrupt mid-wave keeps the RunPod IDs already created
+            for future in as_completed([pool.submit(submit_one, item) for item in submitting]):
+                key, name, units, job_id, error = future.result()
+                details = {
+                    "units": [unit.name for unit in units],
+                    "residues": sum(unit.length for unit in units),
+                    "duplicates": {alias: unit.name for unit in units for alias in unit.aliases},
+                }
+                if job_id:
+                    journal.record(key, state="submitted", job_id=job_id, **details)
+                    in_flight[key] = (name, job_id)
+                    print(f"[batch] submitted {name} ({len(units)} unit(s), {details['residues']} residues) -> {job_id}")
+                else:
+                    failures += 1
+                    journal.record(key, state="failed", error=error, **details)
+                    print(f"[!] submit failed for {name}: {error}", file=sys.stderr)
+
+            polled = list(pool.map(lambda item: finish_one(item[0], *item[1]), list(in_flight.items())))
+            for key, name, result, error in polled:
+                if error:
+                    print(f"[!] status check failed for {name}: {error}", file=sys.stderr)
+                if not result:
+                    continue
+                del in_flight[key]
+                status = result.get("status") or result.get("state")
+                if status in {"COMPLETED", "COMPLETED_WITH_ERRORS"}:
+                    journal.record(key, state="completed", status=status, archives=result.get("saved", []))
+                    print(f"[+] {name} {status.lower()} -> {', '.join(result.get('saved', [])) or 'no archive'}")
+                else:
+                    failures += 1
+                    journal.record(key, state="failed", status=status, error=result.get("error"))
+                    print(f"[!] {name} {status}: {result.get('error')}", file=sys.stderr)
+
+            if in_flight and time.time() - start > args.timeout:
+                print("[!] Batch timed out; rerun with the same journal to resume.", file=sys.stderr)
+                return 1
+            if in_flight:
+                time.sleep(args.poll_interval)
+    print(f"[batch] finished: {len(work) - failures} ok, {failures} failed (journal: {journal.path})")
+    return 1 if failures else 0
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Submit AlphaFold job to RunPod Serverless endpoint")
     parser.add_argument("--sequence-file", help="Path to FASTA file to read")
@@ -222,6 +493,18 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--insecure", action="store_true", help="Disable TLS verification (development only)")
     parser.add_argument("--async", dest="do_async", action="store_true", help="Submit and print job id without polling")
     parser.add_argument("--status", help="Poll an existing job id and print its final result")
+    parser.add_argument("--batch-dir", help="Submit every FASTA file in this directory as its own job")
+    parser.add_argument("--batch-manifest", help="Text file listing FASTA paths (one per line) to submit as jobs")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum batch jobs in flight at once")
+    parser.add_argument("--output-dir", default="alphafold_results", help="Where batch archives are written")
+    parser.add_argument("--journal", help="Batch journal path (default: <output-dir>/journal.jsonl)")
+    parser.add_argument(
+        "--batch-residues",
+        type=int,
+        default=0,
+        help="Pack batch work units into jobs of about this many residues (0 = one chain/complex per job)",
+    )
+    parser.add_argument("--retry-failed", action="store_true", help="Resubmit batch entries the journal marks failed")
     parser.add_argument(
         "--upload-inputs",
         action="store_true",
@@ -244,6 +527,9 @@ def main() -> None:
     else:
         verify = _resolve_verify(args.ca_bundle, append_certifi=args.append_certifi)
 
+    if args.batch_dir or args.batch_manifest:
+        sys.exit(run_batch(args, api_key, endpoint_id, verify))
+
     if args.status:
         result = poll_job(api_key, endpoint_id, args.status, verify, args.poll_interval, args.timeout)
         print(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,39 @@
+﻿from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .confidence import analyze_confidence
+from .metrics import ANALYSIS_ERRORS, ANALYSIS_SECONDS
+from .phastest import analyze_phage
+from .poses import analyze_pose_clusters, analyze_poses
+from .tracing import span
+
+Analyzer = Callable[[AsyncSession, models.Job, Path], Awaitable[None]]
+
+# post-persistence stages per pipeline; each one replaces its own rows for the job
+ANALYZERS: dict[str, list[Analyzer]] = {
+    "alphafold": [analyze_confidence],
+    "diffdock": [analyze_poses, analyze_pose_clusters],
+    "phastest": [analyze_phage],
+}
+
+
+async def run_analyzers(db: AsyncSession, job: models.Job, directory: Path) -> None:
+    for analyzer in ANALYZERS.get(job.pipeline, []):
+        name = analyzer.__name__
+        start = time.perf_counter()
+        try:
+            with span(f"analysis.{name}", job_id=job.id):
+                async with db.begin_nested():
+                    await analyzer(db, job, directory)
+        except Exception as exc:  # noqa: BLE001
+            # analysis is derived data; a bad file must not fail the job that produced it
+            ANALYSIS_ERRORS.labels(analyzer=name).inc()
+            print(f"[analysis] {name} failed for job {job.id}: {exc}")
+        finally:
+            ANALYSIS_SECONDS.labels(analyzer=name).observe(time.perf_counter() - start)
@@ -1,13 +1,18 @@
-﻿from datetime import datetime, timedelta
+﻿import time
+from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
 from . import models
+from .cache import TTLCache
 from .config import get_settings
 from .database import get_db
 from .schemas import TokenData
@@ -16,6 +21,9 @@ settings = get_settings()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 # use pbkdf2_sha256 to avoid bcrypt backend issues & 72-byte truncation
 password_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# decoded token -> username, and username -> user row; polling hits these on every request
+token_cache: TTLCache[str] = TTLCache(settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds)
+user_cache: TTLCache[models.User] = TTLCache(settings.auth_cache_max_entries, settings.auth_cache_ttl_seconds)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -26,6 +34,24 @@ def hash_password(password: str) -> str:
     return password_context.hash(password)
 
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password: str) -> str:
+    return await run_in_threadpool(hash_password, password)
+
+
+def invalidate_user(username: str) -> None:
+    user_cache.pop(username)
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(_mapper, _connection, target: models.User) -> None:
+    invalidate_user(target.username)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.access_token_expire_minutes))
@@ -33,32 +59,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 
-def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[models.User]:
+    user = await get_user_by_username(db, username)
+    if not user or not await verify_password_async(password, user.password_hash):
+        return None
+    return user
 
 
-def authenticate_user(db: Session, username: str, password: str) -> Optional[models.User]:
-    user = get_user_by_username(db, username)
-    if not user or not verify_password(password, user.password_hash):
+def decode_token_subject(token: str) -> str | None:
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    username = payload.get("sub")
+    if username is None:
         return None
+    token_data = TokenData(username=username)
+    exp = payload.get("exp")
+    token_cache.set(token, token_data.username, ttl=exp - time.time() if exp else None)
+    return token_data.username
+
+
+async def get_cached_user(db: AsyncSession, username: str) -> Optional[models.User]:
+    user = user_cache.get(username)
+    if user is not None:
+        return await db.merge(user, load=False)
+    user = await get_user_by_username(db, username)
+    if user is not None:
+        user_cache.set(username, _detached_copy(user))
     return user
 
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
+def _detached_copy(user: models.User) -> models.User:
+    # cache a snapshot rather than the session-bound row so a rollback elsewhere cannot expire it
+    snapshot = models.User(
+        id=user.id,
+        username=user.username,
+        password_hash=user.password_hash,
+        created_at=user.created_at,
+        updated_at=user.updated_at,
+    )
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+async def get_current_user(
+    request: Request, db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="인증 정보가 올바르지 않습니다.",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str | None = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+        username = decode_token_subject(token)
     except JWTError as exc:
         raise credentials_exception from exc
-    user = get_user_by_username(db, username=token_data.username)
+    if username is None:
+        raise credentials_exception
+    user = await get_cached_user(db, username)
     if user is None:
         raise credentials_exception
+    # read by the profiling middleware to tie a captured profile to its requester
+    request.state.user_id = user.id
     return user
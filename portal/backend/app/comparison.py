@@ -0,0 +1,129 @@
+﻿"""All-pairs structure comparison: batched Kabsch superposition over matched CA atoms.
+
+Every structure is scattered onto a shared residue axis (absent residues are masked to zero), so the
+per-pair sums Kabsch needs become a few einsums over the whole set and one batched 3x3 SVD.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+
+from .structures import ANALYSIS_DIR, PARSERS, Atoms, parse_structure
+
+MatchMode = Literal["numbering", "order"]
+PAIR_BLOCK = 512
+
+
+@dataclass
+class Trace:
+    label: str
+    chains: np.ndarray
+    res_seq: np.ndarray
+    coords: np.ndarray
+
+    def keys(self, match: MatchMode) -> list[tuple]:
+        if match == "order":
+            return [(index,) for index in range(len(self.coords))]
+        return list(zip(self.chains.tolist(), self.res_seq.tolist()))
+
+
+def _trace(atoms: Atoms, label: str) -> Trace:
+    ca = atoms.select(~atoms.hetero & (atoms.names == b"CA"))
+    if not len(ca):
+        raise ValueError(f"{label} has no CA atoms")
+    # keep the first CA of each residue (insertion codes / altlocs already collapsed by the parser)
+    keys = np.rec.fromarrays([ca.chains, ca.res_seq])
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return Trace(label=label, chains=ca.chains[first], res_seq=ca.res_seq[first], coords=ca.coords[first].astype(np.float64))
+
+
+def load_trace(path: Path) -> Trace:
+    """CA trace of a structure file, cached beside it in ``.analysis/<name>.ca.npz``."""
+    cache = path.parent / ANALYSIS_DIR / f"{path.name}.ca.npz"
+    if cache.exists() and cache.stat().st_mtime >= path.stat().st_mtime:
+        try:
+            with np.load(cache) as cached:
+                return Trace(label=path.name, chains=cached["chains"], res_seq=cached["res_seq"], coords=cached["coords"])
+        except (OSError, ValueError, KeyError):
+            pass
+    trace = _trace(parse_structure(path), path.name)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    with cache.open("wb") as handle:
+        np.savez(handle, chains=trace.chains, res_seq=trace.res_seq, coords=trace.coords)
+    return trace
+
+
+def trace_from_bytes(data: bytes, file_name: str) -> Trace:
+    parser = PARSERS.get(Path(file_name).suffix.lower())
+    if parser is None:
+        raise ValueError(f"unsupported structure format: {file_name}")
+    return _trace(parser(data), file_name)
+
+
+def _d0(length: np.ndarray) -> np.ndarray:
+    return np.maximum(1.24 * np.cbrt(np.maximum(length, 19) - 15) - 1.8, 0.5)
+
+
+def compare(traces: list[Trace], match: MatchMode = "numbering") -> dict:
+    """RMSD after optimal superposition, aligned residue counts and a TM-score of that superposition.
+
+    ``tm[i][j]`` is normalised by the length of structure ``j`` (the reference), so it is not symmetric.
+    """
+    keyed = [trace.keys(match) for trace in traces]
+    axis = {key: index for index, key in enumerate(sorted({key for keys in keyed for key in keys}))}
+    count, width = len(traces), len(axis)
+    mask = np.zeros((count, width))
+    coords = np.zeros((count, width, 3))
+    for row, (trace, keys) in enumerate(zip(traces, keyed)):
+        columns = np.fromiter((axis[key] for key in keys), dtype=np.intp, count=len(keys))
+        mask[row, columns] = 1
+        coords[row, columns] = trace.coords
+
+    aligned = mask @ mask.T
+    sum_x = np.matmul(mask, coords)  # [i, j]: coords of i summed over residues shared with j
+    sum_y = sum_x.transpose(1, 0, 2)
+    squares = (coords**2).sum(axis=2)
+    norm_x = squares @ mask.T
+    norm_y = norm_x.T
+    cross = np.tensordot(coords, coords, axes=([1], [1])).transpose(0, 2, 1, 3)
+    safe = np.maximum(aligned, 1)[..., None]
+    centre_x, centre_y = sum_x / safe, sum_y / safe
+    covariance = cross - aligned[..., None, None] * centre_x[..., :, None] * centre_y[..., None, :]
+    left, singular, right = np.linalg.svd(covariance)
+    sign = np.sign(np.linalg.det(left @ right))
+    sign[sign == 0] = 1
+    singular[..., 2] *= sign
+    spread = norm_x - aligned * (centre_x**2).sum(-1) + norm_y - aligned * (centre_y**2).sum(-1)
+    rmsd = np.sqrt(np.clip(spread - 2 * singular.sum(-1), 0, None) / np.maximum(aligned, 1))
+
+    # rotation taking i onto j: R = V diag(1, 1, d) U^T
+    correction = np.ones(singular.shape)
+    correction[..., 2] = sign
+    rotation = np.einsum("ijba,ijb,ijcb->ijac", right, correction, left)
+    lengths = mask.sum(axis=1)
+    d0 = _d0(lengths)
+    tm = np.zeros((count, count))
+    pairs = np.argwhere(aligned >= 3)
+    for start in range(0, len(pairs), PAIR_BLOCK):
+        block = pairs[start : start + PAIR_BLOCK]
+        first, second = block[:, 0], block[:, 1]
+        shared = mask[first] * mask[second]
+        moved = (coords[first] - centre_x[first, second][:, None]) @ rotation[first, second].transpose(0, 2, 1)
+        offset = moved + centre_y[first, second][:, None] - coords[second]
+        distance = np.sqrt(np.einsum("pka,pka->pk", offset, offset))
+        score = (shared / (1 + (distance / d0[second][:, None]) ** 2)).sum(axis=1)
+        tm[first, second] = score / lengths[second]
+    rmsd[aligned < 3] = np.nan
+    np.fill_diagonal(rmsd, 0)
+    return {
+        "labels": [trace.label for trace in traces],
+        "residues": lengths.astype(int).tolist(),
+        "aligned": aligned.astype(int).tolist(),
+        "rmsd": [[None if np.isnan(value) else round(float(value), 3) for value in row] for row in rmsd],
+        "tm": np.round(tm, 4).tolist(),
+    }
@@ -0,0 +1,137 @@
+﻿"""Per-residue AlphaFold confidence (pLDDT, PAE) extracted from persisted results.
+
+Arrays are stored as little-endian blobs: pLDDT as uint16 hundredths (exact for the two decimals
+AlphaFold writes), PAE as uint8 eighths of an Angstrom, residue numbers as int32.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .structures import parse_structure
+
+PAE_STEP = 0.125
+CONFIDENT_PLDDT = 70.0
+RANKED_MODEL = re.compile(r"^ranked_(\d+)$")
+
+
+@dataclass
+class ModelScores:
+    target: str | None
+    model_name: str
+    rank: int | None
+    plddt: np.ndarray
+    residue_numbers: np.ndarray
+    chains: str
+    pae: np.ndarray | None = None
+    ranking_score: float | None = None
+    ranking_metric: str | None = None
+
+
+def residue_plddt(path: Path) -> tuple[np.ndarray, np.ndarray, str]:
+    """pLDDT per residue from the B-factor column of each CA atom."""
+    atoms = parse_structure(path)
+    ca = atoms.select(~atoms.hetero & (atoms.names == b"CA"))
+    if not len(ca):
+        raise ValueError(f"{path.name} has no CA atoms")
+    chains = b"".join(chain[:1] or b"-" for chain in ca.chains.tolist()).decode(errors="replace")
+    return ca.b_factors, ca.res_seq, chains
+
+
+def _load_pae(path: Path) -> np.ndarray | None:
+    if not path.exists():
+        return None
+    data = json.loads(path.read_text())
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    values = data.get("predicted_aligned_error") or data.get("pae")
+    return np.asarray(values, dtype=np.float32) if values is not None else None
+
+
+def collect_scores(directory: Path) -> list[ModelScores]:
+    """Scores for every ``ranked_*`` model under ``directory`` (one subfolder per target for batched runs)."""
+    scores: list[ModelScores] = []
+    for ranking_dir in sorted({path.parent for path in directory.rglob("ranked_*.pdb")}):
+        ranking_path = ranking_dir / "ranking_debug.json"
+        ranking = json.loads(ranking_path.read_text()) if ranking_path.exists() else {}
+        order: list[str] = ranking.get("order") or []
+        metric = "iptm+ptm" if "iptm+ptm" in ranking else "plddts" if "plddts" in ranking else None
+        target = None if ranking_dir == directory else ranking_dir.relative_to(directory).as_posix()
+        for path in sorted(ranking_dir.glob("ranked_*.pdb")):
+            match = RANKED_MODEL.match(path.stem)
+            rank = int(match.group(1)) if match else None
+            plddt, residue_numbers, chains = residue_plddt(path)
+            model = order[rank] if rank is not None and rank < len(order) else None
+            pae = _load_pae(ranking_dir / f"pae_{model}.json") if model else None
+            if pae is not None and pae.shape != (len(plddt), len(plddt)):
+                pae = None
+            scores.append(
+                ModelScores(
+                    target=target,
+                    model_name=path.stem,
+                    rank=rank,
+                    plddt=plddt,
+                    residue_numbers=residue_numbers,
+                    chains=chains,
+                    pae=pae,
+                    ranking_score=float(ranking[metric][model]) if metric and model in ranking.get(metric, {}) else None,
+                    ranking_metric=metric,
+                )
+            )
+    return scores
+
+
+def to_row(job_id: str, scores: ModelScores) -> models.ModelConfidence:
+    plddt = scores.plddt
+    return models.ModelConfidence(
+        job_id=job_id,
+        target=scores.target,
+        model_name=scores.model_name,
+        rank=scores.rank,
+        residues=len(plddt),
+        mean_plddt=round(float(plddt.mean()), 2),
+        min_plddt=round(float(plddt.min()), 2),
+        confident_fraction=round(float((plddt >= CONFIDENT_PLDDT).mean()), 4),
+        max_pae=round(float(scores.pae.max()), 2) if scores.pae is not None else None,
+        ranking_score=scores.ranking_score,
+        ranking_metric=scores.ranking_metric,
+        chains=scores.chains,
+        plddt=np.round(plddt * 100).clip(0, 65535).astype("<u2").tobytes(),
+        residue_numbers=scores.residue_numbers.astype("<i4").tobytes(),
+        pae=(
+            np.round(scores.pae / PAE_STEP).clip(0, 255).astype(np.uint8).tobytes() if scores.pae is not None else None
+        ),
+    )
+
+
+def decode_plddt(row: models.ModelConfidence) -> np.ndarray:
+    return np.frombuffer(row.plddt, dtype="<u2") / 100
+
+
+def decode_residue_numbers(row: models.ModelConfidence) -> np.ndarray:
+    return np.frombuffer(row.residue_numbers, dtype="<i4")
+
+
+def decode_pae(row: models.ModelConfidence) -> np.ndarray | None:
+    if row.pae is None:
+        return None
+    return np.frombuffer(row.pae, dtype=np.uint8).astype(np.float32).reshape(row.residues, row.residues) * PAE_STEP
+
+
+def _confidence_rows(job_id: str, directory: Path) -> list[models.ModelConfidence]:
+    return [to_row(job_id, item) for item in collect_scores(directory)]
+
+
+async def analyze_confidence(db: AsyncSession, job: models.Job, directory: Path) -> None:
+    rows = await asyncio.to_thread(_confidence_rows, job.id, directory)
+    await db.execute(delete(models.ModelConfidence).where(models.ModelConfidence.job_id == job.id))
+    db.add_all(rows)
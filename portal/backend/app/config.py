@@ -7,20 +7,63 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     app_name: str = "RunPod Portal"
     database_url: str = Field(default="sqlite:///./data/app.db", env="DATABASE_URL")
+    async_database_url: str | None = Field(default=None, env="ASYNC_DATABASE_URL")
+    db_pool_size: int = Field(default=10, env="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=20, env="DB_MAX_OVERFLOW")
     secret_key: str = Field(default="change-me", env="SECRET_KEY")
     access_token_expire_minutes: int = 60 * 24
     algorithm: str = "HS256"
+    auth_cache_ttl_seconds: int = Field(default=60, env="AUTH_CACHE_TTL_SECONDS")
+    auth_cache_max_entries: int = Field(default=1024, env="AUTH_CACHE_MAX_ENTRIES")
 
     runpod_api_key: str | None = Field(default=None, env="RUNPOD_API_KEY")
     alphafold_endpoint_id: str | None = Field(default=None, env="ALPHAFOLD_ENDPOINT_ID")
     diffdock_endpoint_id: str | None = Field(default=None, env="DIFFDOCK_ENDPOINT_ID")
     phastest_endpoint_id: str | None = Field(default=None, env="PHASTEST_ENDPOINT_ID")
+    # comma-separated pools; combined with the single *_ENDPOINT_ID above
+    alphafold_endpoint_ids: str | None = Field(default=None, env="ALPHAFOLD_ENDPOINT_IDS")
+    diffdock_endpoint_ids: str | None = Field(default=None, env="DIFFDOCK_ENDPOINT_IDS")
+    phastest_endpoint_ids: str | None = Field(default=None, env="PHASTEST_ENDPOINT_IDS")
+    circuit_failure_threshold: int = Field(default=3, env="CIRCUIT_FAILURE_THRESHOLD")
+    circuit_reset_seconds: int = Field(default=120, env="CIRCUIT_RESET_SECONDS")
+    prewarm_enabled: bool = Field(default=True, env="PREWARM_ENABLED")
+    prewarm_interval_seconds: int = Field(default=60, env="PREWARM_INTERVAL_SECONDS")
+    prewarm_cooldown_seconds: int = Field(default=600, env="PREWARM_COOLDOWN_SECONDS")
+    prewarm_max_cooldown_seconds: int = Field(default=6 * 3600, env="PREWARM_MAX_COOLDOWN_SECONDS")
+    prewarm_history_weeks: int = Field(default=4, env="PREWARM_HISTORY_WEEKS")
+    prewarm_min_expected_jobs: float = Field(default=1.0, env="PREWARM_MIN_EXPECTED_JOBS")
+    prewarm_default_preset: str = Field(default="full_dbs", env="PREWARM_DEFAULT_PRESET")
 
     storage_root: Path = Field(default=Path("./data"), env="STORAGE_ROOT")
     uploads_dir: str = "uploads"
     results_dir: str = "results"
     retention_days: int = Field(default=7, env="RETENTION_DAYS")
     poll_interval_seconds: int = Field(default=30, env="POLL_INTERVAL_SECONDS")
+    # ask streaming-capable handlers for partial outputs and drain RunPod's /stream while jobs run
+    stream_outputs: bool = Field(default=True, env="STREAM_OUTPUTS")
+    dispatch_interval_seconds: float = Field(default=5, env="DISPATCH_INTERVAL_SECONDS")
+    dispatch_queue_depth: int = Field(default=2, env="DISPATCH_QUEUE_DEPTH")
+    # input archive codec when the pipeline's handler accepts it (PipelineDefinition.archive_codecs plus ZSTD_PIPELINES)
+    archive_codec: str = Field(default="gzip", env="ARCHIVE_CODEC")
+    # comma-separated pipelines whose deployed worker image unpacks zstd input archives
+    zstd_pipelines: str | None = Field(default=None, env="ZSTD_PIPELINES")
+    archive_threads: int = Field(default=0, env="ARCHIVE_THREADS")
+    # AlphaFold work units are packed into length-balanced batches of about this many residues (0 = one per unit)
+    alphafold_batch_residues: int = Field(default=0, env="ALPHAFOLD_BATCH_RESIDUES")
+    pose_cluster_rmsd: float = Field(default=2.0, env="POSE_CLUSTER_RMSD")
+
+    tracing_enabled: bool = Field(default=True, env="TRACING_ENABLED")
+    trace_ring_size: int = Field(default=20000, env="TRACE_RING_SIZE")
+    trace_export_path: Path | None = Field(default=None, env="TRACE_EXPORT_PATH")
+
+    compression_minimum_size: int = Field(default=1024, env="COMPRESSION_MINIMUM_SIZE")
+    compression_gzip_level: int = Field(default=6, env="COMPRESSION_GZIP_LEVEL")
+    compression_brotli_quality: int = Field(default=4, env="COMPRESSION_BROTLI_QUALITY")
+
+    slow_request_ms: int = Field(default=1000, env="SLOW_REQUEST_MS")
+    profiling_enabled: bool = Field(default=False, env="PROFILING_ENABLED")
+    profile_all_requests: bool = Field(default=False, env="PROFILE_ALL_REQUESTS")
+    profile_interval_ms: float = Field(default=5.0, env="PROFILE_INTERVAL_MS")
 
     class Config:
         env_file = ".env"
@@ -1,21 +1,82 @@
-﻿from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+﻿from sqlalchemy import event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 
 from .config import get_settings
 
 settings = get_settings()
 
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {},
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    # a sync driver (postgresql+psycopg2, sqlite+pysqlite) is swapped for the async one of the same database
+    base = scheme.split("+", 1)[0]
+    if base not in ASYNC_DRIVERS or scheme in ASYNC_DRIVERS.values():
+        return url
+    return f"{ASYNC_DRIVERS[base]}{sep}{rest}"
+
+
+database_url = settings.async_database_url or async_database_url(settings.database_url)
+is_sqlite = database_url.startswith("sqlite")
+
+engine = create_async_engine(
+    database_url,
+    **(
+        {"connect_args": {"check_same_thread": False}}
+        if is_sqlite
+        else {"pool_size": settings.db_pool_size, "max_overflow": settings.db_max_overflow, "pool_pre_ping": True}
+    ),
 )
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
+if is_sqlite:
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, _record) -> None:
+        # WAL lets the monitor write while request handlers keep reading; FKs enable ON DELETE CASCADE
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def _add_missing_columns(conn) -> None:
+    # create_all never alters existing tables; add new nullable/defaulted columns and indexes in place
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.execute(text(ddl))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def init_db() -> None:
+    from . import models  # noqa: F401  (register tables on Base.metadata)
+    from .search import search_index
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(search_index.setup)
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,129 @@
+﻿"""Receptor de-duplication for DiffDock submissions.
+
+DiffDock ``jobs`` often pair one protein with many ligands. Grouping them by receptor content
+lets each protein ship once and lets the worker reuse its embedding across a protein-major run.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import zipfile
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Any
+
+from .validation import normalize_upload_path
+
+
+@dataclass
+class ProteinGroups:
+    jobs: list[dict[str, Any]]
+    groups: list[dict[str, Any]]
+    files: list[Path] = field(default_factory=list)
+
+
+def _exact_member(wanted: str, names: list[str]) -> str | None:
+    return next((name for name in names if name == wanted or name.endswith(f"/{wanted}")), None)
+
+
+def _resolve_protein(
+    protein_path: str, loose: dict[str, Path], members: dict[Path, list[str]]
+) -> tuple[Path, str | None] | None:
+    """Exact matches first (a loose file for a bare name, then a zip member path); basenames only as a fallback."""
+    wanted = normalize_upload_path(protein_path)
+    base = PurePosixPath(wanted).name
+    if "/" not in wanted and wanted in loose:
+        return loose[wanted], None
+    for path, names in members.items():
+        member = _exact_member(wanted, names)
+        if member:
+            return path, member
+    if base in loose:
+        return loose[base], None
+    for path, names in members.items():
+        member = next((name for name in names if PurePosixPath(name).name == base), None)
+        if member:
+            return path, member
+    return None
+
+
+def group_by_protein(jobs: list[dict[str, Any]], files: list[Path], target_dir: Path) -> ProteinGroups:
+    """Rewrite ``jobs`` to point at one canonical copy per unique protein, ordered protein-major.
+
+    ``protein_path`` is resolved against loose uploads by file name and against zipped folders by
+    member path. Resolved proteins are written to ``target_dir`` as ``protein_<sha>.pdb`` and the
+    copies they replace are left out of ``files``. Unresolvable paths are kept as given.
+    """
+    loose = {path.name: path for path in files if path.suffix.lower() != ".zip"}
+    zips: dict[Path, zipfile.ZipFile] = {}
+    try:
+        # opened inside the try so a corrupt zip still closes the ones opened before it
+        for path in files:
+            if path.suffix.lower() == ".zip":
+                zips[path] = zipfile.ZipFile(path)
+        members = {path: [name for name in archive.namelist() if not name.endswith("/")] for path, archive in zips.items()}
+        digests: dict[tuple[Path, str | None], str] = {}
+        groups: dict[str, dict[str, Any]] = {}
+        consumed_loose: set[Path] = set()
+        consumed_members: dict[Path, set[str]] = {}
+        rewritten: list[tuple[int, int, dict[str, Any]]] = []
+
+        for order, job in enumerate(jobs):
+            protein_path = str(job.get("protein_path") or "")
+            source = _resolve_protein(protein_path, loose, members)
+            if source is None:
+                key = f"path:{protein_path}"
+                group = groups.setdefault(key, {"protein_path": protein_path, "sha256": None, "complex_names": []})
+            else:
+                if source not in digests:
+                    path, member = source
+                    data = zips[path].read(member) if member else path.read_bytes()
+                    data = data.replace(b"\r\n", b"\n")
+                    digest = hashlib.sha256(data).hexdigest()
+                    digests[source] = digest
+                    canonical = target_dir / f"protein_{digest[:16]}.pdb"
+                    if not canonical.exists():
+                        canonical.write_bytes(data)
+                if source[1] is None:
+                    consumed_loose.add(source[0])
+                else:
+                    consumed_members.setdefault(source[0], set()).add(source[1])
+                key = digests[source]
+                group = groups.setdefault(
+                    key, {"protein_path": f"protein_{key[:16]}.pdb", "sha256": key, "complex_names": []}
+                )
+            group["complex_names"].append(job.get("complex_name"))
+            group_index = group.setdefault("_index", len(groups) - 1)
+            rewritten.append((group_index, order, {**job, "protein_path": group["protein_path"]}))
+
+        kept: list[Path] = [path for path in files if path.suffix.lower() != ".zip" and path not in consumed_loose]
+        for path, archive in zips.items():
+            dropped = consumed_members.get(path, set())
+            remaining = [name for name in members[path] if name not in dropped]
+            if not dropped:
+                kept.append(path)
+            elif remaining:
+                slim = path.with_name(f"{path.stem}.slim.zip")
+                with zipfile.ZipFile(slim, "w", zipfile.ZIP_DEFLATED) as out:
+                    for name in remaining:
+                        out.writestr(archive.getinfo(name), archive.read(name))
+                kept.append(path)
+    finally:
+        for archive in zips.values():
+            archive.close()
+
+    canonical_files = {target_dir / f"protein_{digest[:16]}.pdb" for digest in digests.values()}
+    for path in consumed_loose - canonical_files:
+        path.unlink(missing_ok=True)
+    for path in consumed_members:
+        slim = path.with_name(f"{path.stem}.slim.zip")
+        if slim.exists():
+            slim.replace(path)
+        else:
+            path.unlink(missing_ok=True)
+    kept += sorted(canonical_files)
+    return ProteinGroups(
+        jobs=[job for _, _, job in sorted(rewritten, key=lambda item: item[:2])],
+        groups=[{key: value for key, value in group.items() if key != "_index"} for group in groups.values()],
+        files=kept,
+    )
@@ -0,0 +1,314 @@
+﻿from __future__ import annotations
+
+import asyncio
+import heapq
+from collections import defaultdict, deque
+from contextlib import suppress
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple
+
+import httpx
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .metrics import DISPATCH_PENDING, DISPATCH_QUEUE_SECONDS, DISPATCH_RELEASED, observe_status_change
+from .endpoints import endpoint_pool
+from .runpod import RunpodClient, build_pipeline_payload, pipeline_endpoints
+from .storage import archive_to_base64
+from .tracing import record_span, span
+
+settings = get_settings()
+
+
+class QueuedJob(NamedTuple):
+    id: str
+    user_id: int
+    pipeline: str
+    priority: int
+    created_at: datetime
+
+
+def fair_share_order(
+    candidates: Iterable[QueuedJob],
+    in_flight: dict[int, int],
+    weights: dict[int, float],
+    limit: int,
+) -> list[QueuedJob]:
+    """Pick up to ``limit`` jobs, always serving the user with the lowest weighted in-flight count.
+
+    Priority only reorders a user's own queue, so one user cannot jump everyone else by raising it.
+    """
+    queues: dict[int, deque[QueuedJob]] = defaultdict(deque)
+    for job in sorted(candidates, key=lambda item: (-item.priority, item.created_at)):
+        queues[job.user_id].append(job)
+    usage = {user_id: in_flight.get(user_id, 0) for user_id in queues}
+    heap = [(usage[user_id] / weights.get(user_id, 1.0), queue[0].created_at, user_id) for user_id, queue in queues.items()]
+    heapq.heapify(heap)
+    selected: list[QueuedJob] = []
+    while heap and len(selected) < limit:
+        _, _, user_id = heapq.heappop(heap)
+        queue = queues[user_id]
+        selected.append(queue.popleft())
+        usage[user_id] += 1
+        if queue:
+            heapq.heappush(heap, (usage[user_id] / weights.get(user_id, 1.0), queue[0].created_at, user_id))
+    return selected
+
+
+async def job_payload(job: models.Job) -> dict[str, Any]:
+    archive_payload = None
+    if job.input_archive_path:
+        archive_path = Path(job.input_archive_path)
+        archive_payload = {
+            "kind": "uploaded",
+            "archive_name": archive_path.name,
+            "file_names": job.input_files or [],
+            "base64": await asyncio.to_thread(archive_to_base64, archive_path),
+        }
+    return build_pipeline_payload(
+        job.pipeline,
+        parameters=job.parameters or {},
+        sequence=job.sequence,
+        input_archive=archive_payload,
+    )
+
+
+async def close_attempt(db: AsyncSession, job: models.Job, status: str, response: dict | None = None) -> None:
+    attempt = await db.scalar(
+        select(models.JobAttempt).where(
+            models.JobAttempt.job_id == job.id, models.JobAttempt.runpod_job_id == job.runpod_job_id
+        )
+    )
+    if attempt is None:
+        return
+    response = response or {}
+    attempt.status = status.lower()
+    # only this attempt's own error; job.error_message may still hold an earlier attempt's retry note
+    attempt.error_message = response.get("error") or response.get("message") or attempt.error_message
+    # a bare cancel carries no timings; keep the ones RunPod already reported
+    if response.get("delayTime") is not None:
+        attempt.delay_ms = response["delayTime"]
+    if response.get("executionTime") is not None:
+        attempt.execution_ms = response["executionTime"]
+    attempt.finished_at = attempt.finished_at or datetime.utcnow()
+
+
+async def request_cancel(db: AsyncSession, client: RunpodClient | None, job: models.Job) -> bool:
+    """Cancel ``job`` locally and on RunPod; returns False when the remote cancel must be retried."""
+    was_active = job.status in models.ACTIVE_STATUSES
+    cancelled = await cancel_remote(client, job)
+    if was_active and cancelled and job.status == "cancelled" and job.runpod_job_id:
+        await close_attempt(db, job, job.status)
+    return cancelled
+
+
+async def cancel_remote(client: RunpodClient | None, job: models.Job) -> bool:
+    """Session-free part of :func:`request_cancel`, safe to run concurrently for many jobs."""
+    previous = job.status
+    if job.status not in models.ACTIVE_STATUSES:
+        return True
+    if not job.runpod_job_id:
+        job.status = "cancelled"
+        job.next_attempt_at = None
+        observe_status_change(job.pipeline, previous, job.status)
+        return True
+    job.status = "cancelling"
+    try:
+        if client is None:
+            raise httpx.TransportError("RunPod client is not configured.")
+        with span("runpod.cancel_job", job_id=job.id, endpoint=job.endpoint_id):
+            await client.cancel(job.endpoint_id, job.runpod_job_id)
+    except httpx.HTTPStatusError as exc:
+        # RunPod forgets finished jobs; nothing left to stop
+        if exc.response.status_code != 404:
+            print(f"[dispatcher] cancel failed for {job.id}: {exc}")
+            observe_status_change(job.pipeline, previous, job.status)
+            return False
+    except httpx.HTTPError as exc:
+        print(f"[dispatcher] cancel failed for {job.id}: {exc}")
+        observe_status_change(job.pipeline, previous, job.status)
+        return False
+    job.status = "cancelled"
+    observe_status_change(job.pipeline, previous, job.status)
+    return True
+
+
+class JobDispatcher:
+    """Holds jobs in the local ``pending`` queue and releases them as RunPod endpoints have room."""
+
+    def __init__(self) -> None:
+        self._stop = asyncio.Event()
+        self._wake = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.client: RunpodClient | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self._stop.clear()
+            self.task = asyncio.create_task(self._run(), name="job-dispatcher")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self.task:
+            with suppress(asyncio.TimeoutError, asyncio.CancelledError):
+                await asyncio.wait_for(self.task, timeout=5)
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def _run(self) -> None:
+        try:
+            self.client = RunpodClient()
+        except RuntimeError as exc:
+            print(f"[dispatcher] RunPod client disabled: {exc}")
+            return
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                await self.dispatch_once()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[dispatcher] error: {exc}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), settings.dispatch_interval_seconds)
+
+    async def dispatch_once(self) -> None:
+        async with AsyncSessionLocal() as db:
+            rows = await db.execute(
+                select(models.Job.id, models.Job.user_id, models.Job.pipeline, models.Job.priority, models.Job.created_at).where(
+                    models.Job.status == "pending",
+                    models.Job.runpod_job_id.is_(None),
+                    or_(models.Job.next_attempt_at.is_(None), models.Job.next_attempt_at <= datetime.utcnow()),
+                )
+            )
+            pending = [QueuedJob(*row) for row in rows]
+            if not pending:
+                DISPATCH_PENDING.clear()
+                return
+            in_flight = dict(
+                (
+                    await db.execute(
+                        select(models.Job.user_id, func.count())
+                        .where(models.Job.status.in_(models.IN_FLIGHT_STATUSES))
+                        .group_by(models.Job.user_id)
+                    )
+                ).all()
+            )
+            user_ids = {job.user_id for job in pending}
+            weights = dict(
+                (await db.execute(select(models.User.id, models.User.share_weight).where(models.User.id.in_(user_ids)))).all()
+            )
+        weights = {user_id: max(weight or 1.0, 0.01) for user_id, weight in weights.items()}
+
+        by_pipeline: dict[str, list[QueuedJob]] = defaultdict(list)
+        for job in pending:
+            by_pipeline[job.pipeline].append(job)
+        for pipeline, jobs in by_pipeline.items():
+            DISPATCH_PENDING.labels(pipeline=pipeline).set(len(jobs))
+            try:
+                endpoint_ids = pipeline_endpoints(pipeline)
+            except RuntimeError as exc:
+                print(f"[dispatcher] {exc}")
+                continue
+            slots = await endpoint_pool.capacity(self.client, endpoint_ids)
+            assigned: dict[str, int] = {}
+            for job in fair_share_order(jobs, in_flight, weights, sum(slots.values())):
+                endpoint_id = endpoint_pool.choose(slots, assigned)
+                if endpoint_id is None:
+                    break
+                if await self._release(job.id, endpoint_id):
+                    assigned[endpoint_id] = assigned.get(endpoint_id, 0) + 1
+                    in_flight[job.user_id] = in_flight.get(job.user_id, 0) + 1
+                else:
+                    # stop routing to this endpoint for the rest of the cycle; the job stays queued
+                    slots[endpoint_id] = 0
+
+    async def _release(self, job_id: str, endpoint_id: str) -> bool:
+        assert self.client is not None
+        async with AsyncSessionLocal() as db:
+            job = await db.get(models.Job, job_id)
+            if job is None or job.status != "pending" or job.runpod_job_id:
+                return True
+            # end the read transaction so the conditional write below sees cancels made during submit
+            await db.commit()
+            with span("dispatch.submit", job_id=job.id, endpoint=endpoint_id):
+                now = datetime.utcnow()
+                record_span(
+                    "local.queue",
+                    job.id,
+                    job.created_at.replace(tzinfo=timezone.utc).timestamp(),
+                    (now - job.created_at).total_seconds() * 1000,
+                    priority=job.priority,
+                )
+                try:
+                    runpod_job_id = await self.client.submit(endpoint_id, await job_payload(job))
+                except httpx.HTTPStatusError as exc:
+                    if exc.response.status_code < 500 and exc.response.status_code != 429:
+                        job.status = "failed"
+                        job.endpoint_id = endpoint_id
+                        job.error_message = f"RunPod rejected the job: {exc.response.text[:500]}"
+                        observe_status_change(job.pipeline, "pending", job.status)
+                        await db.commit()
+                        return True
+                    print(f"[dispatcher] submit to {endpoint_id} failed for {job.id}: {exc}")
+                    endpoint_pool.record_failure(endpoint_id)
+                    return False
+                except httpx.HTTPError as exc:
+                    print(f"[dispatcher] submit to {endpoint_id} failed for {job.id}: {exc}")
+                    endpoint_pool.record_failure(endpoint_id)
+                    return False
+            endpoint_pool.record_success(endpoint_id)
+            attempts = (job.attempts or 0) + 1
+            # conditional write: a cancel or delete that landed while submit was in flight must win
+            claimed = await db.execute(
+                update(models.Job)
+                .where(models.Job.id == job.id, models.Job.status == "pending", models.Job.runpod_job_id.is_(None))
+                .values(
+                    status="submitted",
+                    endpoint_id=endpoint_id,
+                    runpod_job_id=runpod_job_id,
+                    submitted_at=now,
+                    attempts=attempts,
+                    next_attempt_at=None,
+                    # the previous attempt's retry note no longer describes this job
+                    error_message=None,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if claimed.rowcount == 0:
+                await db.rollback()
+                await self._cancel_orphan(job_id, endpoint_id, runpod_job_id)
+                return True
+            if endpoint_pool.state(endpoint_id).cold:
+                endpoint_pool.cold_jobs.add(job.id)
+            db.add(
+                models.JobAttempt(
+                    job_id=job.id,
+                    number=attempts,
+                    runpod_job_id=runpod_job_id,
+                    endpoint_id=endpoint_id,
+                    submitted_at=now,
+                )
+            )
+            observe_status_change(job.pipeline, "pending", "submitted")
+            DISPATCH_RELEASED.labels(endpoint=endpoint_id, pipeline=job.pipeline).inc()
+            DISPATCH_QUEUE_SECONDS.labels(pipeline=job.pipeline).observe((now - job.created_at).total_seconds())
+            await db.commit()
+        return True
+
+    async def _cancel_orphan(self, job_id: str, endpoint_id: str, runpod_job_id: str) -> None:
+        try:
+            with span("runpod.cancel_job", job_id=job_id, endpoint=endpoint_id):
+                await self.client.cancel(endpoint_id, runpod_job_id)
+        except httpx.HTTPError as exc:
+            print(f"[dispatcher] job {job_id} was cancelled during submit; cancelling {runpod_job_id} failed: {exc}")
+
+
+dispatcher = JobDispatcher()
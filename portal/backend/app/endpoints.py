@@ -0,0 +1,129 @@
+﻿from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+
+from .config import get_settings
+from .runpod import RunpodClient
+
+settings = get_settings()
+
+# weight of the newest executionTime sample in the per-endpoint moving average
+EXECUTION_EWMA_ALPHA = 0.3
+
+
+@dataclass
+class EndpointState:
+    endpoint_id: str
+    in_queue: int = 0
+    in_progress: int = 0
+    idle_workers: int = 0
+    running_workers: int = 0
+    health_at: float | None = None
+    execution_seconds: float | None = None
+    completed: int = 0
+    failures: int = 0
+    open_until: float = 0.0
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.failures >= settings.circuit_failure_threshold and time.monotonic() < self.open_until
+
+    def estimated_wait(self, assigned: int) -> float:
+        workers = max(self.idle_workers + self.running_workers, 1)
+        backlog = self.in_queue + self.in_progress + assigned
+        # endpoints we have never seen finish a job are assumed as fast as a one-second job
+        return backlog / workers * (self.execution_seconds or 1.0)
+
+    @property
+    def cold(self) -> bool:
+        return self.health_at is not None and self.idle_workers + self.running_workers == 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "endpointId": self.endpoint_id,
+            "inQueue": self.in_queue,
+            "inProgress": self.in_progress,
+            "idleWorkers": self.idle_workers,
+            "runningWorkers": self.running_workers,
+            "executionSeconds": self.execution_seconds,
+            "completed": self.completed,
+            "circuitOpen": self.circuit_open,
+            "failures": self.failures,
+        }
+
+
+@dataclass
+class EndpointPool:
+    """Live view of every RunPod endpoint used to route and fail over submissions."""
+
+    states: dict[str, EndpointState] = field(default_factory=dict)
+    # jobs released while their endpoint had no ready workers, for cold-start latency
+    cold_jobs: set[str] = field(default_factory=set)
+
+    def state(self, endpoint_id: str) -> EndpointState:
+        if endpoint_id not in self.states:
+            self.states[endpoint_id] = EndpointState(endpoint_id)
+        return self.states[endpoint_id]
+
+    def record_success(self, endpoint_id: str) -> None:
+        state = self.state(endpoint_id)
+        state.failures = 0
+        state.open_until = 0.0
+
+    def record_failure(self, endpoint_id: str) -> None:
+        state = self.state(endpoint_id)
+        state.failures += 1
+        if state.failures >= settings.circuit_failure_threshold:
+            state.open_until = time.monotonic() + settings.circuit_reset_seconds
+            print(f"[endpoints] circuit open for {endpoint_id} after {state.failures} failures")
+
+    def record_execution(self, endpoint_id: str, execution_ms: float) -> None:
+        state = self.state(endpoint_id)
+        seconds = execution_ms / 1000
+        if state.execution_seconds is None:
+            state.execution_seconds = seconds
+        else:
+            state.execution_seconds += EXECUTION_EWMA_ALPHA * (seconds - state.execution_seconds)
+        state.completed += 1
+
+    async def capacity(self, client: RunpodClient, endpoint_ids: list[str]) -> dict[str, int]:
+        """Refresh /health for each usable endpoint and return how many jobs each can take now."""
+        slots: dict[str, int] = {}
+        for endpoint_id in endpoint_ids:
+            state = self.state(endpoint_id)
+            if state.circuit_open:
+                continue
+            try:
+                health = await client.health(endpoint_id)
+            except httpx.HTTPError as exc:
+                print(f"[endpoints] health check failed for {endpoint_id}: {exc}")
+                self.record_failure(endpoint_id)
+                continue
+            self.record_success(endpoint_id)
+            jobs = health.get("jobs") or {}
+            workers = health.get("workers") or {}
+            state.in_queue = jobs.get("inQueue", 0)
+            state.in_progress = jobs.get("inProgress", 0)
+            state.idle_workers = workers.get("idle", 0)
+            state.running_workers = workers.get("running", 0)
+            state.health_at = time.time()
+            # idle workers take a job immediately; beyond that keep at most dispatch_queue_depth waiting remotely
+            slots[endpoint_id] = max(0, settings.dispatch_queue_depth + state.idle_workers - state.in_queue)
+        return slots
+
+    def choose(self, slots: dict[str, int], assigned: dict[str, int]) -> str | None:
+        candidates = [
+            endpoint_id
+            for endpoint_id, free in slots.items()
+            if free > assigned.get(endpoint_id, 0) and not self.state(endpoint_id).circuit_open
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda endpoint_id: self.state(endpoint_id).estimated_wait(assigned.get(endpoint_id, 0)))
+
+
+endpoint_pool = EndpointPool()
@@ -0,0 +1,170 @@
+﻿"""Streaming FASTA parsing, work-unit splitting and length-balanced batching for AlphaFold submissions.
+
+The one parser for the portal and ``alphafold2/submit_job.py``. The CLI loads this file directly, so it
+must stay standard library only and free of imports from the rest of ``app``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import math
+import re
+from dataclasses import dataclass, field
+from itertools import groupby
+from pathlib import Path
+from typing import Iterable, Iterator
+
+PROTEIN_RESIDUES = frozenset("ACDEFGHIKLMNPQRSTVWYX")
+FASTA_SUFFIXES = {".fasta", ".fa", ".faa", ".fas"}
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class FastaError(ValueError):
+    def __init__(self, message: str, source: str | None = None, line: int | None = None) -> None:
+        location = ":".join(str(part) for part in (source, line) if part is not None)
+        super().__init__(f"{location}: {message}" if location else message)
+
+
+@dataclass(frozen=True)
+class FastaRecord:
+    name: str
+    description: str
+    sequence: str
+
+
+@dataclass
+class WorkUnit:
+    """One AlphaFold prediction: a single chain (monomer) or all chains of a complex (multimer)."""
+
+    name: str
+    records: list[FastaRecord]
+    aliases: list[str] = field(default_factory=list)
+
+    @property
+    def length(self) -> int:
+        return sum(len(record.sequence) for record in self.records)
+
+    @property
+    def key(self) -> str:
+        # chain order does not change the prediction, so it does not change the key either
+        joined = "\n".join(sorted(record.sequence for record in self.records))
+        return hashlib.sha256(joined.encode("ascii")).hexdigest()[:16]
+
+    @property
+    def file_name(self) -> str:
+        return f"{_UNSAFE_NAME.sub('_', self.name).strip('_.') or self.key}.fasta"
+
+    def to_fasta(self, width: int = 60) -> str:
+        lines: list[str] = []
+        for record in self.records:
+            lines.append(f">{record.description or record.name}")
+            lines.extend(record.sequence[i : i + width] for i in range(0, len(record.sequence), width))
+        return "\n".join(lines) + "\n"
+
+
+def iter_fasta(lines: Iterable[str], source: str | None = None, alphabet: frozenset[str] = PROTEIN_RESIDUES) -> Iterator[FastaRecord]:
+    name: str | None = None
+    description = ""
+    header_line = 0
+    chunks: list[str] = []
+    number = 0
+    for number, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line or line.startswith(";"):
+            continue
+        if line.startswith(">"):
+            if name is not None:
+                yield _record(name, description, chunks, source, header_line)
+            description = line[1:].strip()
+            name = description.split()[0] if description else f"record_{number}"
+            header_line = number
+            chunks = []
+            continue
+        if name is None:
+            raise FastaError("sequence data before the first '>' header", source, number)
+        residues = "".join(line.split()).upper().rstrip("*")
+        invalid = set(residues) - alphabet
+        if invalid:
+            raise FastaError(f"invalid residue(s) {''.join(sorted(invalid))} in {name}", source, number)
+        chunks.append(residues)
+    if name is None:
+        raise FastaError("no FASTA records found", source, number or None)
+    yield _record(name, description, chunks, source, header_line)
+
+
+def _record(name: str, description: str, chunks: list[str], source: str | None, line: int) -> FastaRecord:
+    if not chunks:
+        raise FastaError(f"record {name} has no sequence", source, line)
+    return FastaRecord(name=name, description=description, sequence="".join(chunks))
+
+
+def read_fasta(path: Path) -> Iterator[FastaRecord]:
+    with Path(path).open("r", encoding="utf-8-sig") as handle:
+        yield from iter_fasta(handle, source=Path(path).name)
+
+
+def parse_sequence_text(text: str, name: str = "sequence") -> Iterator[FastaRecord]:
+    """Parse pasted input, which may be FASTA or a bare residue string."""
+    lines = text.splitlines()
+    if not text.lstrip().startswith(">"):
+        lines = [f">{name}", *lines]
+    return iter_fasta(lines, source=name)
+
+
+def work_units(records: Iterable[FastaRecord], multimer: bool = False, name: str = "complex") -> Iterator[WorkUnit]:
+    """Split records into predictions.
+
+    Monomer runs fold every record on its own. Multimer runs group consecutive records sharing
+    the ``complex|chain`` header prefix; without any ``|`` the whole input is one complex.
+    """
+    if not multimer:
+        for record in records:
+            yield WorkUnit(name=record.name, records=[record])
+        return
+    records = list(records)
+    if not any("|" in record.name for record in records):
+        yield WorkUnit(name=name, records=records)
+        return
+    for complex_name, chains in groupby(records, key=lambda record: record.name.split("|", 1)[0]):
+        yield WorkUnit(name=complex_name, records=list(chains))
+
+
+def dedupe_units(units: Iterable[WorkUnit]) -> list[WorkUnit]:
+    """Keep the first unit per sequence set; later copies are recorded as aliases of it."""
+    unique: dict[str, WorkUnit] = {}
+    names: set[str] = set()
+    for unit in units:
+        kept = unique.get(unit.key)
+        if kept is not None:
+            kept.aliases.append(unit.name)
+            continue
+        base, suffix = unit.name, 2
+        while unit.file_name.lower() in names:
+            unit.name = f"{base}_{suffix}"
+            suffix += 1
+        names.add(unit.file_name.lower())
+        unique[unit.key] = unit
+    return list(unique.values())
+
+
+def balanced_batches(units: Iterable[WorkUnit], max_residues: int) -> list[list[WorkUnit]]:
+    """Pack units into batches of roughly ``max_residues`` total length with near-equal load.
+
+    Longest units are placed first, each onto the lightest batch (LPT scheduling), so no batch
+    ends up more than a third above the best possible split. ``max_residues <= 0`` gives one
+    unit per batch.
+    """
+    units = sorted(units, key=lambda unit: unit.length, reverse=True)
+    if not units:
+        return []
+    if max_residues <= 0:
+        return [[unit] for unit in units]
+    count = min(len(units), max(1, math.ceil(sum(unit.length for unit in units) / max_residues)))
+    batches: list[list[WorkUnit]] = [[] for _ in range(count)]
+    heap = [(0, index) for index in range(count)]
+    for unit in units:
+        load, index = heapq.heappop(heap)
+        batches[index].append(unit)
+        heapq.heappush(heap, (load + unit.length, index))
+    return batches
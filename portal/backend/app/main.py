@@ -2,43 +2,79 @@
 
 import os
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 
+from . import models
+from .auth import get_current_user
+from .compression import CompressionMiddleware
 from .config import get_settings
-from .database import Base, engine
-from .routers import auth, jobs, pipelines, users
+from .database import init_db
+from .dispatcher import dispatcher
+from .metrics import render_latest
+from .prewarm import prewarm
+from .profiling import profiles, profiling_middleware
+from .routers import analysis, auth, jobs, pipelines, users
 from .tasks import monitor
 
 settings = get_settings()
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title=settings.app_name)
+app = FastAPI(title=settings.app_name, default_response_class=ORJSONResponse)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.compression_minimum_size,
+    gzip_level=settings.compression_gzip_level,
+    brotli_quality=settings.compression_brotli_quality,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=os.environ.get("CORS_ALLOW_ORIGINS", "*").split(","),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id", "X-DB-Queries"],
 )
+app.middleware("http")(profiling_middleware)
 
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(pipelines.router)
 app.include_router(jobs.router)
+app.include_router(analysis.router)
 
 
 @app.on_event("startup")
-def start_monitor() -> None:
+async def start_monitor() -> None:
+    await init_db()
     monitor.start()
+    dispatcher.start()
+    prewarm.start()
 
 
 @app.on_event("shutdown")
-def stop_monitor() -> None:
-    monitor.stop()
+async def stop_monitor() -> None:
+    await prewarm.stop()
+    await dispatcher.stop()
+    await monitor.stop()
 
 
 @app.get("/health")
 def health():
     return {"ok": True}
 
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/api/profiles/{profile_id}", response_class=PlainTextResponse)
+def download_profile(profile_id: str, current_user: models.User = Depends(get_current_user)):
+    entry = profiles.get(profile_id)
+    # profiles hold stack frames of the captured request, so only its requester may read them
+    if entry is None or entry[0] != current_user.id:
+        raise HTTPException(status_code=404, detail="Profile not found or expired.")
+    return PlainTextResponse(entry[1], headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
+
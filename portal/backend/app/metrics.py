@@ -0,0 +1,147 @@
+﻿from __future__ import annotations
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# RunPod reports delayTime/executionTime in milliseconds; everything here is exported in seconds
+JOB_SECONDS_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8, 5e8, 1e9, 5e9)
+
+RUNPOD_REQUEST_SECONDS = Histogram(
+    "runpod_request_seconds",
+    "Latency of RunPod API calls.",
+    ["operation", "endpoint"],
+)
+RUNPOD_REQUEST_ERRORS = Counter(
+    "runpod_request_errors_total",
+    "RunPod API calls that raised or returned an error status.",
+    ["operation", "endpoint"],
+)
+RUNPOD_DELAY_SECONDS = Histogram(
+    "runpod_job_delay_seconds",
+    "Queue time reported by RunPod (delayTime).",
+    ["pipeline"],
+    buckets=JOB_SECONDS_BUCKETS,
+)
+RUNPOD_EXECUTION_SECONDS = Histogram(
+    "runpod_job_execution_seconds",
+    "Execution time reported by RunPod (executionTime).",
+    ["pipeline"],
+    buckets=JOB_SECONDS_BUCKETS,
+)
+JOB_STATUS_TRANSITIONS = Counter(
+    "portal_job_status_transitions_total",
+    "Job status changes observed by the portal.",
+    ["pipeline", "status"],
+)
+MONITOR_CYCLE_SECONDS = Histogram(
+    "portal_monitor_cycle_seconds",
+    "Duration of one job monitor poll cycle.",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+MONITOR_BACKLOG = Gauge(
+    "portal_monitor_active_jobs",
+    "Jobs in an active status at the start of the last poll cycle.",
+)
+MONITOR_ERRORS = Counter(
+    "portal_monitor_errors_total",
+    "Poll cycles that ended with an exception.",
+)
+PERSIST_SECONDS = Histogram(
+    "portal_persist_output_seconds",
+    "Time spent decoding, writing and indexing job outputs.",
+    ["pipeline"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+ARCHIVE_BYTES_PERSISTED = Counter(
+    "portal_archive_bytes_persisted_total",
+    "Result archive bytes written to storage.",
+    ["pipeline"],
+)
+STREAM_CHUNKS = Counter(
+    "portal_stream_chunks_total",
+    "Partial outputs read from RunPod /stream while jobs were running.",
+    ["pipeline"],
+)
+UPLOAD_BYTES = Histogram(
+    "portal_upload_bytes",
+    "Total size of files uploaded with a job.",
+    ["pipeline"],
+    buckets=BYTES_BUCKETS,
+)
+
+DISPATCH_PENDING = Gauge(
+    "portal_dispatch_pending_jobs",
+    "Jobs waiting in the local queue per pipeline.",
+    ["pipeline"],
+)
+DISPATCH_RELEASED = Counter(
+    "portal_dispatch_released_total",
+    "Jobs released from the local queue to RunPod.",
+    ["endpoint", "pipeline"],
+)
+DISPATCH_QUEUE_SECONDS = Histogram(
+    "portal_dispatch_queue_seconds",
+    "Time a job spent in the local queue before submission.",
+    ["pipeline"],
+    buckets=JOB_SECONDS_BUCKETS,
+)
+
+JOB_RETRIES = Counter(
+    "portal_job_retries_total",
+    "Failed or timed-out attempts that were requeued automatically.",
+    ["pipeline", "reason"],
+)
+
+PREWARM_REQUESTS = Counter(
+    "portal_prewarm_requests_total",
+    "Preload requests sent to endpoints.",
+    ["endpoint", "reason"],
+)
+PREWARM_LATENCY_SECONDS = Histogram(
+    "portal_prewarm_preload_seconds",
+    "Time from sending preload until RunPod reports it completed.",
+    ["endpoint"],
+    buckets=JOB_SECONDS_BUCKETS,
+)
+COLD_START_SECONDS = Histogram(
+    "portal_cold_start_delay_seconds",
+    "RunPod delayTime of jobs released while the endpoint had no ready workers.",
+    ["endpoint", "pipeline"],
+    buckets=JOB_SECONDS_BUCKETS,
+)
+
+PREVIEW_BUILD_SECONDS = Histogram(
+    "portal_preview_build_seconds",
+    "Time to parse a structure artifact and write its preview levels of detail.",
+    ["format"],
+)
+
+ANALYSIS_SECONDS = Histogram(
+    "portal_analysis_seconds",
+    "Time spent in post-persistence analysis stages.",
+    ["analyzer"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+ANALYSIS_ERRORS = Counter(
+    "portal_analysis_errors_total",
+    "Post-persistence analysis stages that raised.",
+    ["analyzer"],
+)
+
+
+def observe_status_change(pipeline: str, previous: str | None, current: str) -> None:
+    if previous != current:
+        JOB_STATUS_TRANSITIONS.labels(pipeline=pipeline, status=current).inc()
+
+
+def observe_runpod_timings(pipeline: str, response: dict) -> None:
+    delay_ms = response.get("delayTime")
+    execution_ms = response.get("executionTime")
+    if isinstance(delay_ms, (int, float)):
+        RUNPOD_DELAY_SECONDS.labels(pipeline=pipeline).observe(delay_ms / 1000)
+    if isinstance(execution_ms, (int, float)):
+        RUNPOD_EXECUTION_SECONDS.labels(pipeline=pipeline).observe(execution_ms / 1000)
+
+
+def render_latest() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
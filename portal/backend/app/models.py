@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from uuid import uuid4
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text
 from sqlalchemy.dialects.sqlite import JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -13,6 +13,10 @@ from .database import Base
 
 settings = get_settings()
 
+# RunPod statuses are stored lowercased (IN_QUEUE -> in_queue)
+IN_FLIGHT_STATUSES = ["submitted", "queued", "in_queue", "running", "in_progress", "cancelling"]
+ACTIVE_STATUSES = ["pending", *IN_FLIGHT_STATUSES]
+
 
 def _expires_at() -> datetime:
     return datetime.utcnow() + timedelta(days=settings.retention_days)
@@ -24,6 +28,7 @@ class User(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, index=True, nullable=False)
     password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
+    share_weight: Mapped[float] = mapped_column(Float, default=1.0, server_default="1.0")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -37,22 +42,39 @@ class Job(Base):
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
     title: Mapped[str] = mapped_column(String(120), nullable=False)
     pipeline: Mapped[str] = mapped_column(String(32), nullable=False)
-    status: Mapped[str] = mapped_column(String(32), default="pending")
+    status: Mapped[str] = mapped_column(String(32), default="pending", index=True)
+    priority: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     runpod_job_id: Mapped[Optional[str]] = mapped_column(String(80))
     endpoint_id: Mapped[Optional[str]] = mapped_column(String(80))
     parameters: Mapped[dict | None] = mapped_column(JSON, default=dict)
     notes: Mapped[Optional[str]] = mapped_column(Text)
+    sequence: Mapped[Optional[str]] = mapped_column(Text)
     input_archive_path: Mapped[Optional[str]] = mapped_column(String(255))
+    input_files: Mapped[list | None] = mapped_column(JSON)
     result_dir: Mapped[Optional[str]] = mapped_column(String(255))
     result_archive: Mapped[Optional[str]] = mapped_column(String(255))
     preferred_download_dir: Mapped[Optional[str]] = mapped_column(String(255))
     error_message: Mapped[Optional[str]] = mapped_column(Text)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    submitted_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
     expires_at: Mapped[datetime] = mapped_column(DateTime, default=_expires_at)
+    # stable key for the SQLite search index; assigned by trigger because VACUUM may renumber the implicit rowid
+    search_rowid: Mapped[Optional[int]] = mapped_column(Integer, index=True)
 
     user: Mapped[User] = relationship("User", back_populates="jobs")
     artifacts: Mapped[list[Artifact]] = relationship("Artifact", back_populates="job", cascade="all, delete-orphan")
+    attempt_history: Mapped[list[JobAttempt]] = relationship(
+        "JobAttempt", back_populates="job", cascade="all, delete-orphan", passive_deletes=True, order_by="JobAttempt.number"
+    )
+    confidences: Mapped[list[ModelConfidence]] = relationship(
+        "ModelConfidence", back_populates="job", cascade="all, delete-orphan", passive_deletes=True
+    )
+    poses: Mapped[list[DockingPose]] = relationship(
+        "DockingPose", back_populates="job", cascade="all, delete-orphan", passive_deletes=True
+    )
 
 
 class Artifact(Base):
@@ -69,3 +91,135 @@ class Artifact(Base):
 
     job: Mapped[Job] = relationship("Job", back_populates="artifacts")
 
+
+class JobAttempt(Base):
+    __tablename__ = "job_attempts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    number: Mapped[int] = mapped_column(Integer, nullable=False)
+    runpod_job_id: Mapped[Optional[str]] = mapped_column(String(80), index=True)
+    endpoint_id: Mapped[Optional[str]] = mapped_column(String(80))
+    status: Mapped[str] = mapped_column(String(32), default="submitted")
+    error_message: Mapped[Optional[str]] = mapped_column(Text)
+    delay_ms: Mapped[Optional[int]] = mapped_column(Integer)
+    execution_ms: Mapped[Optional[int]] = mapped_column(Integer)
+    submitted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+    job: Mapped[Job] = relationship("Job", back_populates="attempt_history")
+
+
+class ModelConfidence(Base):
+    """Per-model AlphaFold confidence; per-residue arrays are packed blobs (see app/confidence.py)."""
+
+    __tablename__ = "model_confidence"
+    __table_args__ = (Index("ix_model_confidence_job_model", "job_id", "target", "model_name"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    target: Mapped[Optional[str]] = mapped_column(String(255))
+    model_name: Mapped[str] = mapped_column(String(120), nullable=False)
+    rank: Mapped[Optional[int]] = mapped_column(Integer)
+    residues: Mapped[int] = mapped_column(Integer, nullable=False)
+    mean_plddt: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+    min_plddt: Mapped[float] = mapped_column(Float, nullable=False)
+    confident_fraction: Mapped[float] = mapped_column(Float, nullable=False)
+    max_pae: Mapped[Optional[float]] = mapped_column(Float)
+    ranking_score: Mapped[Optional[float]] = mapped_column(Float, index=True)
+    ranking_metric: Mapped[Optional[str]] = mapped_column(String(16))
+    chains: Mapped[str] = mapped_column(Text, nullable=False)
+    # blobs are deferred so ranking queries over many jobs never load them
+    plddt: Mapped[bytes] = mapped_column(LargeBinary, nullable=False, deferred=True)
+    residue_numbers: Mapped[bytes] = mapped_column(LargeBinary, nullable=False, deferred=True)
+    pae: Mapped[Optional[bytes]] = mapped_column(LargeBinary, deferred=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    job: Mapped[Job] = relationship("Job", back_populates="confidences")
+
+
+class DockingPose(Base):
+    """One ranked DiffDock pose; the SDF itself stays an ``Artifact``."""
+
+    __tablename__ = "docking_poses"
+    __table_args__ = (Index("ix_docking_poses_job_complex_ligand", "job_id", "complex_name", "ligand", "rank"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    artifact_id: Mapped[str] = mapped_column(ForeignKey("artifacts.id", ondelete="CASCADE"), nullable=False)
+    complex_name: Mapped[Optional[str]] = mapped_column(String(255), index=True)
+    ligand: Mapped[Optional[str]] = mapped_column(String(512))
+    rank: Mapped[int] = mapped_column(Integer, nullable=False)
+    confidence: Mapped[Optional[float]] = mapped_column(Float, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    job: Mapped[Job] = relationship("Job", back_populates="poses")
+
+
+class PoseCluster(Base):
+    """A distinct binding mode among a complex's sampled poses, at one RMSD threshold."""
+
+    __tablename__ = "pose_clusters"
+    __table_args__ = (Index("ix_pose_clusters_job_threshold", "job_id", "threshold", "complex_name", "cluster_index"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    complex_name: Mapped[Optional[str]] = mapped_column(String(255))
+    threshold: Mapped[float] = mapped_column(Float, nullable=False)
+    cluster_index: Mapped[int] = mapped_column(Integer, nullable=False)
+    representative_pose_id: Mapped[int] = mapped_column(ForeignKey("docking_poses.id", ondelete="CASCADE"), nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    member_ranks: Mapped[list] = mapped_column(JSON, default=list)
+    best_confidence: Mapped[Optional[float]] = mapped_column(Float)
+    max_rmsd: Mapped[float] = mapped_column(Float, default=0.0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    representative: Mapped[DockingPose] = relationship("DockingPose")
+
+
+class PhageGenome(Base):
+    """One PHASTEST sample of a job; ``max_gene_length`` bounds gene range scans from below."""
+
+    __tablename__ = "phage_genomes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False, index=True)
+    sample: Mapped[str] = mapped_column(String(255), nullable=False)
+    sequence_length: Mapped[Optional[int]] = mapped_column(Integer)
+    gene_count: Mapped[int] = mapped_column(Integer, default=0)
+    region_count: Mapped[int] = mapped_column(Integer, default=0)
+    max_gene_length: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PhageRegion(Base):
+    __tablename__ = "phage_regions"
+    __table_args__ = (Index("ix_phage_regions_job_sample_start", "job_id", "sample", "start"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    sample: Mapped[str] = mapped_column(String(255), nullable=False)
+    region_number: Mapped[int] = mapped_column(Integer, nullable=False)
+    start: Mapped[int] = mapped_column(Integer, nullable=False)
+    stop: Mapped[int] = mapped_column(Integer, nullable=False)
+    completeness: Mapped[Optional[str]] = mapped_column(String(16))
+    score: Mapped[Optional[int]] = mapped_column(Integer)
+    gc_percent: Mapped[Optional[float]] = mapped_column(Float)
+    gene_count: Mapped[int] = mapped_column(Integer, default=0)
+    phage_gene_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PhageGene(Base):
+    __tablename__ = "phage_genes"
+    __table_args__ = (Index("ix_phage_genes_job_sample_start", "job_id", "sample", "start"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    job_id: Mapped[str] = mapped_column(ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    sample: Mapped[str] = mapped_column(String(255), nullable=False)
+    start: Mapped[int] = mapped_column(Integer, nullable=False)
+    stop: Mapped[int] = mapped_column(Integer, nullable=False)
+    strand: Mapped[int] = mapped_column(Integer, default=1)
+    type: Mapped[str] = mapped_column(String(64), default="Unknown")
+    name: Mapped[str] = mapped_column(String(512), default="Unknown")
+    source: Mapped[str] = mapped_column(String(32), default="Unknown")
+    region_label: Mapped[str] = mapped_column(String(64), default="?")
+    region_number: Mapped[Optional[int]] = mapped_column(Integer)
@@ -0,0 +1,182 @@
+﻿"""PHASTEST region/gene index built once from ``<sample>/json_input``, ``<sample>.log`` and ``summary.txt``."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+SEQ_LENGTH = re.compile(r"seq length\s*=\s*(\d+)")
+SUMMARY_ROW = re.compile(
+    r"^\s*(\d+)\s+\S+\s+(intact|incomplete|questionable)\((\d+)\)\s+\S+\s+(?:\S+:)?(\d+)-(\d+)\s.*?([\d.]+)%?\s*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class PhageReport:
+    sample: str
+    sequence_length: int | None
+    genes: list[dict] = field(default_factory=list)
+    regions: list[dict] = field(default_factory=list)
+
+
+def region_number(value) -> int | None:
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    return None
+
+
+def legend_name(label: str) -> str:
+    return f"Phage {label}" if label.isdigit() else label
+
+
+def legend_color(name: str) -> str:
+    # stable per legend so every window of a genome paints a region the same way
+    digest = hashlib.md5(name.encode()).digest()
+    return "rgb({}, {}, {})".format(*(50 + value % 151 for value in digest[:3]))
+
+
+def _sequence_length(folder: Path, sample: str) -> int | None:
+    for log in [folder / f"{sample}.log", *sorted(folder.glob("*.log"))]:
+        if not log.exists():
+            continue
+        with log.open(encoding="utf-8", errors="ignore") as handle:
+            for line in handle:
+                match = SEQ_LENGTH.search(line)
+                if match:
+                    return int(match.group(1))
+    return None
+
+
+def _summary_regions(path: Path) -> dict[int, dict]:
+    if not path.exists():
+        return {}
+    regions = {}
+    for line in path.read_text(encoding="utf-8", errors="ignore").splitlines():
+        match = SUMMARY_ROW.match(line)
+        if match:
+            number, completeness, score, start, stop, gc = match.groups()
+            regions[int(number)] = {
+                "completeness": completeness.lower(),
+                "score": int(score),
+                "start": int(start),
+                "stop": int(stop),
+                "gc_percent": float(gc),
+            }
+    return regions
+
+
+def parse_report(features_path: Path) -> PhageReport:
+    folder = features_path.parent
+    sample = folder.name
+    report = PhageReport(sample=sample, sequence_length=_sequence_length(folder, sample))
+    for item in json.loads(features_path.read_text(encoding="utf-8")):
+        start, stop = int(item.get("start", 0)), int(item.get("stop", 0))
+        if stop <= 0:
+            continue
+        label = str(item.get("region_index", "?"))
+        report.genes.append(
+            {
+                "start": min(start, stop),
+                "stop": max(start, stop),
+                "strand": 1 if item.get("strand", "+") == "+" else -1,
+                "type": str(item.get("type", "Unknown"))[:64],
+                "name": str(item.get("name", "Unknown"))[:512],
+                "source": str(item.get("phage_bac_class", "Unknown")).capitalize()[:32],
+                "region_label": label[:64],
+                "region_number": region_number(item.get("region_index")),
+            }
+        )
+    report.genes.sort(key=lambda gene: (gene["start"], gene["stop"]))
+    summary = _summary_regions(folder / "summary.txt")
+    spans: dict[int, dict] = {}
+    for gene in report.genes:
+        number = gene["region_number"]
+        if number is None:
+            continue
+        entry = spans.setdefault(number, {"start": gene["start"], "stop": gene["stop"], "genes": 0, "phage_genes": 0})
+        entry["start"] = min(entry["start"], gene["start"])
+        entry["stop"] = max(entry["stop"], gene["stop"])
+        entry["genes"] += 1
+        entry["phage_genes"] += gene["source"] == "Phage"
+    for number in sorted(spans.keys() | summary.keys()):
+        entry = {**spans.get(number, {}), **summary.get(number, {})}
+        report.regions.append(
+            {
+                "region_number": number,
+                "start": entry["start"],
+                "stop": entry["stop"],
+                "completeness": entry.get("completeness"),
+                "score": entry.get("score"),
+                "gc_percent": entry.get("gc_percent"),
+                "gene_count": entry.get("genes", 0),
+                "phage_gene_count": entry.get("phage_genes", 0),
+            }
+        )
+    return report
+
+
+def collect_reports(directory: Path) -> list[PhageReport]:
+    return [parse_report(path) for path in sorted(directory.rglob("json_input")) if path.is_file()]
+
+
+async def analyze_phage(db: AsyncSession, job: models.Job, directory: Path) -> None:
+    reports = await asyncio.to_thread(collect_reports, directory)
+    for table in (models.PhageGene, models.PhageRegion, models.PhageGenome):
+        await db.execute(delete(table).where(table.job_id == job.id))
+    for report in reports:
+        db.add(
+            models.PhageGenome(
+                job_id=job.id,
+                sample=report.sample,
+                sequence_length=report.sequence_length,
+                gene_count=len(report.genes),
+                region_count=len(report.regions),
+                max_gene_length=max((gene["stop"] - gene["start"] for gene in report.genes), default=0),
+            )
+        )
+        if report.regions:
+            await db.execute(
+                insert(models.PhageRegion), [{"job_id": job.id, "sample": report.sample, **row} for row in report.regions]
+            )
+        if report.genes:
+            # executemany keeps genomes with thousands of genes to one round trip
+            await db.execute(
+                insert(models.PhageGene), [{"job_id": job.id, "sample": report.sample, **row} for row in report.genes]
+            )
+
+
+def cgview_document(sample_length: int | None, genes: list[models.PhageGene]) -> dict:
+    """The CGView JSON the gene visualizer loads, built from indexed rows instead of the raw report."""
+    legends = sorted({legend_name(gene.region_label) for gene in genes})
+    return {
+        "cgview": {
+            "version": "1.7.0",
+            "sequence": {"length": sample_length or max((gene.stop for gene in genes), default=1)},
+            "features": [
+                {
+                    "type": gene.type,
+                    "name": gene.name,
+                    "start": gene.start,
+                    "stop": gene.stop,
+                    "strand": gene.strand,
+                    "source": gene.source,
+                    "legend": legend_name(gene.region_label),
+                }
+                for gene in genes
+            ],
+            "legend": {
+                "items": [{"name": name, "swatchColor": legend_color(name), "decoration": "arrow"} for name in legends]
+            },
+            "tracks": [{"name": "Phage", "dataType": "feature", "dataMethod": "source", "dataKeys": "Phage"}],
+        }
+    }
@@ -0,0 +1,284 @@
+﻿"""DiffDock pose index built from the ``rank<N>[_confidence<score>].sdf`` files of persisted results,
+plus symmetry-aware clustering of the sampled poses of each complex."""
+
+from __future__ import annotations
+
+import asyncio
+import re
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .config import get_settings
+from .structures import ANALYSIS_DIR
+
+MAX_AUTOMORPHISMS = 512
+MAX_SEARCH_STEPS = 200_000
+POSE_FILE = re.compile(r"^rank(\d+)(?:_confidence(-?\d+(?:\.\d+)?(?:e-?\d+)?))?\.sdf$", re.IGNORECASE)
+
+
+def parse_pose_name(file_name: str) -> tuple[int, float | None] | None:
+    match = POSE_FILE.match(file_name)
+    if not match:
+        return None
+    rank, confidence = match.groups()
+    return int(rank), float(confidence) if confidence is not None else None
+
+
+def pose_rows(job: models.Job, artifacts: list[models.Artifact]) -> list[models.DockingPose]:
+    # DiffDock writes rank1.sdf next to rank1_confidence*.sdf; keep a single row per (complex, rank)
+    ligands = {
+        row.get("complex_name"): row.get("ligand_description")
+        for row in (job.parameters or {}).get("jobs") or []
+        if isinstance(row, dict)
+    }
+    result_dir = Path(job.result_dir) if job.result_dir else None
+    best: dict[tuple[str | None, int], tuple[models.Artifact, float | None]] = {}
+    for artifact in artifacts:
+        parsed = parse_pose_name(artifact.file_name)
+        if not parsed:
+            continue
+        rank, confidence = parsed
+        parent = Path(artifact.file_path).parent
+        complex_name = parent.name if parent != result_dir else None
+        key = (complex_name, rank)
+        if key not in best or (best[key][1] is None and confidence is not None):
+            best[key] = (artifact, confidence)
+    return [
+        models.DockingPose(
+            job_id=job.id,
+            artifact_id=artifact.id,
+            complex_name=complex_name,
+            ligand=ligands.get(complex_name),
+            rank=rank,
+            confidence=confidence,
+        )
+        for (complex_name, rank), (artifact, confidence) in sorted(best.items(), key=lambda item: (item[0][0] or "", item[0][1]))
+    ]
+
+
+async def analyze_poses(db: AsyncSession, job: models.Job, directory: Path) -> None:
+    await db.flush()
+    artifacts = (
+        await db.scalars(
+            select(models.Artifact).where(models.Artifact.job_id == job.id, models.Artifact.file_name.ilike("rank%.sdf"))
+        )
+    ).all()
+    await db.execute(delete(models.DockingPose).where(models.DockingPose.job_id == job.id))
+    db.add_all(pose_rows(job, list(artifacts)))
+
+
+@dataclass
+class Ligand:
+    elements: list[str]
+    coords: np.ndarray
+    bonds: list[tuple[int, int]]
+
+
+def read_ligand(path: Path) -> Ligand:
+    """Heavy atoms and bonds of the first molecule of a V2000 SDF."""
+    lines = path.read_text(errors="replace").splitlines()
+    if len(lines) < 4 or "V3000" in lines[3]:
+        raise ValueError(f"{path.name}: only V2000 molfiles are supported")
+    atom_count, bond_count = int(lines[3][:3]), int(lines[3][3:6])
+    elements, coords, index = [], [], {}
+    for number, line in enumerate(lines[4 : 4 + atom_count], start=1):
+        element = line[31:34].strip().upper()
+        if element in {"H", "D"}:
+            continue
+        index[number] = len(elements)
+        elements.append(element)
+        coords.append((float(line[0:10]), float(line[10:20]), float(line[20:30])))
+    bonds = []
+    for line in lines[4 + atom_count : 4 + atom_count + bond_count]:
+        first, second = int(line[0:3]), int(line[3:6])
+        if first in index and second in index:
+            bonds.append((index[first], index[second]))
+    return Ligand(elements=elements, coords=np.asarray(coords, dtype=np.float64).reshape(-1, 3), bonds=bonds)
+
+
+def automorphisms(elements: list[str], bonds: list[tuple[int, int]], limit: int = MAX_AUTOMORPHISMS) -> np.ndarray:
+    """Atom permutations that map the molecular graph onto itself (identity first), capped at ``limit``."""
+    count = len(elements)
+    neighbours: list[set[int]] = [set() for _ in range(count)]
+    for first, second in bonds:
+        neighbours[first].add(second)
+        neighbours[second].add(first)
+    # refine (element, degree) classes by neighbour classes until stable
+    labels = _relabel([(element, len(neighbours[atom])) for atom, element in enumerate(elements)])
+    while True:
+        refined = _relabel([(labels[atom], tuple(sorted(labels[n] for n in neighbours[atom]))) for atom in range(count)])
+        if len(set(refined)) == len(set(labels)):
+            break
+        labels = refined
+    members: dict[int, list[int]] = {}
+    for atom, label in enumerate(labels):
+        members.setdefault(label, []).append(atom)
+    order = _search_order(labels, members, neighbours)
+    mapping = [-1] * count
+    used = [False] * count
+    found: list[list[int]] = []
+    steps = 0
+
+    def extend(depth: int) -> None:
+        nonlocal steps
+        steps += 1
+        if len(found) >= limit or steps > MAX_SEARCH_STEPS:
+            return
+        if depth == count:
+            found.append(mapping.copy())
+            return
+        atom = order[depth]
+        mapped = [mapping[n] for n in neighbours[atom] if mapping[n] >= 0]
+        for candidate in members[labels[atom]]:
+            if used[candidate] or not all(m in neighbours[candidate] for m in mapped):
+                continue
+            if sum(used[n] for n in neighbours[candidate]) != len(mapped):
+                continue
+            mapping[atom], used[candidate] = candidate, True
+            extend(depth + 1)
+            mapping[atom], used[candidate] = -1, False
+
+    extend(0)
+    identity = list(range(count))
+    perms = [identity] + [perm for perm in found if perm != identity]
+    return np.asarray(perms[:limit], dtype=np.intp).reshape(-1, count)
+
+
+def _relabel(signatures: list) -> list[int]:
+    ids = {signature: number for number, signature in enumerate(sorted(set(signatures)))}
+    return [ids[signature] for signature in signatures]
+
+
+def _search_order(labels: list[int], members: dict[int, list[int]], neighbours: list[set[int]]) -> list[int]:
+    # breadth-first from the rarest class so every atom after the first has a mapped neighbour to prune on
+    order: list[int] = []
+    seen: set[int] = set()
+    for start in sorted(range(len(labels)), key=lambda atom: (len(members[labels[atom]]), atom)):
+        if start in seen:
+            continue
+        queue = deque([start])
+        seen.add(start)
+        while queue:
+            atom = queue.popleft()
+            order.append(atom)
+            for neighbour in sorted(neighbours[atom]):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+    return order
+
+
+def rmsd_matrix(coords: np.ndarray, perms: np.ndarray) -> np.ndarray:
+    """Pairwise in-place RMSD of ``coords`` (poses x atoms x 3), minimised over the atom permutations ``perms``.
+
+    |x - Py|^2 = |x|^2 + |y|^2 - 2 x.Py, so every pose/permutation pair reduces to one matrix product.
+    """
+    poses, atoms, _ = coords.shape
+    flat = coords.reshape(poses, atoms * 3)
+    squared = np.einsum("ij,ij->i", flat, flat)
+    permuted = coords[:, perms].transpose(1, 0, 2, 3).reshape(len(perms) * poses, atoms * 3)
+    cross = (flat @ permuted.T).reshape(poses, len(perms), poses).max(axis=1)
+    distance = (squared[:, None] + squared[None, :] - 2 * cross) / atoms
+    distance = np.sqrt(np.clip(distance, 0, None))
+    distance = np.minimum(distance, distance.T)
+    np.fill_diagonal(distance, 0)
+    return distance
+
+
+def cluster_poses(distance: np.ndarray, threshold: float) -> list[tuple[int, list[int], float]]:
+    """Leader clustering over poses already sorted best-first: (leader, members, max RMSD to leader)."""
+    assigned = np.zeros(len(distance), dtype=bool)
+    clusters = []
+    for leader in range(len(distance)):
+        if assigned[leader]:
+            continue
+        members = np.flatnonzero(~assigned & (distance[leader] <= threshold))
+        assigned[members] = True
+        clusters.append((leader, members.tolist(), float(distance[leader, members].max())))
+    return clusters
+
+
+def complex_rmsd(paths: list[Path], cache_key: list[int]) -> np.ndarray:
+    """RMSD matrix for one complex, cached next to its poses and keyed by the pose ids it was built from."""
+    cache = paths[0].parent / ANALYSIS_DIR / "pose_rmsd.npz"
+    key = np.asarray(cache_key, dtype=np.int64)
+    if cache.exists():
+        try:
+            with np.load(cache) as cached:
+                if np.array_equal(cached["pose_ids"], key):
+                    return cached["rmsd"]
+        except (OSError, ValueError, KeyError):
+            pass
+    ligands = [read_ligand(path) for path in paths]
+    reference = ligands[0]
+    for path, ligand in zip(paths, ligands):
+        if ligand.elements != reference.elements:
+            raise ValueError(f"{path.name} does not match the atoms of {paths[0].name}")
+    perms = automorphisms(reference.elements, reference.bonds)
+    distance = rmsd_matrix(np.stack([ligand.coords for ligand in ligands]), perms)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    with cache.open("wb") as handle:
+        np.savez(handle, pose_ids=key, rmsd=distance.astype(np.float32))
+    return distance
+
+
+def _cluster_rows(
+    job_id: str, poses: list[tuple[models.DockingPose, str]], threshold: float
+) -> list[models.PoseCluster]:
+    by_complex: dict[str | None, list[tuple[models.DockingPose, str]]] = {}
+    for pose, path in sorted(poses, key=lambda item: item[0].rank):
+        by_complex.setdefault(pose.complex_name, []).append((pose, path))
+    rows = []
+    for complex_name, items in by_complex.items():
+        try:
+            distance = complex_rmsd([Path(path) for _, path in items], [pose.id for pose, _ in items])
+        except (OSError, ValueError) as exc:
+            print(f"[poses] skipping clustering for {complex_name}: {exc}")
+            continue
+        for number, (leader, members, max_rmsd) in enumerate(cluster_poses(distance, threshold)):
+            member_poses = [items[member][0] for member in members]
+            confidences = [pose.confidence for pose in member_poses if pose.confidence is not None]
+            rows.append(
+                models.PoseCluster(
+                    job_id=job_id,
+                    complex_name=complex_name,
+                    threshold=threshold,
+                    cluster_index=number,
+                    representative_pose_id=items[leader][0].id,
+                    size=len(members),
+                    member_ranks=[pose.rank for pose in member_poses],
+                    best_confidence=max(confidences) if confidences else None,
+                    max_rmsd=round(max_rmsd, 3),
+                )
+            )
+    return rows
+
+
+async def cluster_job_poses(db: AsyncSession, job_id: str, threshold: float) -> list[models.PoseCluster]:
+    """Cluster every complex of a job at ``threshold``; replaces earlier clusters at the same threshold."""
+    poses = (
+        await db.execute(
+            select(models.DockingPose, models.Artifact.file_path)
+            .join(models.Artifact, models.Artifact.id == models.DockingPose.artifact_id)
+            .where(models.DockingPose.job_id == job_id)
+        )
+    ).all()
+    rows = await asyncio.to_thread(_cluster_rows, job_id, [(pose, path) for pose, path in poses], threshold)
+    await db.execute(
+        delete(models.PoseCluster).where(models.PoseCluster.job_id == job_id, models.PoseCluster.threshold == threshold)
+    )
+    db.add_all(rows)
+    await db.flush()
+    return rows
+
+
+async def analyze_pose_clusters(db: AsyncSession, job: models.Job, directory: Path) -> None:
+    await db.flush()
+    await db.execute(delete(models.PoseCluster).where(models.PoseCluster.job_id == job.id))
+    await cluster_job_poses(db, job.id, get_settings().pose_cluster_rmsd)
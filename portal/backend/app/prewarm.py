@@ -0,0 +1,167 @@
+﻿from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import func, select
+
+from . import models
+from .config import get_settings
+from .database import AsyncSessionLocal
+from .endpoints import endpoint_pool
+from .metrics import PREWARM_LATENCY_SECONDS, PREWARM_REQUESTS
+from .runpod import PIPELINES, RunpodClient, pipeline_endpoints
+
+settings = get_settings()
+
+PRELOAD_TERMINAL = {"COMPLETED", "FAILED", "TIMED_OUT", "CANCELLED", "COMPLETED_WITH_ERRORS"}
+
+
+@dataclass
+class PreloadState:
+    runpod_job_id: str | None = None
+    sent_at: float = 0.0
+    last_sent_at: float = float("-inf")
+    # preloads in a row that no job followed; each doubles the cooldown
+    wasted: int = 0
+
+    def cooldown(self) -> float:
+        return min(settings.prewarm_cooldown_seconds * 2**self.wasted, settings.prewarm_max_cooldown_seconds)
+
+
+async def expected_jobs(pipeline: str, now: datetime) -> float:
+    """Average jobs created in this hour-of-week over the recent history window."""
+    weeks = settings.prewarm_history_weeks
+    windows = [now - timedelta(weeks=week) for week in range(1, weeks + 1)]
+    async with AsyncSessionLocal() as db:
+        total = 0
+        for start in windows:
+            hour_start = start.replace(minute=0, second=0, microsecond=0)
+            total += await db.scalar(
+                select(func.count()).where(
+                    models.Job.pipeline == pipeline,
+                    models.Job.created_at >= hour_start,
+                    models.Job.created_at < hour_start + timedelta(hours=1),
+                )
+            )
+    return total / weeks
+
+
+class PrewarmController:
+    """Sends ``preload`` to endpoints ahead of demand so the first job skips the database load."""
+
+    def __init__(self) -> None:
+        self._stop = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.client: RunpodClient | None = None
+        self.states: dict[str, PreloadState] = {}
+
+    def start(self) -> None:
+        if not settings.prewarm_enabled:
+            return
+        if self.task is None or self.task.done():
+            self._stop.clear()
+            self.task = asyncio.create_task(self._run(), name="prewarm")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self.task:
+            with suppress(asyncio.TimeoutError, asyncio.CancelledError):
+                await asyncio.wait_for(self.task, timeout=5)
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def _run(self) -> None:
+        try:
+            self.client = RunpodClient()
+        except RuntimeError as exc:
+            print(f"[prewarm] RunPod client disabled: {exc}")
+            return
+        while not self._stop.is_set():
+            try:
+                await self.tick()
+            except Exception as exc:  # noqa: BLE001
+                print(f"[prewarm] error: {exc}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stop.wait(), settings.prewarm_interval_seconds)
+
+    async def tick(self) -> None:
+        assert self.client is not None
+        for key, pipeline in PIPELINES.items():
+            if not pipeline.supports_preload:
+                continue
+            try:
+                endpoint_ids = pipeline_endpoints(key)
+            except RuntimeError:
+                continue
+            waiting, preset = await self._queued_demand(key)
+            predicted = await expected_jobs(key, datetime.utcnow())
+            if not waiting and predicted < settings.prewarm_min_expected_jobs:
+                continue
+            await endpoint_pool.capacity(self.client, endpoint_ids)
+            for endpoint_id in endpoint_ids:
+                await self._track_preload(endpoint_id)
+                if waiting:
+                    await self._maybe_preload(endpoint_id, preset, "queued", demand_confirmed=True)
+                elif predicted >= settings.prewarm_min_expected_jobs:
+                    await self._maybe_preload(endpoint_id, preset, "predicted", demand_confirmed=False)
+
+    async def _queued_demand(self, pipeline: str) -> tuple[int, str]:
+        async with AsyncSessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(models.Job.parameters).where(
+                        models.Job.pipeline == pipeline,
+                        models.Job.status.in_(["pending", "submitted", "queued", "in_queue"]),
+                    )
+                )
+            ).scalars().all()
+        presets = Counter((parameters or {}).get("db_preset") or settings.prewarm_default_preset for parameters in rows)
+        preset = presets.most_common(1)[0][0] if presets else settings.prewarm_default_preset
+        return len(rows), preset
+
+    async def _maybe_preload(self, endpoint_id: str, preset: str, reason: str, demand_confirmed: bool) -> None:
+        assert self.client is not None
+        state = self.states.setdefault(endpoint_id, PreloadState())
+        if demand_confirmed:
+            state.wasted = 0
+        endpoint = endpoint_pool.state(endpoint_id)
+        if not endpoint.cold or endpoint.circuit_open or state.runpod_job_id:
+            return
+        if time.monotonic() - state.last_sent_at < state.cooldown():
+            return
+        try:
+            state.runpod_job_id = await self.client.submit(endpoint_id, {"action": "preload", "preset": preset})
+        except httpx.HTTPError as exc:
+            print(f"[prewarm] preload failed for {endpoint_id}: {exc}")
+            return
+        state.sent_at = state.last_sent_at = time.monotonic()
+        if not demand_confirmed:
+            state.wasted += 1
+        PREWARM_REQUESTS.labels(endpoint=endpoint_id, reason=reason).inc()
+        print(f"[prewarm] preload ({preset}) sent to {endpoint_id}: {reason} demand")
+
+    async def _track_preload(self, endpoint_id: str) -> None:
+        assert self.client is not None
+        state = self.states.get(endpoint_id)
+        if not state or not state.runpod_job_id:
+            return
+        try:
+            response = await self.client.status(endpoint_id, state.runpod_job_id)
+        except httpx.HTTPError:
+            return
+        status = response.get("status") or response.get("state")
+        if status not in PRELOAD_TERMINAL:
+            return
+        if status == "COMPLETED":
+            PREWARM_LATENCY_SECONDS.labels(endpoint=endpoint_id).observe(time.monotonic() - state.sent_at)
+        state.runpod_job_id = None
+
+
+prewarm = PrewarmController()
@@ -0,0 +1,129 @@
+﻿from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextvars import ContextVar
+from dataclasses import dataclass
+from uuid import uuid4
+
+from fastapi import Request
+from prometheus_client import Histogram
+from sqlalchemy import event
+
+from .cache import TTLCache
+from .config import get_settings
+from .database import engine
+
+settings = get_settings()
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Request latency per route template.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+PROFILE_HEADER = "x-profile"
+# (owning user id, collapsed-stack profile), downloadable by that user for a while after the request
+profiles: TTLCache[tuple[int | None, str]] = TTLCache(maxsize=64, ttl=3600)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+
+_query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany) -> None:
+    started = conn.info["query_started"].pop()
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - started
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval and folds the results.
+
+    Request profiles sample the event-loop thread. Other requests running on the loop at the same
+    time show up in the profile, and work handed to the threadpool (``run_in_threadpool``,
+    ``asyncio.to_thread``) does not; its time appears only as the awaiting frame.
+    """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: StackCounter[str] = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: list[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+def _wants_profile(request: Request) -> bool:
+    if settings.profile_all_requests:
+        return True
+    return settings.profiling_enabled and request.headers.get(PROFILE_HEADER) == "1"
+
+
+async def profiling_middleware(request: Request, call_next):
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    sampler = None
+    if _wants_profile(request):
+        sampler = StackSampler(threading.get_ident(), settings.profile_interval_ms / 1000)
+        sampler.start()
+    start = time.perf_counter()
+    status_code = 500
+    profile = None
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        if sampler:
+            # stopped even when the handler raised, or the sampling thread would outlive the request
+            profile = sampler.stop()
+        elapsed = time.perf_counter() - start
+        _query_stats.reset(token)
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_SECONDS.labels(method=request.method, route=route_path, status=str(status_code)).observe(elapsed)
+        if elapsed * 1000 >= settings.slow_request_ms:
+            print(
+                f"[slow-request] {request.method} {route_path} status={status_code} "
+                f"time={elapsed * 1000:.1f}ms db_queries={stats.count} db_time={stats.seconds * 1000:.1f}ms"
+            )
+    response.headers["X-DB-Queries"] = str(stats.count)
+    if profile is not None:
+        profile_id = uuid4().hex
+        profiles.set(profile_id, (getattr(request.state, "user_id", None), profile))
+        response.headers["X-Profile-Id"] = profile_id
+    return response
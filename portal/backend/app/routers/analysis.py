@@ -0,0 +1,317 @@
+﻿from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Literal
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+
+from .. import models
+from ..auth import get_current_user
+from ..comparison import MatchMode, compare, load_trace, trace_from_bytes
+from ..config import get_settings
+from ..confidence import decode_pae, decode_plddt, decode_residue_numbers
+from ..database import get_db
+from ..phastest import cgview_document
+from ..poses import cluster_job_poses
+from ..schemas import DockingPoseRead, ModelConfidenceRead, PoseClusterRead
+from ..serializers import json_rows, schema_columns
+from ..tracing import span
+
+router = APIRouter(prefix="/api/analysis", tags=["analysis"])
+
+MAX_COMPARE_STRUCTURES = 200
+
+CONFIDENCE_COLUMNS = schema_columns(ModelConfidenceRead, models.ModelConfidence)
+POSE_COLUMNS = schema_columns(DockingPoseRead, models.DockingPose)
+
+CONFIDENCE_SORT = {
+    "mean_plddt": models.ModelConfidence.mean_plddt,
+    "ranking_score": models.ModelConfidence.ranking_score,
+    "confident_fraction": models.ModelConfidence.confident_fraction,
+}
+
+
+@router.get("/confidence", response_model=List[ModelConfidenceRead])
+async def rank_models(
+    sort: Literal["mean_plddt", "ranking_score", "confident_fraction"] = "mean_plddt",
+    best_only: bool = True,
+    min_plddt: float | None = Query(None, ge=0, le=100),
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    query = (
+        select(*CONFIDENCE_COLUMNS, models.Job.title.label("job_title"))
+        .join(models.Job, models.Job.id == models.ModelConfidence.job_id)
+        .where(models.Job.user_id == current_user.id)
+    )
+    if best_only:
+        query = query.where(models.ModelConfidence.rank == 0)
+    if min_plddt is not None:
+        query = query.where(models.ModelConfidence.mean_plddt >= min_plddt)
+    column = CONFIDENCE_SORT[sort]
+    query = query.order_by(column.is_(None), column.desc(), models.ModelConfidence.id).limit(limit).offset(offset)
+    return json_rows((await db.execute(query)).mappings())
+
+
+@router.get("/jobs/{job_id}/confidence", response_model=List[ModelConfidenceRead])
+async def job_confidence(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    await _get_job_or_404(db, current_user.id, job_id)
+    rows = await db.scalars(
+        select(models.ModelConfidence)
+        .where(models.ModelConfidence.job_id == job_id)
+        .order_by(models.ModelConfidence.target, models.ModelConfidence.rank)
+    )
+    return rows.all()
+
+
+@router.get("/confidence/{confidence_id}/residues")
+async def residue_confidence(
+    confidence_id: int,
+    pae: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    options = [undefer(models.ModelConfidence.plddt), undefer(models.ModelConfidence.residue_numbers)]
+    if pae:
+        options.append(undefer(models.ModelConfidence.pae))
+    row = await db.scalar(
+        select(models.ModelConfidence)
+        .options(*options)
+        .join(models.Job, models.Job.id == models.ModelConfidence.job_id)
+        .where(models.ModelConfidence.id == confidence_id, models.Job.user_id == current_user.id)
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Confidence record not found.")
+
+    def unpack() -> dict:
+        pae_matrix = decode_pae(row) if pae else None
+        return {
+            "id": row.id,
+            "modelName": row.model_name,
+            "target": row.target,
+            "chains": row.chains,
+            "residueNumbers": decode_residue_numbers(row).tolist(),
+            "plddt": decode_plddt(row).tolist(),
+            "pae": pae_matrix.tolist() if pae_matrix is not None else None,
+        }
+
+    return await run_in_threadpool(unpack)
+
+
+@router.get("/poses", response_model=List[DockingPoseRead])
+async def top_poses(
+    job_id: List[str] = Query([]),
+    complex_name: str | None = None,
+    ligand: str | None = None,
+    min_confidence: float | None = None,
+    max_rank: int | None = Query(None, ge=1),
+    sort: Literal["confidence", "rank"] = "confidence",
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Top-K poses across a screening batch (all of the caller's DiffDock jobs unless ``job_id`` narrows it)."""
+    pose = models.DockingPose
+    query = (
+        select(*POSE_COLUMNS, models.Job.title.label("job_title"))
+        .join(models.Job, models.Job.id == pose.job_id)
+        .where(models.Job.user_id == current_user.id)
+    )
+    if job_id:
+        query = query.where(pose.job_id.in_(job_id))
+    if complex_name:
+        query = query.where(pose.complex_name == complex_name)
+    if ligand:
+        query = query.where(pose.ligand == ligand)
+    if min_confidence is not None:
+        query = query.where(pose.confidence >= min_confidence)
+    if max_rank is not None:
+        query = query.where(pose.rank <= max_rank)
+    if sort == "confidence":
+        query = query.order_by(pose.confidence.is_(None), pose.confidence.desc(), pose.rank, pose.id)
+    else:
+        query = query.order_by(pose.rank, pose.confidence.is_(None), pose.confidence.desc(), pose.id)
+    return json_rows((await db.execute(query.limit(limit).offset(offset))).mappings())
+
+
+@router.get("/jobs/{job_id}/pose-clusters", response_model=List[PoseClusterRead])
+async def pose_clusters(
+    job_id: str,
+    threshold: float | None = Query(None, ge=0.25, le=10),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Distinct binding modes per complex; computed once per (job, threshold) and served from the table after."""
+    await _get_job_or_404(db, current_user.id, job_id)
+    # snap to 0.05 A so arbitrary query values cannot grow the cache without bound
+    threshold = round(round((threshold or get_settings().pose_cluster_rmsd) / 0.05) * 0.05, 2)
+    query = (
+        select(models.PoseCluster, models.DockingPose.artifact_id, models.DockingPose.rank)
+        .join(models.DockingPose, models.DockingPose.id == models.PoseCluster.representative_pose_id)
+        .where(models.PoseCluster.job_id == job_id, models.PoseCluster.threshold == threshold)
+        .order_by(models.PoseCluster.complex_name, models.PoseCluster.cluster_index)
+    )
+    rows = (await db.execute(query)).all()
+    if not rows:
+        has_poses = await db.scalar(select(models.DockingPose.id).where(models.DockingPose.job_id == job_id).limit(1))
+        if has_poses is None:
+            return []
+        await cluster_job_poses(db, job_id, threshold)
+        await db.commit()
+        rows = (await db.execute(query)).all()
+    return [
+        PoseClusterRead.model_validate(cluster, from_attributes=True).model_copy(
+            update={"representative_artifact_id": artifact_id, "representative_rank": rank}
+        )
+        for cluster, artifact_id, rank in rows
+    ]
+
+
+@router.post("/compare")
+async def compare_structures(
+    artifact_ids: List[str] = Form(default_factory=list),
+    match: MatchMode = Form("numbering"),
+    references: List[UploadFile] = File(default_factory=list),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """All-pairs superposition of structure artifacts (from any of the caller's jobs) and uploaded references."""
+    artifact_ids = list(dict.fromkeys(artifact_ids))
+    total = len(artifact_ids) + len(references)
+    if total < 2:
+        raise HTTPException(status_code=400, detail="Select at least two structures to compare.")
+    if total > MAX_COMPARE_STRUCTURES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARE_STRUCTURES} structures can be compared at once.")
+    artifacts = {
+        artifact.id: artifact
+        for artifact in await db.scalars(
+            select(models.Artifact)
+            .join(models.Job, models.Job.id == models.Artifact.job_id)
+            .where(
+                models.Artifact.id.in_(artifact_ids),
+                models.Artifact.kind == "structure",
+                models.Job.user_id == current_user.id,
+            )
+        )
+    }
+    missing = [artifact_id for artifact_id in artifact_ids if artifact_id not in artifacts]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Structure artifacts not found: {', '.join(missing)}")
+    uploads = [(upload.filename or "reference.pdb", await upload.read()) for upload in references]
+    items = [
+        {"artifactId": artifact.id, "jobId": artifact.job_id, "fileName": artifact.file_name}
+        for artifact in (artifacts[artifact_id] for artifact_id in artifact_ids)
+    ] + [{"reference": name} for name, _ in uploads]
+
+    def run() -> dict:
+        traces = [load_trace(Path(artifacts[artifact_id].file_path)) for artifact_id in artifact_ids]
+        traces += [trace_from_bytes(data, name) for name, data in uploads]
+        return compare(traces, match)
+
+    with span("analysis.compare", structures=total, match=match):
+        try:
+            result = await run_in_threadpool(run)
+        except (OSError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"Could not read structure: {exc}") from exc
+    return {"items": items, **result}
+
+
+@router.get("/jobs/{job_id}/phage")
+async def phage_genomes(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    await _get_job_or_404(db, current_user.id, job_id)
+    genomes = (
+        await db.scalars(select(models.PhageGenome).where(models.PhageGenome.job_id == job_id).order_by(models.PhageGenome.sample))
+    ).all()
+    regions = (
+        await db.scalars(
+            select(models.PhageRegion)
+            .where(models.PhageRegion.job_id == job_id)
+            .order_by(models.PhageRegion.sample, models.PhageRegion.start)
+        )
+    ).all()
+    return [
+        {
+            "sample": genome.sample,
+            "sequenceLength": genome.sequence_length,
+            "geneCount": genome.gene_count,
+            "regions": [
+                {
+                    "region": region.region_number,
+                    "start": region.start,
+                    "stop": region.stop,
+                    "completeness": region.completeness,
+                    "score": region.score,
+                    "gcPercent": region.gc_percent,
+                    "geneCount": region.gene_count,
+                    "phageGeneCount": region.phage_gene_count,
+                }
+                for region in regions
+                if region.sample == genome.sample
+            ],
+        }
+        for genome in genomes
+    ]
+
+
+GENE_COLUMNS = ("start", "stop", "strand", "type", "name", "source", "region_label")
+
+
+@router.get("/jobs/{job_id}/phage/features")
+async def phage_features(
+    job_id: str,
+    sample: str | None = None,
+    start: int | None = Query(None, ge=0),
+    end: int | None = Query(None, ge=0),
+    source: str | None = None,
+    format: Literal["columns", "cgview"] = "columns",
+    limit: int = Query(20000, ge=1, le=200000),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Genes overlapping ``[start, end]`` of one sample, as column arrays or a CGView document."""
+    await _get_job_or_404(db, current_user.id, job_id)
+    genome_query = select(models.PhageGenome).where(models.PhageGenome.job_id == job_id)
+    if sample is not None:
+        genome_query = genome_query.where(models.PhageGenome.sample == sample)
+    genome = await db.scalar(genome_query.order_by(models.PhageGenome.sample).limit(1))
+    if not genome:
+        raise HTTPException(status_code=404, detail="No PHASTEST report indexed for this job.")
+    gene = models.PhageGene
+    query = select(*(getattr(gene, column) for column in GENE_COLUMNS)).where(
+        gene.job_id == job_id, gene.sample == genome.sample
+    )
+    if end is not None:
+        query = query.where(gene.start <= end)
+    if start is not None:
+        # genes are at most max_gene_length long, which turns the overlap test into an index range on start
+        query = query.where(gene.start >= start - genome.max_gene_length, gene.stop >= start)
+    if source:
+        query = query.where(gene.source == source.capitalize())
+    rows = (await db.execute(query.order_by(gene.start, gene.stop).limit(limit + 1))).all()
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    if format == "cgview":
+        return cgview_document(genome.sequence_length, rows)
+    return {
+        "sample": genome.sample,
+        "sequenceLength": genome.sequence_length,
+        "start": start,
+        "end": end,
+        "count": len(rows),
+        "truncated": truncated,
+        "columns": {column: [row[index] for row in rows] for index, column in enumerate(GENE_COLUMNS)},
+    }
+
+
+async def _get_job_or_404(db: AsyncSession, user_id: int, job_id: str) -> models.Job:
+    job = await db.scalar(select(models.Job).where(models.Job.id == job_id, models.Job.user_id == user_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
@@ -2,10 +2,11 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import models
-from ..auth import authenticate_user, create_access_token, hash_password
+from ..auth import authenticate_user, create_access_token, hash_password_async
 from ..database import get_db
 from ..schemas import Token, UserCreate, UserRead
 
@@ -13,20 +14,20 @@ router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
 @router.post("/register", response_model=UserRead)
-def register(payload: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(models.User).filter(models.User.username == payload.username).first()
+async def register(payload: UserCreate, db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(select(models.User).where(models.User.username == payload.username))
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists.")
-    user = models.User(username=payload.username, password_hash=hash_password(payload.password))
+    user = models.User(username=payload.username, password_hash=await hash_password_async(payload.password))
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     return user
 
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials.")
     access_token = create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=60 * 12))
@@ -1,37 +1,76 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import json
+import zipfile
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, List, Literal
+from uuid import uuid4
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from .. import models
 from ..auth import get_current_user
+from ..config import get_settings
 from ..database import get_db
-from ..runpod import PIPELINES, RunpodClient, build_pipeline_payload, pipeline_endpoint
-from ..schemas import JobRead
-from ..storage import archive_to_base64, build_archive, remove_tree, save_uploads
+from ..diffdock import group_by_protein
+from ..dispatcher import cancel_remote, close_attempt, dispatcher, request_cancel
+from ..fasta import (
+    FASTA_SUFFIXES,
+    FastaError,
+    WorkUnit,
+    balanced_batches,
+    dedupe_units,
+    iter_fasta,
+    parse_sequence_text,
+    work_units,
+)
+from ..metrics import UPLOAD_BYTES
+from ..runpod import PIPELINES, RunpodClient, input_archive_format, pipeline_endpoints
+from ..search import search_index
+from ..serializers import user_jobs_payload
+from ..schemas import JobAttemptRead, JobCancelRequest, JobRead, JobSearchHit, JobSearchResponse
+from ..structures import PREVIEW_SUFFIXES, ensure_preview
+from ..storage import ARCHIVE_SUFFIXES, build_archive, remove_tree, save_uploads, uploads_dir, write_texts
+from ..tracing import job_timeline, span
+from ..validation import error_detail, upload_names
 
 router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+settings = get_settings()
+
+BULK_CANCEL_CONCURRENCY = 8
 
 
 @router.get("", response_model=List[JobRead])
-def list_jobs(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    jobs = (
-        db.query(models.Job)
-        .filter(models.Job.user_id == current_user.id)
-        .order_by(models.Job.created_at.desc())
-        .all()
-    )
-    return jobs
+async def list_jobs(db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    return ORJSONResponse(await user_jobs_payload(db, current_user.id))
+
+
+@router.get("/search", response_model=JobSearchResponse)
+async def search_jobs(
+    q: str = Query(..., min_length=1, max_length=200),
+    pipeline: str | None = None,
+    status: str | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    filters = {key: value for key, value in {"pipeline": pipeline, "status": status}.items() if value}
+    with span("jobs.search", results_limit=limit):
+        total, capped, hits = await search_index.search(db, current_user.id, q, filters, limit, offset)
+    return JobSearchResponse(total=total, total_capped=capped, items=[JobSearchHit.model_validate(hit, from_attributes=True) for hit in hits])
 
 
 @router.get("/{job_id}", response_model=JobRead)
-def get_job(job_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    job = _get_job_or_404(db, current_user.id, job_id)
+async def get_job(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    job = await _get_job_or_404(db, current_user.id, job_id)
     return job
 
 
@@ -43,153 +82,306 @@ async def create_job(
     notes: str | None = Form(None),
     preferred_download_dir: str | None = Form(None),
     sequence: str | None = Form(None),
-    files: UploadFile | list[UploadFile] | None = File(None),
-    db: Session = Depends(get_db),
+    priority: int = Form(0, ge=-10, le=10),
+    files: list[UploadFile] = File(default_factory=list),
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    if pipeline not in PIPELINES:
-        raise HTTPException(status_code=400, detail="Unknown pipeline.")
-    try:
-        parameter_data = json.loads(parameters or "{}")
-    except json.JSONDecodeError as exc:
-        raise HTTPException(status_code=400, detail="Invalid parameter payload.") from exc
-
-    if pipeline == "diffdock":
-        jobs_payload = parameter_data.get("jobs")
-        if not isinstance(jobs_payload, list) or not jobs_payload:
-            raise HTTPException(status_code=400, detail="DiffDock jobs definition is required.")
-        for idx, item in enumerate(jobs_payload, start=1):
-            if not isinstance(item, dict):
-                raise HTTPException(status_code=400, detail=f"Invalid job entry at index {idx}.")
-            required_keys = ("complex_name", "protein_path", "ligand_description")
-            if not all(item.get(key) for key in required_keys):
-                raise HTTPException(status_code=400, detail=f"Missing required DiffDock fields in job #{idx}.")
-            ligand_type = item.get("ligand_type")
-            if ligand_type not in {"sdf", "smiles"}:
-                raise HTTPException(status_code=400, detail=f"Unsupported ligand type in job #{idx}.")
-
-    phastest_input_type = None
-    if pipeline == "phastest":
-        phastest_input_type = parameter_data.get("input_type")
-        mode = parameter_data.get("mode")
-        sample_name = parameter_data.get("sample_name")
-        if phastest_input_type not in {"fasta", "contig", "genbank"}:
-            raise HTTPException(status_code=400, detail="Invalid PHASTEST input type.")
-        if mode not in {"lite", "deep"}:
-            raise HTTPException(status_code=400, detail="Invalid PHASTEST mode.")
-        if not sample_name:
-            raise HTTPException(status_code=400, detail="Sample name is required for PHASTEST.")
-        if phastest_input_type == "genbank" and not parameter_data.get("accession"):
-            raise HTTPException(status_code=400, detail="GenBank accession is required for this mode.")
-
-    job = models.Job(
-        title=title,
-        pipeline=pipeline,
-        notes=notes,
-        preferred_download_dir=preferred_download_dir,
-        parameters=parameter_data,
-        user_id=current_user.id,
-        status="pending",
-    )
-    db.add(job)
-    db.commit()
-    db.refresh(job)
-
-    archive_payload = None
-    file_list: list[UploadFile] = []
-    if isinstance(files, list):
-        file_list = files
-    elif files:
-        file_list = [files]
-
-    if file_list:
-        saved_files = save_uploads(current_user.id, job.id, file_list)
-        archive_path = Path(saved_files[0]).parent / "inputs.tar.gz"
-        build_archive(saved_files, archive_path)
-        archive_payload = {
-            "kind": "uploaded",
-            "archive_name": "inputs.tar.gz",
-            "file_names": [path.name for path in saved_files],
-            "base64": archive_to_base64(archive_path),
-        }
-        job.input_archive_path = str(archive_path)
-
-    pipeline_meta = PIPELINES[pipeline]
-    requires_archive = pipeline_meta.requires_archive
-    if pipeline == "phastest" and phastest_input_type == "genbank":
-        requires_archive = False
-
-    if requires_archive and not archive_payload:
-        raise HTTPException(status_code=400, detail="This pipeline requires file uploads.")
-
-    endpoint_id = pipeline_endpoint(pipeline)
-    job.endpoint_id = endpoint_id
-
-    payload = build_pipeline_payload(
-        pipeline,
-        parameters=parameter_data,
-        sequence=sequence if pipeline_meta.supports_sequence else None,
-        input_archive=archive_payload,
-    )
+    # the id is fixed up front so spans opened before the row exists (validation, FASTA parsing) join its timeline
+    job_id = str(uuid4())
+    with span("create_job", job_id=job_id, pipeline=pipeline) as trace:
+        if pipeline not in PIPELINES:
+            raise HTTPException(status_code=400, detail="Unknown pipeline.")
+        try:
+            parameter_data = json.loads(parameters or "{}")
+        except json.JSONDecodeError as exc:
+            raise HTTPException(status_code=400, detail="Invalid parameter payload.") from exc
+        if not isinstance(parameter_data, dict):
+            raise HTTPException(status_code=400, detail="Parameters must be a JSON object.")
 
-    try:
-        client = RunpodClient()
-    except RuntimeError as exc:
-        raise HTTPException(status_code=500, detail=str(exc))
-    runpod_job_id = client.submit(endpoint_id, payload)
-    job.runpod_job_id = runpod_job_id
-    job.status = "submitted"
-    db.add(job)
-    db.commit()
-    db.refresh(job)
+        # FastAPI only collects every part of a multi-file form for a plain list annotation
+        file_list: list[UploadFile] = files
 
-    return job
+        pipeline_meta = PIPELINES[pipeline]
+        schema = pipeline_meta.parameters_schema
+        if schema is not None:
+            rows = parameter_data.get("jobs")
+            with span("validate_parameters", rows=len(rows) if isinstance(rows, list) else 0):
+                names = await run_in_threadpool(upload_names, file_list)
+                errors = await run_in_threadpool(schema.validate, parameter_data, names)
+            if errors:
+                raise HTTPException(status_code=400, detail=error_detail(errors))
+        phastest_input_type = parameter_data.get("input_type") if pipeline == "phastest" else None
+
+        fasta_units: list[WorkUnit] | None = None
+        if pipeline == "alphafold":
+            multimer = parameter_data.get("model_preset") == "multimer"
+            try:
+                fasta_units = await run_in_threadpool(_alphafold_units, file_list, sequence, multimer)
+            except (FastaError, UnicodeDecodeError) as exc:
+                raise HTTPException(status_code=400, detail=f"Invalid FASTA input: {exc}") from exc
+            if not fasta_units:
+                raise HTTPException(status_code=400, detail="AlphaFold jobs need a sequence or a FASTA upload.")
+            trace.set(work_units=len(fasta_units), duplicates=sum(len(unit.aliases) for unit in fasta_units))
+            if len(fasta_units) == 1 and not multimer and not any(_is_fasta(upload) for upload in file_list):
+                # a single monomer chain still goes out as a plain sequence
+                sequence = fasta_units[0].records[0].sequence
+                fasta_units = None
+            else:
+                file_list = [upload for upload in file_list if not _is_fasta(upload)]
+                sequence = None
+                # the worker folds one batch at a time; balanced batches keep GPU time per batch predictable
+                batches = balanced_batches(fasta_units, settings.alphafold_batch_residues)
+                parameter_data = {**parameter_data, "batches": [[unit.file_name for unit in batch] for batch in batches]}
+
+        requires_archive = pipeline_meta.requires_archive
+        if pipeline == "phastest" and phastest_input_type == "genbank":
+            requires_archive = False
+
+        # every rejection happens before the row is written; a committed "pending" job is picked up by the dispatcher
+        if requires_archive and not (file_list or fasta_units):
+            raise HTTPException(status_code=400, detail="This pipeline requires file uploads.")
+        if not settings.runpod_api_key:
+            raise HTTPException(status_code=500, detail="RUNPOD_API_KEY is required.")
+
+        try:
+            pipeline_endpoints(pipeline)
+        except RuntimeError as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+
+        job = models.Job(
+            id=job_id,
+            title=title,
+            pipeline=pipeline,
+            notes=notes,
+            preferred_download_dir=preferred_download_dir,
+            parameters=parameter_data,
+            user_id=current_user.id,
+            status="pending",
+            priority=priority,
+        )
+
+        # anything failing from here on would leave the upload folder behind without a job row to own it
+        try:
+            if file_list or fasta_units:
+                with span("save_uploads", files=len(file_list)) as upload_span:
+                    saved_files = await run_in_threadpool(save_uploads, current_user.id, job.id, file_list)
+                    if fasta_units:
+                        unit_files = {unit.file_name: unit.to_fasta() for unit in fasta_units}
+                        saved_files += await run_in_threadpool(write_texts, current_user.id, job.id, unit_files)
+                    upload_bytes = sum(path.stat().st_size for path in saved_files)
+                    upload_span.set(bytes=upload_bytes)
+                UPLOAD_BYTES.labels(pipeline=pipeline).observe(upload_bytes)
+                if pipeline == "diffdock":
+                    with span("group_proteins", pairs=len(parameter_data["jobs"])) as group_span:
+                        try:
+                            grouped = await run_in_threadpool(
+                                group_by_protein, parameter_data["jobs"], saved_files, Path(saved_files[0]).parent
+                            )
+                        except zipfile.BadZipFile as exc:
+                            raise HTTPException(status_code=400, detail=f"Uploaded zip could not be read: {exc}") from exc
+                        group_span.set(proteins=len(grouped.groups))
+                    saved_files = grouped.files
+                    job.parameters = {**parameter_data, "jobs": grouped.jobs, "protein_groups": grouped.groups}
+                codec, level = input_archive_format(pipeline)
+                archive_path = Path(saved_files[0]).parent / f"inputs{ARCHIVE_SUFFIXES[codec]}"
+                with span("build_archive", codec=codec) as archive_span:
+                    await run_in_threadpool(build_archive, saved_files, archive_path, codec, level)
+                    archive_span.set(bytes=archive_path.stat().st_size)
+                job.input_archive_path = str(archive_path)
+                job.input_files = [path.name for path in saved_files]
+
+            # the job stays "pending" in the local queue; the dispatcher picks an endpoint once one has room
+            job.sequence = sequence if pipeline_meta.supports_sequence else None
+            db.add(job)
+            await db.commit()
+        except Exception:
+            await run_in_threadpool(remove_tree, uploads_dir(current_user.id, job_id))
+            raise
+        dispatcher.wake()
+
+        return await _get_job_or_404(db, current_user.id, job.id)
 
 
 @router.get("/{job_id}/download")
-def download_archive(job_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    job = _get_job_or_404(db, current_user.id, job_id)
+async def download_archive(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    job = await _get_job_or_404(db, current_user.id, job_id)
     if not job.result_archive:
         raise HTTPException(status_code=404, detail="Results are not ready yet.")
     return FileResponse(job.result_archive, filename=Path(job.result_archive).name)
 
 
+@router.get("/{job_id}/attempts", response_model=List[JobAttemptRead])
+async def list_attempts(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    await _get_job_or_404(db, current_user.id, job_id)
+    attempts = await db.scalars(
+        select(models.JobAttempt).where(models.JobAttempt.job_id == job_id).order_by(models.JobAttempt.number)
+    )
+    return attempts.all()
+
+
+@router.get("/{job_id}/trace")
+async def get_job_trace(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    await _get_job_or_404(db, current_user.id, job_id)
+    # falls back to scanning the JSONL export, so keep it off the event loop
+    return {"jobId": job_id, "spans": await run_in_threadpool(job_timeline, job_id)}
+
+
+@router.post("/cancel")
+async def cancel_jobs(
+    payload: JobCancelRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    jobs = (
+        await db.scalars(
+            select(models.Job).where(models.Job.id.in_(payload.job_ids), models.Job.user_id == current_user.id)
+        )
+    ).all()
+    found = {job.id for job in jobs}
+    # jobs already finished (including already cancelled) are left alone and reported as unchanged
+    active = {job.id for job in jobs if job.status in models.ACTIVE_STATUSES}
+    semaphore = asyncio.Semaphore(BULK_CANCEL_CONCURRENCY)
+
+    async def cancel_one(client: RunpodClient | None, job: models.Job) -> bool:
+        async with semaphore:
+            return await cancel_remote(client, job)
+
+    async with _runpod_client() as client:
+        outcomes = await asyncio.gather(*(cancel_one(client, job) for job in jobs))
+    # the session is not safe for concurrent use, so attempt rows are closed afterwards
+    for job in jobs:
+        if job.id in active and job.status == "cancelled" and job.runpod_job_id:
+            await close_attempt(db, job, job.status)
+    await db.commit()
+    return {
+        "cancelled": [job.id for job, ok in zip(jobs, outcomes) if ok and job.id in active],
+        "cancelling": [job.id for job, ok in zip(jobs, outcomes) if not ok],
+        "unchanged": [job.id for job in jobs if job.id not in active],
+        "notFound": [job_id for job_id in payload.job_ids if job_id not in found],
+    }
+
+
+@router.post("/{job_id}/cancel", response_model=JobRead)
+async def cancel_job(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    job = await _get_job_or_404(db, current_user.id, job_id)
+    async with _runpod_client() as client:
+        # on failure the job stays "cancelling" and the monitor keeps retrying /cancel
+        await request_cancel(db, client, job)
+    await db.commit()
+    return job
+
+
 @router.delete("/{job_id}")
-def delete_job(job_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    job = _get_job_or_404(db, current_user.id, job_id)
+async def delete_job(job_id: str, db: AsyncSession = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    job = await _get_job_or_404(db, current_user.id, job_id)
+    if job.status in models.ACTIVE_STATUSES:
+        async with _runpod_client() as client:
+            cancelled = await request_cancel(db, client, job)
+        await db.commit()
+        if not cancelled:
+            raise HTTPException(
+                status_code=502,
+                detail=(
+                    "Could not cancel the RunPod job. Cancellation keeps being retried in the background; "
+                    "delete the job again once it shows as cancelled."
+                ),
+            )
     if job.result_dir:
-        remove_tree(Path(job.result_dir))
+        await run_in_threadpool(remove_tree, Path(job.result_dir))
     if job.input_archive_path:
         archive_path = Path(job.input_archive_path)
         if archive_path.exists():
-            remove_tree(archive_path)
+            await run_in_threadpool(remove_tree, archive_path)
         uploads_dir = archive_path.parent
         if uploads_dir.exists():
-            remove_tree(uploads_dir)
-    db.delete(job)
-    db.commit()
+            await run_in_threadpool(remove_tree, uploads_dir)
+    await db.delete(job)
+    await db.commit()
     return {"ok": True}
 
 
 @router.get("/{job_id}/artifacts/{artifact_id}")
-def download_artifact(
+async def download_artifact(
+    job_id: str,
+    artifact_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    artifact = await _get_artifact_or_404(db, current_user.id, job_id, artifact_id)
+    return FileResponse(artifact.file_path, filename=artifact.file_name, media_type=artifact.mime_type or "application/octet-stream")
+
+
+@router.get("/{job_id}/artifacts/{artifact_id}/preview")
+async def artifact_preview(
     job_id: str,
     artifact_id: str,
-    db: Session = Depends(get_db),
+    lod: Literal["full", "trace", "ligand"] = "trace",
+    db: AsyncSession = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    _get_job_or_404(db, current_user.id, job_id)
-    artifact = db.query(models.Artifact).filter(models.Artifact.id == artifact_id, models.Artifact.job_id == job_id).first()
+    artifact = await _get_artifact_or_404(db, current_user.id, job_id, artifact_id)
+    if Path(artifact.file_name).suffix.lower() not in PREVIEW_SUFFIXES:
+        raise HTTPException(status_code=404, detail="No preview for this artifact type.")
+    try:
+        with span("artifact_preview", job_id=job_id, lod=lod):
+            path = await run_in_threadpool(ensure_preview, Path(artifact.file_path), lod)
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail="Artifact file is missing.") from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=f"Could not build a preview: {exc}") from exc
+    # stored pre-compressed, so it is sent as-is with a gzip content encoding
+    return FileResponse(
+        path,
+        media_type="application/vnd.runpod-portal.preview",
+        headers={"Content-Encoding": "gzip", "Cache-Control": "private, max-age=3600"},
+    )
+
+
+def _is_fasta(upload: UploadFile) -> bool:
+    return Path(upload.filename or "").suffix.lower() in FASTA_SUFFIXES
+
+
+def _alphafold_units(files: list[UploadFile], sequence: str | None, multimer: bool) -> list[WorkUnit]:
+    # every chain/complex becomes its own FASTA, and duplicate sequences are folded only once
+    units: list[WorkUnit] = []
+    if sequence and sequence.strip():
+        units.extend(work_units(parse_sequence_text(sequence), multimer=multimer, name="sequence"))
+    for upload in files:
+        if not _is_fasta(upload):
+            continue
+        lines = (line.decode("utf-8-sig") for line in upload.file)
+        units.extend(work_units(iter_fasta(lines, source=upload.filename), multimer=multimer, name=Path(upload.filename).stem))
+        upload.file.seek(0)
+    return dedupe_units(units)
+
+
+@asynccontextmanager
+async def _runpod_client() -> AsyncIterator[RunpodClient | None]:
+    try:
+        client = RunpodClient()
+    except RuntimeError:
+        yield None
+        return
+    async with client:
+        yield client
+
+
+async def _get_artifact_or_404(db: AsyncSession, user_id: int, job_id: str, artifact_id: str) -> models.Artifact:
+    await _get_job_or_404(db, user_id, job_id)
+    artifact = await db.scalar(
+        select(models.Artifact).where(models.Artifact.id == artifact_id, models.Artifact.job_id == job_id)
+    )
     if not artifact:
         raise HTTPException(status_code=404, detail="Artifact not found.")
-    return FileResponse(artifact.file_path, filename=artifact.file_name, media_type=artifact.mime_type or "application/octet-stream")
+    return artifact
 
 
-def _get_job_or_404(db: Session, user_id: int, job_id: str) -> models.Job:
-    job = (
-        db.query(models.Job)
-        .filter(models.Job.id == job_id, models.Job.user_id == user_id)
-        .first()
+async def _get_job_or_404(db: AsyncSession, user_id: int, job_id: str) -> models.Job:
+    job = await db.scalar(
+        select(models.Job)
+        .options(selectinload(models.Job.artifacts))
+        .where(models.Job.id == job_id, models.Job.user_id == user_id)
     )
     if not job:
         raise HTTPException(status_code=404, detail="Job not found.")
@@ -1,7 +1,10 @@
-﻿from fastapi import APIRouter
+﻿from fastapi import APIRouter, Depends
 
+from .. import models
+from ..auth import get_current_user
 from ..config import get_settings
-from ..runpod import PIPELINES
+from ..endpoints import endpoint_pool
+from ..runpod import PIPELINES, pipeline_endpoints
 
 router = APIRouter(prefix="/api/pipelines", tags=["pipelines"])
 settings = get_settings()
@@ -20,9 +23,21 @@ def list_pipelines():
                 "supportsSequence": pipeline.supports_sequence,
                 "requiresArchive": pipeline.requires_archive,
                 "previewKind": pipeline.preview_kind,
+                "maxAttempts": pipeline.retry.max_attempts,
                 "inputFields": [field.__dict__ for field in pipeline.input_fields],
             }
             for pipeline in PIPELINES.values()
         ],
     }
 
+
+@router.get("/endpoints")
+def list_endpoints(current_user: models.User = Depends(get_current_user)):
+    pools = {}
+    for key in PIPELINES:
+        try:
+            endpoint_ids = pipeline_endpoints(key)
+        except RuntimeError:
+            endpoint_ids = []
+        pools[key] = [endpoint_pool.state(endpoint_id).as_dict() for endpoint_id in endpoint_ids]
+    return {"pipelines": pools}
@@ -1,5 +1,4 @@
 ﻿from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
 
 from .. import models
 from ..auth import get_current_user
@@ -10,6 +9,6 @@ router = APIRouter(prefix="/api/users", tags=["users"])
 
 
 @router.get("/me", response_model=UserRead)
-def read_me(current_user: models.User = Depends(get_current_user)):
+async def read_me(current_user: models.User = Depends(get_current_user)):
     return current_user
 
@@ -1,11 +1,17 @@
 ﻿from __future__ import annotations
 
+import time
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any, Dict
 
 import httpx
 
 from .config import get_settings
+from .metrics import RUNPOD_REQUEST_ERRORS, RUNPOD_REQUEST_SECONDS
+from .storage import archive_codec
+from .tracing import span
+from .validation import DIFFDOCK_SCHEMA, PHASTEST_SCHEMA, ParameterSchema
 
 RUNPOD_BASE = "https://api.runpod.ai/v2"
 settings = get_settings()
@@ -22,6 +28,19 @@ class InputField:
     helper: str | None = None
 
 
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    backoff_seconds: float = 60
+    backoff_multiplier: float = 2
+    max_backoff_seconds: float = 1800
+    retry_on: frozenset[str] = frozenset({"FAILED", "TIMED_OUT"})
+
+    def delay(self, attempt: int) -> float:
+        """Backoff before the attempt that follows ``attempt`` (1-based)."""
+        return min(self.backoff_seconds * self.backoff_multiplier ** (attempt - 1), self.max_backoff_seconds)
+
+
 @dataclass
 class PipelineDefinition:
     key: str
@@ -29,10 +48,21 @@ class PipelineDefinition:
     description: str
     endpoint_attr: str
     instructions: str
+    endpoint_pool_attr: str | None = None
     input_fields: list[InputField] = field(default_factory=list)
     supports_sequence: bool = False
     requires_archive: bool = False
     preview_kind: str = "generic"
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    # handler accepts {"action": "preload", "preset": ...} (see alphafold2/control.py)
+    supports_preload: bool = False
+    # handler is a generator that yields partial outputs ({"stage", "archives"}) read back through /stream
+    supports_stream: bool = False
+    # input archive codecs every deployed handler can unpack; ZSTD_PIPELINES adds zstd per deployment, and
+    # zstd_level then trades upload latency for payload size
+    archive_codecs: tuple[str, ...] = ("gzip",)
+    zstd_level: int = 3
+    parameters_schema: ParameterSchema | None = None
 
 
 PIPELINES: dict[str, PipelineDefinition] = {
@@ -41,6 +71,7 @@ PIPELINES: dict[str, PipelineDefinition] = {
         label="AlphaFold2",
         description="Predict protein structures and preview them in 3D.",
         endpoint_attr="alphafold_endpoint_id",
+        endpoint_pool_attr="alphafold_endpoint_ids",
         instructions="Provide a FASTA file/folder or paste the raw sequence.",
         input_fields=[
             InputField(
@@ -69,12 +100,19 @@ PIPELINES: dict[str, PipelineDefinition] = {
         ],
         supports_sequence=True,
         preview_kind="protein",
+        # runs take hours, so only one extra attempt and a longer pause for evicted workers
+        retry=RetryPolicy(max_attempts=2, backoff_seconds=300),
+        supports_preload=True,
+        supports_stream=True,
+        # a few KB of FASTA: the slow levels cost nothing
+        zstd_level=9,
     ),
     "diffdock": PipelineDefinition(
         key="diffdock",
         label="DiffDock",
         description="Run ligand docking jobs and download the ranked poses.",
         endpoint_attr="diffdock_endpoint_id",
+        endpoint_pool_attr="diffdock_endpoint_ids",
         instructions="Upload protein PDBs and ligand files (single sdf or zipped folder).",
         input_fields=[
             InputField(
@@ -95,12 +133,16 @@ PIPELINES: dict[str, PipelineDefinition] = {
         ],
         requires_archive=True,
         preview_kind="ligand",
+        parameters_schema=DIFFDOCK_SCHEMA,
+        supports_stream=True,
+        zstd_level=7,
     ),
     "phastest": PipelineDefinition(
         key="phastest",
         label="PHASTEST",
         description="Generate phage functional reports mirroring the current notebook workflow.",
         endpoint_attr="phastest_endpoint_id",
+        endpoint_pool_attr="phastest_endpoint_ids",
         instructions="Upload the genome FASTA or CSV bundle exported from the helper notebook.",
         input_fields=[
             InputField(
@@ -113,39 +155,97 @@ PIPELINES: dict[str, PipelineDefinition] = {
         ],
         requires_archive=True,
         preview_kind="phage",
+        parameters_schema=PHASTEST_SCHEMA,
+        # whole-genome FASTA is large and low-redundancy; higher levels barely shrink it
+        zstd_level=5,
     ),
 }
 
 
 class RunpodClient:
-    def __init__(self) -> None:
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None) -> None:
         if not settings.runpod_api_key:
             raise RuntimeError("RUNPOD_API_KEY is required.")
-        self.http = httpx.Client(timeout=60)
+        self.http = httpx.AsyncClient(timeout=60, transport=transport)
         self.api_key = settings.runpod_api_key
 
-    def submit(self, endpoint_id: str, payload: Dict[str, Any]) -> str:
+    async def __aenter__(self) -> "RunpodClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def submit(self, endpoint_id: str, payload: Dict[str, Any]) -> str:
         url = f"{RUNPOD_BASE}/{endpoint_id}/run"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        response = self.http.post(url, headers=headers, json={"input": payload})
-        response.raise_for_status()
+        response = await self._request("run", endpoint_id, "POST", url, json={"input": payload})
         data = response.json()
         return data.get("id") or data.get("jobId")
 
-    def status(self, endpoint_id: str, job_id: str) -> Dict[str, Any]:
+    async def status(self, endpoint_id: str, job_id: str) -> Dict[str, Any]:
         url = f"{RUNPOD_BASE}/{endpoint_id}/status/{job_id}"
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        response = self.http.get(url, headers=headers)
-        response.raise_for_status()
+        response = await self._request("status", endpoint_id, "GET", url)
+        return response.json()
+
+    async def stream(self, endpoint_id: str, job_id: str) -> Dict[str, Any]:
+        """Outputs yielded since the previous call; RunPod hands each chunk out once."""
+        url = f"{RUNPOD_BASE}/{endpoint_id}/stream/{job_id}"
+        response = await self._request("stream", endpoint_id, "GET", url)
         return response.json()
 
+    async def cancel(self, endpoint_id: str, job_id: str) -> Dict[str, Any]:
+        url = f"{RUNPOD_BASE}/{endpoint_id}/cancel/{job_id}"
+        response = await self._request("cancel", endpoint_id, "POST", url)
+        return response.json()
+
+    async def health(self, endpoint_id: str) -> Dict[str, Any]:
+        url = f"{RUNPOD_BASE}/{endpoint_id}/health"
+        response = await self._request("health", endpoint_id, "GET", url)
+        return response.json()
+
+    async def _request(self, operation: str, endpoint_id: str, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        start = time.perf_counter()
+        try:
+            with span(f"runpod.{operation}", endpoint=endpoint_id) as request_span:
+                response = await self.http.request(method, url, headers=headers, **kwargs)
+                request_span.set(status_code=response.status_code, response_bytes=len(response.content))
+                response.raise_for_status()
+        except httpx.HTTPError:
+            RUNPOD_REQUEST_ERRORS.labels(operation=operation, endpoint=endpoint_id).inc()
+            raise
+        finally:
+            RUNPOD_REQUEST_SECONDS.labels(operation=operation, endpoint=endpoint_id).observe(time.perf_counter() - start)
+        return response
+
 
-def pipeline_endpoint(key: str) -> str:
+def pipeline_endpoints(key: str) -> list[str]:
     pipeline = PIPELINES[key]
-    endpoint_id = getattr(settings, pipeline.endpoint_attr)
-    if not endpoint_id:
+    endpoint_ids: list[str] = []
+    single = getattr(settings, pipeline.endpoint_attr)
+    pool = getattr(settings, pipeline.endpoint_pool_attr) if pipeline.endpoint_pool_attr else None
+    for endpoint_id in [single, *(pool or "").split(",")]:
+        endpoint_id = (endpoint_id or "").strip()
+        if endpoint_id and endpoint_id not in endpoint_ids:
+            endpoint_ids.append(endpoint_id)
+    if not endpoint_ids:
         raise RuntimeError(f"{pipeline.label} endpoint is not configured ({pipeline.endpoint_attr}).")
-    return endpoint_id
+    return endpoint_ids
+
+
+def archive_codecs(key: str) -> tuple[str, ...]:
+    opted_in = {name.strip() for name in (settings.zstd_pipelines or "").split(",")}
+    codecs = PIPELINES[key].archive_codecs
+    return (*codecs, "zstd") if key in opted_in and "zstd" not in codecs else codecs
+
+
+def input_archive_format(key: str) -> tuple[str, int | None]:
+    """ARCHIVE_CODEC when the pipeline's handler can unpack it, otherwise gzip."""
+    pipeline = PIPELINES[key]
+    codec = settings.archive_codec if settings.archive_codec in archive_codecs(key) else "gzip"
+    return codec, pipeline.zstd_level if codec == "zstd" else None
 
 
 def build_pipeline_payload(key: str, parameters: Dict[str, Any], sequence: str | None = None, input_archive: dict | None = None) -> Dict[str, Any]:
@@ -153,5 +253,8 @@ def build_pipeline_payload(key: str, parameters: Dict[str, Any], sequence: str |
     if sequence:
         payload["sequence"] = sequence
     if input_archive:
-        payload["input_archive"] = input_archive
+        # the codec follows the stored file, so archives built before a codec change still resubmit correctly
+        payload["input_archive"] = {**input_archive, "codec": archive_codec(Path(input_archive.get("archive_name", "")))}
+    if key in PIPELINES and PIPELINES[key].supports_stream and settings.stream_outputs:
+        payload["stream_outputs"] = True
     return payload
@@ -42,6 +42,89 @@ class ArtifactRead(BaseModel):
         orm_mode = True
 
 
+class JobAttemptRead(BaseModel):
+    number: int
+    runpod_job_id: str | None
+    endpoint_id: str | None
+    status: str
+    error_message: str | None
+    delay_ms: int | None
+    execution_ms: int | None
+    submitted_at: datetime
+    finished_at: datetime | None
+
+    class Config:
+        orm_mode = True
+
+
+class JobSearchHit(BaseModel):
+    id: str
+    title: str
+    pipeline: str
+    status: str
+    created_at: datetime
+    score: float
+    snippet: str | None = None
+
+    class Config:
+        orm_mode = True
+
+
+class JobSearchResponse(BaseModel):
+    total: int
+    total_capped: bool = False
+    items: list[JobSearchHit]
+
+
+class ModelConfidenceRead(BaseModel):
+    id: int
+    job_id: str
+    job_title: str | None = None
+    target: str | None
+    model_name: str
+    rank: int | None
+    residues: int
+    mean_plddt: float
+    min_plddt: float
+    confident_fraction: float
+    max_pae: float | None
+    ranking_score: float | None
+    ranking_metric: str | None
+
+    class Config:
+        orm_mode = True
+
+
+class DockingPoseRead(BaseModel):
+    id: int
+    job_id: str
+    job_title: str | None = None
+    artifact_id: str
+    complex_name: str | None
+    ligand: str | None
+    rank: int
+    confidence: float | None
+
+    class Config:
+        orm_mode = True
+
+
+class PoseClusterRead(BaseModel):
+    complex_name: str | None
+    threshold: float
+    cluster_index: int
+    size: int
+    member_ranks: list[int]
+    best_confidence: float | None
+    max_rmsd: float
+    representative_pose_id: int
+    representative_artifact_id: str | None = None
+    representative_rank: int | None = None
+
+    class Config:
+        orm_mode = True
+
+
 class JobBase(BaseModel):
     title: str
     pipeline: str
@@ -57,11 +140,20 @@ class JobCreate(JobBase):
 class JobRead(JobBase):
     id: str
     status: str
+    priority: int = 0
     runpod_job_id: str | None
     created_at: datetime
+    submitted_at: datetime | None = None
+    attempts: int = 0
+    next_attempt_at: datetime | None = None
+    error_message: str | None = None
     updated_at: datetime
     expires_at: datetime
     artifacts: list[ArtifactRead] = []
 
     class Config:
         orm_mode = True
+
+
+class JobCancelRequest(BaseModel):
+    job_ids: list[str] = Field(min_length=1, max_length=1000)
@@ -0,0 +1,201 @@
+﻿"""Full-text search over a user's jobs (title, notes, sequence and the JSON parameters).
+
+SQLite uses an external-content FTS5 table kept in sync by triggers on ``jobs``, so every writer (API,
+monitor cleanup, bulk deletes) updates the index without application code. It is keyed on the explicit
+``jobs.search_rowid`` column: ``jobs`` has a TEXT primary key, so its implicit rowid may change on VACUUM. Postgres uses an
+expression GIN index over the same document and needs no sync at all.
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import is_sqlite
+
+SEARCH_COLUMNS = ("title", "notes", "sequence", "parameters")
+# matches are counted up to COUNT_CAP; beyond RANK_LIMIT matches the query is too broad for relevance to
+# mean much, so the page is served newest-first instead of scoring every match
+COUNT_CAP = 10_000
+RANK_LIMIT = 2_000
+
+
+@dataclass
+class SearchHit:
+    id: str
+    title: str
+    pipeline: str
+    status: str
+    created_at: datetime
+    score: float
+    snippet: str | None
+
+
+class SearchIndex(ABC):
+    @abstractmethod
+    def setup(self, conn) -> None: ...
+
+    @abstractmethod
+    async def search(
+        self, db: AsyncSession, user_id: int, query: str, filters: dict[str, str], limit: int, offset: int
+    ) -> tuple[int, bool, list[SearchHit]]:
+        """(total, whether total hit COUNT_CAP, page of hits)."""
+
+
+def _filter_sql(filters: dict[str, str]) -> str:
+    return "".join(f" AND jobs.{column} = :{column}" for column in filters)
+
+
+class SqliteSearchIndex(SearchIndex):
+    # trigram (SQLite >= 3.34) matches any 3+ character fragment, e.g. the middle of a sequence
+    trigram = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+    def setup(self, conn) -> None:
+        existing = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'jobs_fts'")).scalar()
+        if existing and "content_rowid='search_rowid'" not in existing:
+            # indexes created before search_rowid were keyed on the implicit rowid; rebuild them on the new key
+            conn.execute(text("DROP TABLE jobs_fts"))
+            for name in ("jobs_fts_insert", "jobs_fts_delete", "jobs_fts_update"):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            existing = None
+        offset = conn.execute(text("SELECT coalesce(max(search_rowid), 0) FROM jobs")).scalar()
+        conn.execute(text("UPDATE jobs SET search_rowid = rowid + :offset WHERE search_rowid IS NULL"), {"offset": offset})
+        if existing:
+            self.trigram = "trigram" in existing
+        else:
+            tokenizer = "trigram" if self.trigram else "unicode61 remove_diacritics 2"
+            conn.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE jobs_fts USING fts5({', '.join(SEARCH_COLUMNS)}, "
+                    f"content='jobs', content_rowid='search_rowid', tokenize='{tokenizer}')"
+                )
+            )
+        triggers = set(
+            conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'jobs'")).scalars()
+        )
+        columns = ", ".join(SEARCH_COLUMNS)
+        new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+        old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+        insert_row = f"INSERT INTO jobs_fts(rowid, {columns}) VALUES (new.search_rowid, {new_values});"
+        delete_row = f"INSERT INTO jobs_fts(jobs_fts, rowid, {columns}) VALUES ('delete', old.search_rowid, {old_values});"
+        assign_rowid = "UPDATE jobs SET search_rowid = (SELECT coalesce(max(search_rowid), 0) + 1 FROM jobs) WHERE id = new.id;"
+        statements = {
+            "jobs_fts_insert": (
+                f"AFTER INSERT ON jobs BEGIN {assign_rowid} INSERT INTO jobs_fts(rowid, {columns}) "
+                f"SELECT search_rowid, {columns} FROM jobs WHERE id = new.id; END"
+            ),
+            "jobs_fts_delete": f"AFTER DELETE ON jobs BEGIN {delete_row} END",
+            "jobs_fts_update": f"AFTER UPDATE OF {columns} ON jobs BEGIN {delete_row} {insert_row} END",
+        }
+        for name, body in statements.items():
+            if name not in triggers:
+                conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+        # a missing trigger means rows were written without indexing (new table, or jobs was recreated)
+        if not existing or set(statements) - triggers:
+            conn.execute(text("INSERT INTO jobs_fts(jobs_fts) VALUES ('rebuild')"))
+
+    def split_terms(self, query: str) -> tuple[str | None, list[str]]:
+        """FTS match expression plus the terms trigram cannot index (under 3 characters), matched with LIKE."""
+        terms = re.findall(r"\S+", query)
+        if not self.trigram:
+            return " AND ".join('"' + term.replace('"', '""') + '"*' for term in terms) or None, []
+        short = [term for term in terms if len(term) < 3]
+        match = " AND ".join('"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3) or None
+        return match, short
+
+    async def search(self, db, user_id, query, filters, limit, offset):
+        match, short = self.split_terms(query)
+        if match is None and not short:
+            return 0, False, []
+        params = {"match": match, "user_id": user_id, "limit": limit, "offset": offset, "cap": COUNT_CAP, **filters}
+        where = f"jobs.user_id = :user_id{_filter_sql(filters)}"
+        for index, term in enumerate(short):
+            params[f"short_{index}"] = "%" + re.sub(r"([\\%_])", r"\\\1", term) + "%"
+            like = " OR ".join(f"jobs.{column} LIKE :short_{index} ESCAPE '\\'" for column in SEARCH_COLUMNS)
+            where += f" AND ({like})"
+        if match is None:
+            return await self._scan(db, where, params)
+        source = "FROM jobs_fts JOIN jobs ON jobs.search_rowid = jobs_fts.rowid"
+        where = f"jobs_fts MATCH :match AND {where}"
+        total = await db.scalar(text(f"SELECT count(*) FROM (SELECT 1 {source} WHERE {where} LIMIT :cap)"), params) or 0
+        # title hits outrank notes, which outrank sequence / parameter hits
+        # bm25 needs each phrase's document frequency, i.e. a pass over every match, so it is skipped when unranked
+        ranked = total <= RANK_LIMIT
+        rank = "bm25(jobs_fts, 10.0, 4.0, 1.0, 1.0)" if ranked else "0"
+        order = f"{rank}, jobs_fts.rowid DESC" if ranked else "jobs_fts.rowid DESC"
+        rows = await db.execute(
+            text(
+                "SELECT jobs.id, jobs.title, jobs.pipeline, jobs.status, jobs.created_at, "
+                f"-{rank} AS score, snippet(jobs_fts, -1, '[', ']', '…', 12) AS snippet "
+                f"{source} WHERE {where} ORDER BY {order} LIMIT :limit OFFSET :offset"
+            ),
+            params,
+        )
+        return total, total >= COUNT_CAP, [_hit(row) for row in rows]
+
+    async def _scan(self, db, where, params):
+        # only short terms: nothing the index can answer, so scan the user's jobs newest-first
+        total = await db.scalar(text(f"SELECT count(*) FROM (SELECT 1 FROM jobs WHERE {where} LIMIT :cap)"), params) or 0
+        rows = await db.execute(
+            text(
+                "SELECT jobs.id, jobs.title, jobs.pipeline, jobs.status, jobs.created_at, 0 AS score, NULL AS snippet "
+                f"FROM jobs WHERE {where} ORDER BY jobs.created_at DESC LIMIT :limit OFFSET :offset"
+            ),
+            params,
+        )
+        return total, total >= COUNT_CAP, [_hit(row) for row in rows]
+
+
+class PostgresSearchIndex(SearchIndex):
+    # must stay textually identical to the indexed expression for the planner to use the index
+    document = (
+        "to_tsvector('simple', coalesce(jobs.title, '') || ' ' || coalesce(jobs.notes, '') || ' ' || "
+        "coalesce(jobs.sequence, '') || ' ' || coalesce(jobs.parameters::text, ''))"
+    )
+
+    def setup(self, conn) -> None:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_jobs_search ON jobs USING gin ({self.document})"))
+
+    async def search(self, db, user_id, query, filters, limit, offset):
+        if not query.strip():
+            return 0, False, []
+        params = {"query": query, "user_id": user_id, "limit": limit, "offset": offset, "cap": COUNT_CAP, **filters}
+        where = f"{self.document} @@ websearch_to_tsquery('simple', :query) AND jobs.user_id = :user_id{_filter_sql(filters)}"
+        total = await db.scalar(text(f"SELECT count(*) FROM (SELECT 1 FROM jobs WHERE {where} LIMIT :cap) AS hits"), params) or 0
+        rank = f"ts_rank({self.document}, websearch_to_tsquery('simple', :query))" if total <= RANK_LIMIT else "0"
+        rows = await db.execute(
+            text(
+                "SELECT id, title, pipeline, status, created_at, score, "
+                "ts_headline('simple', coalesce(title, '') || ' ' || coalesce(notes, ''), "
+                "websearch_to_tsquery('simple', :query), 'StartSel=[, StopSel=], MaxWords=12') AS snippet FROM ("
+                f"SELECT jobs.*, {rank} AS score "
+                f"FROM jobs WHERE {where} ORDER BY score DESC, created_at DESC LIMIT :limit OFFSET :offset"
+                ") AS page ORDER BY score DESC, created_at DESC"
+            ),
+            params,
+        )
+        return total, total >= COUNT_CAP, [_hit(row) for row in rows]
+
+
+def _hit(row) -> SearchHit:
+    created_at = row.created_at
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return SearchHit(
+        id=row.id,
+        title=row.title,
+        pipeline=row.pipeline,
+        status=row.status,
+        created_at=created_at,
+        score=round(float(row.score), 4),
+        snippet=row.snippet,
+    )
+
+
+search_index: SearchIndex = SqliteSearchIndex() if is_sqlite else PostgresSearchIndex()
@@ -0,0 +1,52 @@
+﻿"""Lean serializers for large list endpoints.
+
+They select only the columns a response schema exposes and hand plain dicts straight to orjson,
+skipping ORM hydration, pydantic validation and ``jsonable_encoder``. The schemas still document the
+shape (``response_model``); they are just not run per row.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .schemas import ArtifactRead, JobRead
+
+
+def schema_columns(schema: type[BaseModel], model: type) -> list:
+    columns = model.__table__.columns
+    return [columns[name] for name in schema.model_fields if name in columns]
+
+
+JOB_COLUMNS = schema_columns(JobRead, models.Job)
+ARTIFACT_COLUMNS = schema_columns(ArtifactRead, models.Artifact)
+
+
+def json_rows(rows: Iterable) -> ORJSONResponse:
+    return ORJSONResponse([dict(row) for row in rows])
+
+
+async def user_jobs_payload(db: AsyncSession, user_id: int) -> list[dict]:
+    jobs = [
+        {**row, "artifacts": []}
+        for row in (
+            await db.execute(
+                select(*JOB_COLUMNS).where(models.Job.user_id == user_id).order_by(models.Job.created_at.desc())
+            )
+        ).mappings()
+    ]
+    by_id = {job["id"]: job for job in jobs}
+    artifacts = await db.execute(
+        select(models.Artifact.job_id.label("_job_id"), *ARTIFACT_COLUMNS)
+        .join(models.Job, models.Job.id == models.Artifact.job_id)
+        .where(models.Job.user_id == user_id)
+    )
+    for row in artifacts.mappings():
+        artifact = dict(row)
+        by_id[artifact.pop("_job_id")]["artifacts"].append(artifact)
+    return jobs
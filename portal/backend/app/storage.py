@@ -1,16 +1,24 @@
 ﻿from __future__ import annotations
 
 import base64
+import gzip
+import hashlib
+import os
 import tarfile
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable
+from typing import BinaryIO, Iterable, Iterator
 
+import zstandard
 from fastapi import UploadFile
 
 from .config import get_settings
 
 settings = get_settings()
 
+ARCHIVE_SUFFIXES = {"gzip": ".tar.gz", "zstd": ".tar.zst"}
+DEFAULT_LEVELS = {"gzip": 9, "zstd": 3}
+
 
 def storage_path(*segments: str) -> Path:
     path = settings.storage_root.joinpath(*segments)
@@ -41,11 +49,67 @@ def save_uploads(user_id: int, job_id: str, files: Iterable[UploadFile]) -> list
     return saved_paths
 
 
-def build_archive(paths: list[Path], archive_path: Path) -> Path:
+def write_texts(user_id: int, job_id: str, files: dict[str, str]) -> list[Path]:
+    target_dir = uploads_dir(user_id, job_id)
+    saved_paths: list[Path] = []
+    for name, text in files.items():
+        target_path = target_dir / name
+        target_path.write_text(text, encoding="utf-8")
+        saved_paths.append(target_path)
+    return saved_paths
+
+
+def archive_codec(path: Path) -> str:
+    return next((codec for codec, suffix in ARCHIVE_SUFFIXES.items() if path.name.endswith(suffix)), "gzip")
+
+
+@contextmanager
+def _compressed(raw: BinaryIO, codec: str, level: int) -> Iterator[BinaryIO]:
+    if codec == "zstd":
+        threads = settings.archive_threads or os.cpu_count() or 1
+        with zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(raw, closefd=False) as writer:
+            yield writer
+    else:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level, mtime=0) as writer:
+            yield writer
+
+
+def duplicate_files(paths: list[Path]) -> dict[Path, Path]:
+    """Map each file whose bytes repeat an earlier one to that first copy; only equal sizes are hashed."""
+    by_size: dict[int, list[Path]] = {}
+    for path in paths:
+        if path.is_file():
+            by_size.setdefault(path.stat().st_size, []).append(path)
+    duplicates: dict[Path, Path] = {}
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        first: dict[str, Path] = {}
+        for path in group:
+            with path.open("rb") as handle:
+                digest = hashlib.file_digest(handle, "sha256").hexdigest()
+            original = first.setdefault(digest, path)
+            if original != path:
+                duplicates[path] = original
+    return duplicates
+
+
+def build_archive(paths: list[Path], archive_path: Path, codec: str = "gzip", level: int | None = None) -> Path:
     archive_path.parent.mkdir(parents=True, exist_ok=True)
-    with tarfile.open(archive_path, "w:gz") as tar:
-        for path in paths:
-            tar.add(path, arcname=path.name)
+    duplicates = duplicate_files(paths)
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    with archive_path.open("wb") as raw, _compressed(raw, codec, level) as stream:
+        with tarfile.open(fileobj=stream, mode="w|") as tar:
+            for path in paths:
+                if path not in duplicates:
+                    tar.add(path, arcname=path.name)
+                    continue
+                # hard link member: extracts under its own name, bytes stored once
+                info = tar.gettarinfo(path, arcname=path.name)
+                info.type = tarfile.LNKTYPE
+                info.linkname = duplicates[path].name
+                info.size = 0
+                tar.addfile(info)
     return archive_path
 
 
@@ -0,0 +1,233 @@
+﻿"""Vectorized structure parsing and compact, cached previews for the 3D viewer.
+
+A preview is ``RPV1`` + uint32 header length + JSON header + little-endian arrays. Arrays are
+ordered by item size so every one starts aligned and can be viewed as a typed array in place.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import shlex
+import tempfile
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+import numpy as np
+
+from .metrics import PREVIEW_BUILD_SECONDS
+
+MAGIC = b"RPV1"
+PREVIEW_DIR = ".preview"
+ANALYSIS_DIR = ".analysis"
+PREVIEW_SUFFIXES = {".pdb", ".cif", ".sdf"}
+LODS = ("full", "trace", "ligand")
+WATER = np.array([b"HOH", b"WAT", b"DOD", b"H2O"])
+TRACE_ATOMS = np.array([b"CA", b"P"])
+
+
+@dataclass
+class Atoms:
+    coords: np.ndarray
+    names: np.ndarray
+    res_names: np.ndarray
+    chains: np.ndarray
+    res_seq: np.ndarray
+    elements: np.ndarray
+    b_factors: np.ndarray
+    hetero: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def select(self, mask: np.ndarray) -> "Atoms":
+        return Atoms(**{item.name: getattr(self, item.name)[mask] for item in fields(self)})
+
+    def lod(self, level: str) -> "Atoms":
+        solvent = np.isin(self.res_names, WATER)
+        if level == "full":
+            return self.select(~solvent)
+        ligand = self.hetero & ~solvent
+        if level == "ligand":
+            return self.select(ligand)
+        trace = ~self.hetero & np.isin(self.names, TRACE_ATOMS)
+        # ligand-only inputs (SDF poses) have no backbone, so the trace is the ligand itself
+        return self.select(trace if trace.any() else ligand)
+
+
+def _columns(matrix: np.ndarray, start: int, stop: int) -> np.ndarray:
+    return np.char.strip(np.ascontiguousarray(matrix[:, start:stop]).view(f"S{stop - start}").ravel())
+
+
+def _fixed_width(lines: list[bytes], width: int = 80) -> np.ndarray:
+    return np.array(lines, dtype=f"S{width}").view(np.uint8).reshape(-1, width)
+
+
+def parse_pdb(data: bytes) -> Atoms:
+    lines = data.splitlines()
+    matrix = _fixed_width(lines)
+    records = _columns(matrix, 0, 6)
+    model_ends = np.flatnonzero(records == b"ENDMDL")
+    if len(model_ends):
+        matrix, records = matrix[: model_ends[0]], records[: model_ends[0]]
+    atom_rows = (records == b"ATOM") | (records == b"HETATM")
+    alt_loc = _columns(matrix, 16, 17)
+    matrix = matrix[atom_rows & ((alt_loc == b"") | (alt_loc == b"A"))]
+    if not len(matrix):
+        raise ValueError("no ATOM/HETATM records")
+    names = _columns(matrix, 12, 16)
+    elements = _columns(matrix, 76, 78)
+    missing = elements == b""
+    if missing.any():
+        # pre-v3 files leave the element column empty; the first letter of the atom name is close enough
+        elements[missing] = np.char.lstrip(names[missing], b"0123456789").astype("S1")
+    b_factors = _columns(matrix, 60, 66)
+    return Atoms(
+        coords=np.stack([_columns(matrix, start, start + 8).astype(np.float32) for start in (30, 38, 46)], axis=1),
+        names=names,
+        res_names=_columns(matrix, 17, 20),
+        chains=_columns(matrix, 21, 22),
+        res_seq=_columns(matrix, 22, 26).astype(np.int32),
+        elements=np.char.upper(elements),
+        b_factors=np.where(b_factors == b"", b"0", b_factors).astype(np.float32),
+        hetero=_columns(matrix, 0, 6) == b"HETATM",
+    )
+
+
+def parse_cif(data: bytes) -> Atoms:
+    lines = data.splitlines()
+    headers: list[str] = []
+    rows: list[bytes] = []
+    in_loop = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith(b"_atom_site."):
+            headers.append(stripped[len(b"_atom_site.") :].decode())
+            in_loop = True
+        elif in_loop and headers:
+            if not stripped or stripped.startswith((b"#", b"_", b"loop_", b"data_")):
+                if rows:
+                    break
+                continue
+            rows.append(stripped)
+    if not rows:
+        raise ValueError("no _atom_site loop")
+    tokens = b" ".join(rows).split()
+    if len(tokens) % len(headers):
+        # quoted values containing spaces; rare enough to take the slow path
+        tokens = [token.encode() for row in rows for token in shlex.split(row.decode())]
+    table = np.array(tokens, dtype=object).reshape(-1, len(headers)).astype("S")
+    column = {name: table[:, index] for index, name in enumerate(headers)}
+
+    def pick(*names: str, default: bytes = b"") -> np.ndarray:
+        for name in names:
+            if name in column:
+                values = np.char.strip(column[name], b"\"'")
+                return np.where(np.isin(values, [b".", b"?"]), default, values)
+        return np.full(len(table), default)
+
+    keep = np.isin(pick("label_alt_id"), [b"", b"A"])
+    models = pick("pdbx_PDB_model_num", default=b"1")
+    keep &= models == models[0]
+    res_seq = pick("auth_seq_id", "label_seq_id", default=b"0")
+    atoms = Atoms(
+        coords=np.stack([pick(f"Cartn_{axis}").astype(np.float32) for axis in "xyz"], axis=1),
+        names=pick("auth_atom_id", "label_atom_id"),
+        res_names=pick("auth_comp_id", "label_comp_id"),
+        chains=pick("auth_asym_id", "label_asym_id"),
+        res_seq=res_seq.astype(np.int32),
+        elements=np.char.upper(pick("type_symbol")),
+        b_factors=pick("B_iso_or_equiv", default=b"0").astype(np.float32),
+        hetero=pick("group_PDB", default=b"ATOM") == b"HETATM",
+    )
+    return atoms.select(keep)
+
+
+def parse_sdf(data: bytes) -> Atoms:
+    lines = data.splitlines()
+    if len(lines) < 4 or b"V3000" in lines[3]:
+        raise ValueError("only V2000 molfiles are supported")
+    count = int(lines[3][:3])
+    matrix = _fixed_width(lines[4 : 4 + count], width=40)
+    elements = np.char.upper(_columns(matrix, 31, 34))
+    return Atoms(
+        coords=np.stack([_columns(matrix, start, start + 10).astype(np.float32) for start in (0, 10, 20)], axis=1),
+        names=elements,
+        res_names=np.full(count, b"LIG"),
+        chains=np.full(count, b"L"),
+        res_seq=np.ones(count, dtype=np.int32),
+        elements=elements,
+        b_factors=np.zeros(count, dtype=np.float32),
+        hetero=np.ones(count, dtype=bool),
+    )
+
+
+PARSERS = {".pdb": parse_pdb, ".cif": parse_cif, ".sdf": parse_sdf}
+
+
+def parse_structure(path: Path) -> Atoms:
+    parser = PARSERS.get(path.suffix.lower())
+    if parser is None:
+        raise ValueError(f"unsupported structure format: {path.suffix}")
+    return parser(path.read_bytes())
+
+
+def encode_preview(atoms: Atoms, lod: str, source: str) -> bytes:
+    tables: dict[str, list[str]] = {}
+    arrays: list[tuple[str, np.ndarray]] = [
+        ("coords", atoms.coords.astype("<f4")),
+        ("bFactor", atoms.b_factors.astype("<f4")),
+        ("resSeq", atoms.res_seq.astype("<i4")),
+    ]
+    for name, values, dtype in (
+        ("atomName", atoms.names, "<u2"),
+        ("resName", atoms.res_names, "<u2"),
+        ("chain", atoms.chains, "<u2"),
+        ("element", atoms.elements, "u1"),
+    ):
+        table, index = np.unique(values, return_inverse=True)
+        tables[name] = [value.decode(errors="replace") for value in table]
+        arrays.append((name, index.astype(dtype)))
+    arrays.append(("hetero", atoms.hetero.astype("u1")))
+
+    layout: dict[str, dict[str, object]] = {}
+    offset = 0
+    for name, array in arrays:
+        layout[name] = {"dtype": array.dtype.name, "offset": offset, "length": int(array.size)}
+        offset += array.nbytes
+    header = json.dumps(
+        {"version": 1, "lod": lod, "source": source, "atoms": len(atoms), "tables": tables, "arrays": layout},
+        separators=(",", ":"),
+    ).encode()
+    header += b" " * (-len(header) % 4)
+    return b"".join([MAGIC, len(header).to_bytes(4, "little"), header, *(array.tobytes() for _, array in arrays)])
+
+
+def preview_path(artifact_path: Path, lod: str) -> Path:
+    return artifact_path.parent / PREVIEW_DIR / f"{artifact_path.name}.{lod}.rpv.gz"
+
+
+def build_previews(artifact_path: Path) -> dict[str, Path]:
+    """Parse once and write every level of detail, gzip-compressed, next to the artifact."""
+    start = time.perf_counter()
+    atoms = parse_structure(artifact_path)
+    written: dict[str, Path] = {}
+    for lod in LODS:
+        target = preview_path(artifact_path, lod)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        payload = gzip.compress(encode_preview(atoms.lod(lod), lod, artifact_path.name), compresslevel=6, mtime=0)
+        # unique per writer: concurrent requests in one process would otherwise share a pid-named temp file
+        with tempfile.NamedTemporaryFile(dir=target.parent, prefix=f"{target.name}.", suffix=".tmp", delete=False) as tmp:
+            tmp.write(payload)
+        Path(tmp.name).replace(target)
+        written[lod] = target
+    PREVIEW_BUILD_SECONDS.labels(format=artifact_path.suffix.lower().lstrip(".")).observe(time.perf_counter() - start)
+    return written
+
+
+def ensure_preview(artifact_path: Path, lod: str) -> Path:
+    target = preview_path(artifact_path, lod)
+    if target.exists() and target.stat().st_mtime >= artifact_path.stat().st_mtime:
+        return target
+    return build_previews(artifact_path)[lod]
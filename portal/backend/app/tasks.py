@@ -1,120 +1,238 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import base64
+import hashlib
 import io
 import tarfile
-import threading
 import time
-from datetime import datetime
+from contextlib import suppress
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Iterable
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+import httpx
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from . import models
+from .analysis import run_analyzers
 from .config import get_settings
-from .database import SessionLocal
-from .runpod import RunpodClient
+from .database import AsyncSessionLocal
+from .dispatcher import close_attempt, request_cancel
+from .endpoints import endpoint_pool
+from .metrics import (
+    ARCHIVE_BYTES_PERSISTED,
+    COLD_START_SECONDS,
+    JOB_RETRIES,
+    MONITOR_BACKLOG,
+    MONITOR_CYCLE_SECONDS,
+    MONITOR_ERRORS,
+    PERSIST_SECONDS,
+    STREAM_CHUNKS,
+    observe_runpod_timings,
+    observe_status_change,
+)
+from .runpod import PIPELINES, RunpodClient
 from .storage import remove_tree, results_dir
+from .structures import ANALYSIS_DIR, PREVIEW_DIR, build_previews
+from .tracing import record_span, span
 
 settings = get_settings()
 
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "TIMED_OUT", "CANCELLED", "COMPLETED_WITH_ERRORS"}
+
 
 class JobMonitor:
     def __init__(self) -> None:
-        self._stop = threading.Event()
-        self.thread = threading.Thread(target=self._run, name="job-monitor", daemon=True)
+        self._stop = asyncio.Event()
+        self.task: asyncio.Task | None = None
         self.client: RunpodClient | None = None
 
     def start(self) -> None:
-        if not self.thread.is_alive():
-            self.thread.start()
+        if self.task is None or self.task.done():
+            self._stop.clear()
+            self.task = asyncio.create_task(self._run(), name="job-monitor")
 
-    def stop(self) -> None:
+    async def stop(self) -> None:
         self._stop.set()
-        self.thread.join(timeout=5)
+        if self.task:
+            with suppress(asyncio.TimeoutError, asyncio.CancelledError):
+                await asyncio.wait_for(self.task, timeout=5)
+        if self.client:
+            await self.client.aclose()
+            self.client = None
 
-    def _run(self) -> None:
+    async def _run(self) -> None:
         try:
             self.client = RunpodClient()
         except RuntimeError as exc:
             print(f"[monitor] RunPod client disabled: {exc}")
             return
         while not self._stop.is_set():
+            start = time.perf_counter()
             try:
-                self._poll_once()
+                await self._poll_once()
             except Exception as exc:  # noqa: BLE001
+                MONITOR_ERRORS.inc()
                 print(f"[monitor] error: {exc}")
             finally:
-                self._stop.wait(settings.poll_interval_seconds)
-
-    def _poll_once(self) -> None:
-        with SessionLocal() as db:
-            jobs: Iterable[models.Job] = db.execute(
-                select(models.Job).where(models.Job.status.in_(["submitted", "running", "queued", "pending"]))
-            ).scalars()
-            for job in jobs:
-                self._update_job(db, job)
-            self._cleanup_expired(db)
-            db.commit()
-
-    def _update_job(self, db: Session, job: models.Job) -> None:
+                MONITOR_CYCLE_SECONDS.observe(time.perf_counter() - start)
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._stop.wait(), settings.poll_interval_seconds)
+
+    async def _poll_once(self) -> None:
+        async with AsyncSessionLocal() as db:
+            job_ids = (
+                await db.scalars(
+                    select(models.Job.id).where(
+                        models.Job.status.in_(models.IN_FLIGHT_STATUSES), models.Job.runpod_job_id.is_not(None)
+                    )
+                )
+            ).all()
+        MONITOR_BACKLOG.set(len(job_ids))
+        # one short session per job so a slow status call never holds a connection for the whole cycle
+        for job_id in job_ids:
+            async with AsyncSessionLocal() as db:
+                job = await db.get(models.Job, job_id)
+                if job is None:
+                    continue
+                with span("monitor.update_job", job_id=job.id, pipeline=job.pipeline):
+                    await self._update_job(db, job)
+                    await db.commit()
+        async with AsyncSessionLocal() as db:
+            await self._cleanup_expired(db)
+            await db.commit()
+
+    async def _update_job(self, db: AsyncSession, job: models.Job) -> None:
         if not self.client or not job.endpoint_id or not job.runpod_job_id:
             return
-        response = self.client.status(job.endpoint_id, job.runpod_job_id)
+        response = await self.client.status(job.endpoint_id, job.runpod_job_id)
         status = response.get("status") or response.get("state")
+        cancelling = job.status == "cancelling"
+        if cancelling and status not in TERMINAL_STATUSES:
+            # an earlier /cancel did not go through; keep asking until RunPod stops the job
+            await request_cancel(db, self.client, job)
+            return
         if status:
+            previous = job.status
             job.status = status.lower()
+            observe_status_change(job.pipeline, previous, job.status)
+            if previous != job.status and status in TERMINAL_STATUSES:
+                observe_runpod_timings(job.pipeline, response)
+                _record_remote_spans(job, response)
+                if isinstance(response.get("executionTime"), (int, float)):
+                    endpoint_pool.record_execution(job.endpoint_id, response["executionTime"])
+                if job.id in endpoint_pool.cold_jobs and isinstance(response.get("delayTime"), (int, float)):
+                    endpoint_pool.cold_jobs.discard(job.id)
+                    COLD_START_SECONDS.labels(endpoint=job.endpoint_id, pipeline=job.pipeline).observe(
+                        response["delayTime"] / 1000
+                    )
+        if status in {"IN_PROGRESS", "COMPLETED"} and _streams(job):
+            # drained once more on COMPLETED: chunks yielded just before the end are still queued there
+            await self._drain_stream(db, job)
         output = response.get("output") or {}
         if status == "COMPLETED" and output:
-            self._persist_output(db, job, output)
+            start = time.perf_counter()
+            with span("persist_output"):
+                await self._persist_output(db, job, output)
+            PERSIST_SECONDS.labels(pipeline=job.pipeline).observe(time.perf_counter() - start)
         elif status in {"FAILED", "TIMED_OUT", "CANCELLED", "COMPLETED_WITH_ERRORS"}:
             job.error_message = response.get("error") or response.get("message")
+        if status in TERMINAL_STATUSES:
+            await close_attempt(db, job, status, response)
+            if not cancelling:
+                await self._maybe_retry(db, job, status)
+
+    async def _drain_stream(self, db: AsyncSession, job: models.Job) -> None:
+        try:
+            response = await self.client.stream(job.endpoint_id, job.runpod_job_id)
+        except httpx.HTTPError as exc:
+            # partial results are a bonus; the final status still carries whatever was not streamed
+            print(f"[monitor] stream read failed for job {job.id}: {exc}")
+            return
+        chunks = [item["output"] for item in response.get("stream") or [] if isinstance(item.get("output"), dict)]
+        if not chunks:
+            return
+        STREAM_CHUNKS.labels(pipeline=job.pipeline).inc(len(chunks))
+        start = time.perf_counter()
+        with span("persist_stream", chunks=len(chunks)):
+            await self._persist_output(db, job, chunks)
+        PERSIST_SECONDS.labels(pipeline=job.pipeline).observe(time.perf_counter() - start)
+
+    async def _maybe_retry(self, db: AsyncSession, job: models.Job, status: str) -> None:
+        policy = PIPELINES[job.pipeline].retry if job.pipeline in PIPELINES else None
+        if policy is None or status not in policy.retry_on or (job.attempts or 0) >= policy.max_attempts:
+            return
+        # requeue locally; the dispatcher resubmits from the stored input archive once the backoff passes
+        delay = policy.delay(job.attempts or 1)
+        JOB_RETRIES.labels(pipeline=job.pipeline, reason=status.lower()).inc()
+        observe_status_change(job.pipeline, job.status, "pending")
+        job.status = "pending"
+        job.runpod_job_id = None
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        job.error_message = f"Attempt {job.attempts} {status.lower()}: {job.error_message or 'no details'}; retrying in {delay:.0f}s."
+        # drop what the failed attempt streamed, otherwise the retry's archives would be deduped against it
+        await db.execute(delete(models.Artifact).where(models.Artifact.job_id == job.id))
+        if job.result_dir:
+            await asyncio.to_thread(remove_tree, Path(job.result_dir))
+        job.result_dir = None
+        job.result_archive = None
 
-    def _persist_output(self, db: Session, job: models.Job, output: dict) -> None:
-        target_dir = results_dir(job.user_id, job.id)
+    async def _persist_output(self, db: AsyncSession, job: models.Job, output: dict | list[dict]) -> None:
+        target_dir = await asyncio.to_thread(results_dir, job.user_id, job.id)
         job.result_dir = str(target_dir)
-        archives = output.get("archives") or []
-        if not archives:
-            archive_b64 = output.get("archive_base64")
-            if archive_b64:
-                archives = [{"name": f"{job.id}.tar.gz", "base64": archive_b64}]
+        # a list is a batch of stream chunks (or RunPod's aggregate of them on COMPLETED)
+        chunks = output if isinstance(output, list) else [output]
+        archives = [
+            archive for chunk in chunks if isinstance(chunk, dict) for archive in _archives(job, chunk, isinstance(output, list))
+        ]
+        persisted = set(
+            (
+                await db.scalars(
+                    select(models.Artifact.file_path).where(models.Artifact.job_id == job.id, models.Artifact.kind == "archive")
+                )
+            ).all()
+        )
         for item in archives:
             base64_data = item.get("base64")
             if not base64_data:
                 continue
             file_name = item.get("name") or f"{job.id}.tar.gz"
-            raw = base64.b64decode(base64_data)
             archive_path = target_dir / file_name
-            archive_path.write_bytes(raw)
+            if str(archive_path) in persisted:
+                # already arrived through /stream; an aggregated final output repeats it
+                continue
+            persisted.add(str(archive_path))
+            with span("persist_output.write_archive", archive=file_name) as write_span:
+                size_bytes = await asyncio.to_thread(_write_archive, base64_data, archive_path, target_dir)
+                write_span.set(bytes=size_bytes)
             job.result_archive = str(archive_path)
-            try:
-                with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
-                    tar.extractall(target_dir)
-            except tarfile.ReadError:
-                pass
+            ARCHIVE_BYTES_PERSISTED.labels(pipeline=job.pipeline).inc(size_bytes)
             artifact = models.Artifact(
                 job_id=job.id,
                 file_name=file_name,
                 file_path=str(archive_path),
                 kind="archive",
                 mime_type="application/gzip",
-                size_bytes=len(raw),
+                size_bytes=size_bytes,
             )
             db.add(artifact)
-        self._index_results(db, job, target_dir)
+        await db.flush()
+        with span("index_results"):
+            structures = await self._index_results(db, job, target_dir)
+        if structures:
+            with span("build_previews", structures=len(structures)):
+                await asyncio.to_thread(_build_previews, structures)
+        await run_analyzers(db, job, target_dir)
 
-    def _index_results(self, db: Session, job: models.Job, directory: Path) -> None:
-        if not directory.exists():
-            return
-        existing_paths = {
-            artifact.file_path
-            for artifact in db.query(models.Artifact).filter(models.Artifact.job_id == job.id).all()
-        }
-        for file in directory.rglob("*"):
-            if not file.is_file():
-                continue
+    async def _index_results(self, db: AsyncSession, job: models.Job, directory: Path) -> list[Path]:
+        existing_paths = set(
+            (await db.scalars(select(models.Artifact.file_path).where(models.Artifact.job_id == job.id))).all()
+        )
+        files = await asyncio.to_thread(_scan_files, directory)
+        structures: list[Path] = []
+        for file, size_bytes in files:
             if str(file) in existing_paths:
                 continue
             suffix = file.suffix.lower()
@@ -123,6 +241,7 @@ class JobMonitor:
             if suffix in {".pdb", ".cif"}:
                 kind = "structure"
                 mime = "chemical/x-pdb" if suffix == ".pdb" else "chemical/x-cif"
+                structures.append(file)
             elif suffix in {".json", ".csv"}:
                 kind = "table"
                 mime = "application/json" if suffix == ".json" else "text/csv"
@@ -135,20 +254,88 @@ class JobMonitor:
                 file_path=str(file),
                 kind=kind,
                 mime_type=mime,
-                size_bytes=file.stat().st_size,
+                size_bytes=size_bytes,
             )
             db.add(artifact)
+        return structures
 
-    def _cleanup_expired(self, db: Session) -> None:
+    async def _cleanup_expired(self, db: AsyncSession) -> None:
         now = datetime.utcnow()
-        expired_jobs = db.scalars(select(models.Job).where(models.Job.expires_at < now)).all()
+        expired_jobs = (
+            await db.scalars(
+                select(models.Job).options(selectinload(models.Job.artifacts)).where(models.Job.expires_at < now)
+            )
+        ).all()
         for job in expired_jobs:
             if job.result_dir:
-                remove_tree(Path(job.result_dir))
+                await asyncio.to_thread(remove_tree, Path(job.result_dir))
             uploads_folder = Path(job.input_archive_path).parent if job.input_archive_path else None
             if uploads_folder and uploads_folder.exists():
-                remove_tree(uploads_folder)
-            db.delete(job)
+                await asyncio.to_thread(remove_tree, uploads_folder)
+            await db.delete(job)
+
+
+def _record_remote_spans(job: models.Job, response: dict) -> None:
+    # RunPod only reports durations (ms), so anchor them backwards from the moment we saw the final status
+    delay_ms = response.get("delayTime")
+    execution_ms = response.get("executionTime")
+    finished = time.time()
+    if isinstance(execution_ms, (int, float)):
+        record_span("runpod.execution", job.id, finished - execution_ms / 1000, execution_ms, endpoint=job.endpoint_id)
+        finished -= execution_ms / 1000
+    if isinstance(delay_ms, (int, float)):
+        record_span("runpod.queue", job.id, finished - delay_ms / 1000, delay_ms, endpoint=job.endpoint_id)
+
+
+def _streams(job: models.Job) -> bool:
+    pipeline = PIPELINES.get(job.pipeline)
+    return bool(settings.stream_outputs and pipeline and pipeline.supports_stream)
+
+
+def _archives(job: models.Job, output: dict, chunked: bool = False) -> list[dict]:
+    archives = output.get("archives") or []
+    if not archives and output.get("archive_base64"):
+        # unnamed chunks are told apart by stage, or by content when they carry none, so each one keeps its own
+        # archive file and a chunk repeated in the aggregated final output still maps to the same name
+        stage = output.get("stage")
+        if stage:
+            name = f"{job.id}.{stage}.tar.gz"
+        elif chunked:
+            name = f"{job.id}.{hashlib.sha256(output['archive_base64'].encode()).hexdigest()[:12]}.tar.gz"
+        else:
+            name = f"{job.id}.tar.gz"
+        archives = [{"name": name, "base64": output["archive_base64"]}]
+    return archives
+
+
+def _write_archive(base64_data: str, archive_path: Path, target_dir: Path) -> int:
+    raw = base64.b64decode(base64_data)
+    archive_path.write_bytes(raw)
+    try:
+        with tarfile.open(fileobj=io.BytesIO(raw)) as tar:
+            tar.extractall(target_dir)
+    except tarfile.ReadError:
+        pass
+    return len(raw)
+
+
+def _scan_files(directory: Path) -> list[tuple[Path, int]]:
+    if not directory.exists():
+        return []
+    return [
+        (file, file.stat().st_size)
+        for file in directory.rglob("*")
+        if file.is_file() and not {PREVIEW_DIR, ANALYSIS_DIR} & set(file.relative_to(directory).parts)
+    ]
+
+
+def _build_previews(paths: list[Path]) -> None:
+    # best effort: the preview endpoint rebuilds lazily if a file could not be parsed here
+    for path in paths:
+        try:
+            build_previews(path)
+        except (OSError, ValueError) as exc:
+            print(f"[monitor] preview failed for {path.name}: {exc}")
 
 
 monitor = JobMonitor()
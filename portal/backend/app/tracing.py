@@ -0,0 +1,138 @@
+﻿from __future__ import annotations
+
+import json
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+from uuid import uuid4
+
+from .config import get_settings
+
+settings = get_settings()
+
+
+@dataclass
+class Span:
+    name: str
+    job_id: str | None = None
+    parent_id: str | None = None
+    span_id: str = field(default_factory=lambda: uuid4().hex[:16])
+    start: float = field(default_factory=time.time)
+    duration_ms: float | None = None
+    status: str = "ok"
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class SpanExporter:
+    """Keeps recent spans in a ring buffer and optionally appends them to a JSON lines file.
+
+    File writes happen on a background thread so exporting never blocks the event loop.
+    """
+
+    def __init__(self, ring_size: int, path: Path | None = None) -> None:
+        self.ring: deque[dict[str, Any]] = deque(maxlen=ring_size)
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending: queue.SimpleQueue[str] = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+
+    def export(self, span: Span) -> None:
+        record = asdict(span)
+        with self._lock:
+            self.ring.append(record)
+            if self.path and self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="span-exporter", daemon=True)
+                self._writer.start()
+        if self.path:
+            self._pending.put(json.dumps(record, default=str) + "\n")
+
+    def _write_loop(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            lines = [self._pending.get()]
+            # drain whatever queued up meanwhile so bursts cost one open/write
+            while True:
+                try:
+                    lines.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.path.open("a", encoding="utf-8") as handle:
+                    handle.writelines(lines)
+            except OSError as exc:
+                print(f"[tracing] span export failed: {exc}")
+
+    def spans_for(self, job_id: str) -> list[dict[str, Any]]:
+        with self._lock:
+            spans = [record for record in self.ring if record["job_id"] == job_id]
+        if not spans and self.path and self.path.exists():
+            with self.path.open("r", encoding="utf-8") as handle:
+                for line in handle:
+                    if job_id not in line:
+                        continue
+                    record = json.loads(line)
+                    if record.get("job_id") == job_id:
+                        spans.append(record)
+        return sorted(spans, key=lambda record: record["start"])
+
+
+exporter = SpanExporter(settings.trace_ring_size, settings.trace_export_path)
+
+
+@contextmanager
+def span(name: str, job_id: str | None = None, **attributes: Any) -> Iterator[Span]:
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        job_id=job_id or (parent.job_id if parent else None),
+        parent_id=parent.span_id if parent else None,
+        attributes=attributes,
+    )
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as exc:
+        current.status = "error"
+        current.attributes["error"] = repr(exc)
+        raise
+    finally:
+        current.duration_ms = (time.perf_counter() - started) * 1000
+        _current_span.reset(token)
+        if settings.tracing_enabled:
+            exporter.export(current)
+
+
+def record_span(name: str, job_id: str, start: float, duration_ms: float, **attributes: Any) -> None:
+    """Export a span measured elsewhere, e.g. RunPod-reported queue and execution time."""
+    if not settings.tracing_enabled:
+        return
+    parent = _current_span.get()
+    exporter.export(
+        Span(
+            name=name,
+            job_id=job_id,
+            parent_id=parent.span_id if parent else None,
+            start=start,
+            duration_ms=duration_ms,
+            attributes=attributes,
+        )
+    )
+
+
+def job_timeline(job_id: str) -> list[dict[str, Any]]:
+    spans = exporter.spans_for(job_id)
+    origin = spans[0]["start"] if spans else 0.0
+    return [{**record, "offset_ms": (record["start"] - origin) * 1000} for record in spans]
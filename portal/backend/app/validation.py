@@ -0,0 +1,147 @@
+﻿from __future__ import annotations
+
+import zipfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Annotated, Any, Callable, Iterable, Literal
+
+from fastapi import UploadFile
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, model_validator
+
+MAX_REPORTED_ERRORS = 200
+
+NonEmptyStr = Annotated[str, Field(min_length=1)]
+
+
+class DiffDockJobRow(BaseModel):
+    model_config = ConfigDict(extra="allow", str_strip_whitespace=True)
+
+    complex_name: NonEmptyStr
+    protein_path: NonEmptyStr
+    ligand_description: NonEmptyStr
+    ligand_type: Literal["sdf", "smiles"]
+    protein_sequence: str | None = None
+
+
+class DiffDockParameters(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    jobs: list[DiffDockJobRow] = Field(min_length=1)
+
+
+class PhastestParameters(BaseModel):
+    model_config = ConfigDict(extra="allow", str_strip_whitespace=True)
+
+    input_type: Literal["fasta", "contig", "genbank"]
+    mode: Literal["lite", "deep"]
+    sample_name: NonEmptyStr
+    accession: str | None = None
+
+    @model_validator(mode="after")
+    def _genbank_needs_accession(self) -> "PhastestParameters":
+        if self.input_type == "genbank" and not self.accession:
+            raise ValueError("GenBank accession is required for this mode.")
+        return self
+
+
+@dataclass
+class ParameterError:
+    field: str
+    message: str
+    row: int | None = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {"row": self.row, "field": self.field, "message": self.message}
+
+
+class ParameterSchema:
+    """Pipeline parameter schema compiled once; one call reports every row error."""
+
+    def __init__(
+        self,
+        model: type[BaseModel],
+        references: Callable[[Any, set[str]], Iterable[ParameterError]] | None = None,
+    ) -> None:
+        self.adapter = TypeAdapter(model)
+        self.references = references
+
+    def validate(self, parameters: Any, upload_names: set[str] | None = None) -> list[ParameterError]:
+        errors: list[ParameterError] = []
+        try:
+            self.adapter.validate_python(parameters)
+        except ValidationError as exc:
+            errors.extend(_from_pydantic(error) for error in exc.errors(include_url=False, include_input=False))
+        if self.references is not None and upload_names is not None:
+            # runs on the raw payload so rows with shape errors still get their references checked
+            errors.extend(self.references(parameters, upload_names))
+        return sorted(errors, key=lambda error: (error.row or 0, error.field))
+
+
+def _from_pydantic(error: dict[str, Any]) -> ParameterError:
+    loc = list(error["loc"])
+    row = None
+    if len(loc) >= 2 and isinstance(loc[1], int):
+        row = loc[1] + 1
+        loc = [loc[0], *loc[2:]]
+    return ParameterError(field=".".join(str(part) for part in loc) or "parameters", message=error["msg"], row=row)
+
+
+def normalize_upload_path(path: str) -> str:
+    normalized = path.replace("\\", "/")
+    while normalized.startswith("./"):
+        normalized = normalized.removeprefix("./")
+    return normalized
+
+
+def _referenced(path: str, upload_names: set[str]) -> bool:
+    normalized = normalize_upload_path(path)
+    return normalized in upload_names or PurePosixPath(normalized).name in upload_names
+
+
+def _diffdock_references(parameters: Any, upload_names: set[str]) -> Iterable[ParameterError]:
+    rows = parameters.get("jobs") if isinstance(parameters, dict) else None
+    for row, job in enumerate(rows if isinstance(rows, list) else [], start=1):
+        if not isinstance(job, dict):
+            continue
+        references = [("protein_path", job.get("protein_path"))]
+        if job.get("ligand_type") == "sdf":
+            references.append(("ligand_description", job.get("ligand_description")))
+        for name, value in references:
+            if not isinstance(value, str) or not value.strip():
+                continue
+            if ".." in normalize_upload_path(value.strip()).split("/"):
+                yield ParameterError(row=row, field=f"jobs.{name}", message=f"{value.strip()} must not contain '..' segments.")
+            elif not _referenced(value.strip(), upload_names):
+                yield ParameterError(row=row, field=f"jobs.{name}", message=f"{value.strip()} is not among the uploaded files.")
+
+
+def upload_names(files: Iterable[UploadFile]) -> set[str]:
+    """File names a parameter payload may reference: loose uploads plus every path suffix inside zips."""
+    names: set[str] = set()
+    for upload in files:
+        name = upload.filename or ""
+        names.add(PurePosixPath(name).name)
+        if not name.lower().endswith(".zip"):
+            continue
+        try:
+            with zipfile.ZipFile(upload.file) as archive:
+                for member in archive.namelist():
+                    parts = PurePosixPath(member).parts
+                    names.update("/".join(parts[index:]) for index in range(len(parts)))
+        except zipfile.BadZipFile:
+            pass
+        finally:
+            upload.file.seek(0)
+    return names
+
+
+def error_detail(errors: list[ParameterError]) -> dict[str, Any]:
+    return {
+        "message": f"{len(errors)} invalid parameter value(s).",
+        "errors": [error.as_dict() for error in errors[:MAX_REPORTED_ERRORS]],
+        "errorCount": len(errors),
+    }
+
+
+DIFFDOCK_SCHEMA = ParameterSchema(DiffDockParameters, references=_diffdock_references)
+PHASTEST_SCHEMA = ParameterSchema(PhastestParameters)
@@ -0,0 +1,96 @@
+﻿"""Input archive benchmarks: gzip (the old single-core path) vs zstd levels on pipeline-shaped uploads."""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import shutil
+
+from harness import WORKDIR, Result, measure
+
+from app.runpod import PIPELINES
+from app.storage import ARCHIVE_SUFFIXES, build_archive
+
+RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+AMINO_ACIDS = ("ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE", "LEU", "LYS", "MET", "PHE", "PRO")
+ATOM_NAMES = ("N", "CA", "C", "O", "CB", "CG", "CD")
+
+
+def _fasta(rng: random.Random, name: str, length: int, alphabet: str) -> bytes:
+    sequence = "".join(rng.choices(alphabet, k=length))
+    lines = [sequence[i : i + 60] for i in range(0, length, 60)]
+    return (f">{name}\n" + "\n".join(lines) + "\n").encode()
+
+
+def _pdb(rng: random.Random, residues: int) -> bytes:
+    lines, serial = [], 1
+    for number in range(1, residues + 1):
+        residue = rng.choice(AMINO_ACIDS)
+        for atom in ATOM_NAMES:
+            x, y, z = (rng.uniform(-50, 50) for _ in range(3))
+            lines.append(
+                f"ATOM  {serial:5d}  {atom:<3} {residue} A{number:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  1.00{rng.uniform(30, 99):6.2f}"
+                f"           {atom[0]}"
+            )
+            serial += 1
+    return ("\n".join(lines) + "\nEND\n").encode()
+
+
+def _sdf(rng: random.Random, atoms: int) -> bytes:
+    lines = ["ligand", "  bench", "", f"{atoms:3d}{atoms - 1:3d}  0  0  0  0  0  0  0  0999 V2000"]
+    for _ in range(atoms):
+        x, y, z = (rng.uniform(-10, 10) for _ in range(3))
+        lines.append(f"{x:10.4f}{y:10.4f}{z:10.4f} {rng.choice('CCCNOS'):<3} 0  0  0  0  0  0  0  0  0  0  0  0")
+    lines += [f"{i:3d}{i + 1:3d}  1  0" for i in range(1, atoms)]
+    return ("\n".join(lines) + "\nM  END\n$$$$\n").encode()
+
+
+def pipeline_inputs(pipeline: str, scale: int) -> dict[str, bytes]:
+    rng = random.Random(7)
+    if pipeline == "alphafold":
+        return {f"target_{n}.fasta": _fasta(rng, f"target_{n}", 400, RESIDUES) for n in range(scale)}
+    if pipeline == "diffdock":
+        files = {f"protein_{n}.pdb": _pdb(rng, 300) for n in range(scale)}
+        # one ligand docked against every receptor: uploaded once per complex
+        ligand = _sdf(rng, 40)
+        files.update({f"ligand_{n}.sdf": ligand for n in range(scale * 4)})
+        return files
+    return {f"genome_{n}.fasta": _fasta(rng, f"genome_{n}", 2_000_000, "ACGT") for n in range(scale)}
+
+
+async def bench_build_input_archive(scale: dict) -> list[Result]:
+    results = []
+    for pipeline, count in scale["archive_inputs"].items():
+        folder = WORKDIR / f"archive-{pipeline}"
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+        paths = []
+        for name, data in pipeline_inputs(pipeline, count).items():
+            (folder / name).write_bytes(data)
+            paths.append(folder / name)
+        raw_bytes = sum(path.stat().st_size for path in paths)
+        # gzip 9 is what build_archive always produced; the middle zstd level is the pipeline's tuned default
+        levels = sorted({3, PIPELINES[pipeline].zstd_level, 12})
+        for codec, level in [("gzip", 9), *(("zstd", level) for level in levels)]:
+            target = WORKDIR / f"inputs-{pipeline}{ARCHIVE_SUFFIXES[codec]}"
+
+            async def build() -> None:
+                await asyncio.to_thread(build_archive, paths, target, codec, level)
+
+            samples = await measure(build, scale["repeat"])
+            size = target.stat().st_size
+            results.append(
+                Result(
+                    "build_input_archive",
+                    {"pipeline": pipeline, "codec": codec, "level": level, "raw_bytes": raw_bytes},
+                    samples,
+                    {"bytes": size, "ratio": raw_bytes / size, "mb_per_s": raw_bytes / min(samples) / 1e6},
+                )
+            )
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+BENCHMARKS = {
+    "build_input_archive": bench_build_input_archive,
+}
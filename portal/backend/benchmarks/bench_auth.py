@@ -0,0 +1,53 @@
+﻿"""Per-request overhead of the authenticated dependency path, cached and uncached."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from harness import Result, create_user, reset_db
+from starlette.requests import Request
+
+from app import auth
+from app.database import AsyncSessionLocal
+
+
+async def _time_requests(token: str, count: int, cached: bool) -> list[float]:
+    samples: list[float] = []
+    for _ in range(count):
+        if not cached:
+            auth.token_cache.clear()
+            auth.user_cache.clear()
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            await auth.get_current_user(Request({"type": "http", "headers": []}), db=db, token=token)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def bench_auth(scale: dict) -> list[Result]:
+    await reset_db()
+    async with AsyncSessionLocal() as db:
+        _, headers = await create_user(db)
+    token = headers["Authorization"].split()[1]
+    count = scale["repeat"] * 200
+    results = [
+        Result("get_current_user", {"cached": False}, await _time_requests(token, count, cached=False)),
+        Result("get_current_user", {"cached": True}, await _time_requests(token, count, cached=True)),
+    ]
+
+    async def login() -> None:
+        async with AsyncSessionLocal() as db:
+            await auth.authenticate_user(db, "bench", "benchpass")
+
+    concurrency = 8
+    samples = []
+    for _ in range(scale["repeat"]):
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(concurrency)))
+        samples.append(time.perf_counter() - start)
+    results.append(Result("login_burst", {"concurrency": concurrency}, samples))
+    return results
+
+
+BENCHMARKS = {"auth": bench_auth}
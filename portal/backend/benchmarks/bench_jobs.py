@@ -0,0 +1,201 @@
+﻿"""Request-path benchmarks: create_job, validate_parameters, list_jobs, search_jobs and download_artifact."""
+
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime
+from uuid import uuid4
+
+from harness import WORKDIR, FakeRunpod, Result, api_client, create_user, measure, reset_db, seed_jobs, use_fake_runpod
+from sqlalchemy import insert
+
+from app import models
+from app.database import AsyncSessionLocal
+from app.main import app
+from app.validation import DIFFDOCK_SCHEMA
+
+DIFFDOCK_PARAMETERS = json.dumps(
+    {
+        "jobs": [
+            {
+                "complex_name": "bench",
+                "protein_path": "protein.pdb",
+                "ligand_description": "ligand.sdf",
+                "ligand_type": "sdf",
+            }
+        ]
+    }
+)
+
+
+async def bench_create_job(scale: dict) -> list[Result]:
+    await reset_db()
+    use_fake_runpod(FakeRunpod())
+    async with AsyncSessionLocal() as db:
+        _, headers = await create_user(db)
+    results = []
+    async with api_client(app) as client:
+        for size in scale["upload_sizes"]:
+            # PDB-like text so archive compression behaves like real uploads
+            line = b"ATOM      1  CA  ALA A   1      11.104  13.207  10.000  1.00 90.00           C\n"
+            payload = (line * (size // len(line) + 1))[:size]
+
+            async def create() -> None:
+                response = await client.post(
+                    "/api/jobs",
+                    headers=headers,
+                    data={"title": "bench", "pipeline": "diffdock", "parameters": DIFFDOCK_PARAMETERS},
+                    files=[
+                        ("files", ("protein.pdb", payload, "chemical/x-pdb")),
+                        ("files", ("ligand.sdf", b"bench\n  RDKit\n\n$$$$\n", "chemical/x-mdl-sdfile")),
+                    ],
+                )
+                response.raise_for_status()
+
+            samples = await measure(create, scale["repeat"])
+            results.append(
+                Result("create_job", {"upload_bytes": size}, samples, {"mb_per_s": size / 1e6 / min(samples)})
+            )
+    return results
+
+
+async def bench_validate_parameters(scale: dict) -> list[Result]:
+    results = []
+    for rows in scale["manifest_rows"]:
+        names = {f"protein_{n}.pdb" for n in range(rows // 50 + 1)} | {"ligand.sdf"}
+        parameters = {
+            "jobs": [
+                {
+                    "complex_name": f"complex_{n}",
+                    "protein_path": f"inputs/protein_{n // 50}.pdb",
+                    "ligand_description": "ligand.sdf" if n % 2 else "CC(=O)Oc1ccccc1C(=O)O",
+                    "ligand_type": "sdf" if n % 2 else "smiles",
+                }
+                for n in range(rows)
+            ]
+        }
+        # every 100th row is broken so the error path is part of the measurement
+        for row in parameters["jobs"][::100]:
+            row["ligand_type"] = "mol2"
+
+        async def validate() -> None:
+            errors = DIFFDOCK_SCHEMA.validate(parameters, names)
+            assert len(errors) == len(parameters["jobs"][::100])
+
+        samples = await measure(validate, scale["repeat"])
+        results.append(Result("validate_parameters", {"rows": rows}, samples, {"rows_per_s": rows / min(samples)}))
+    return results
+
+
+async def bench_list_jobs(scale: dict) -> list[Result]:
+    await reset_db()
+    job_count = scale["list_jobs"]
+    per_job = scale["artifacts_per_job"]
+    async with AsyncSessionLocal() as db:
+        user, headers = await create_user(db)
+        await seed_jobs(db, user, job_count, per_job)
+
+    async with api_client(app) as client:
+        body_size = 0
+
+        async def list_all() -> None:
+            nonlocal body_size
+            response = await client.get("/api/jobs", headers=headers)
+            response.raise_for_status()
+            body_size = len(response.content)
+
+        samples = await measure(list_all, scale["repeat"])
+    return [Result("list_jobs", {"jobs": job_count, "artifacts": job_count * per_job}, samples, {"bytes": body_size})]
+
+
+async def bench_search_jobs(scale: dict) -> list[Result]:
+    await reset_db()
+    job_count = scale["search_jobs"]
+    residues = "ACDEFGHIKLMNPQRSTVWY"
+    async with AsyncSessionLocal() as db:
+        user, headers = await create_user(db)
+        now = datetime.utcnow()
+        for start in range(0, job_count, 10_000):
+            await db.execute(
+                insert(models.Job),
+                [
+                    {
+                        "id": str(uuid4()),
+                        "user_id": user.id,
+                        "title": f"sample_{index:06d} screen",
+                        "notes": f"batch {index % 97} follow-up",
+                        "pipeline": ("alphafold", "diffdock", "phastest")[index % 3],
+                        "status": "completed",
+                        "sequence": "".join(residues[(index * 7 + n) % 20] for n in range(60)),
+                        "parameters": {"jobs": [{"complex_name": f"cpx_{index:06d}", "ligand_description": "ligand.sdf"}]},
+                        "created_at": now,
+                        "updated_at": now,
+                        "expires_at": now,
+                    }
+                    for index in range(start, min(start + 10_000, job_count))
+                ],
+            )
+        await db.commit()
+
+    queries = {
+        "title": f"sample_{job_count // 2:06d}",
+        "parameters": f"cpx_{job_count // 3:06d}",
+        "sequence_fragment": "KLMNPQ",
+        "broad": "follow-up",
+    }
+    results = []
+    async with api_client(app) as client:
+        for label, query in queries.items():
+            total = 0
+
+            async def search() -> None:
+                nonlocal total
+                response = await client.get("/api/jobs/search", params={"q": query, "limit": 20}, headers=headers)
+                response.raise_for_status()
+                total = response.json()["total"]
+
+            samples = await measure(search, scale["repeat"])
+            results.append(Result("search_jobs", {"jobs": job_count, "query": label}, samples, {"matches": total}))
+    return results
+
+
+async def bench_download_artifact(scale: dict) -> list[Result]:
+    await reset_db()
+    size = scale["download_bytes"]
+    path = WORKDIR / "download.bin"
+    with path.open("wb") as handle:
+        chunk = os.urandom(1 << 20)
+        for _ in range(size // len(chunk)):
+            handle.write(chunk)
+    async with AsyncSessionLocal() as db:
+        user, headers = await create_user(db)
+        job = models.Job(user_id=user.id, title="download", pipeline="alphafold", status="completed")
+        db.add(job)
+        await db.flush()
+        artifact = models.Artifact(job_id=job.id, file_name=path.name, file_path=str(path), size_bytes=size)
+        db.add(artifact)
+        await db.commit()
+        url = f"/api/jobs/{job.id}/artifacts/{artifact.id}"
+
+    async with api_client(app) as client:
+
+        async def download() -> None:
+            received = 0
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_raw():
+                    received += len(chunk)
+            assert received == path.stat().st_size
+
+        samples = await measure(download, scale["repeat"])
+    return [Result("download_artifact", {"bytes": size}, samples, {"mb_per_s": size / 1e6 / min(samples)})]
+
+
+BENCHMARKS = {
+    "create_job": bench_create_job,
+    "validate_parameters": bench_validate_parameters,
+    "list_jobs": bench_list_jobs,
+    "search_jobs": bench_search_jobs,
+    "download_artifact": bench_download_artifact,
+}
@@ -0,0 +1,84 @@
+﻿"""Monitor benchmarks: one poll cycle over many active jobs and large archive persistence."""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from harness import FakeRunpod, Result, create_user, measure, reset_db, tar_base64
+from sqlalchemy import insert, update
+
+from app import models
+from app.database import AsyncSessionLocal
+from app.tasks import JobMonitor
+
+
+async def bench_poll_once(scale: dict) -> list[Result]:
+    await reset_db()
+    count = scale["poll_jobs"]
+    async with AsyncSessionLocal() as db:
+        user, _ = await create_user(db)
+        now = datetime.utcnow()
+        await db.execute(
+            insert(models.Job),
+            [
+                {
+                    "id": str(uuid4()),
+                    "user_id": user.id,
+                    "title": f"active {index}",
+                    "pipeline": "alphafold",
+                    "status": "running",
+                    "endpoint_id": "bench-alphafold",
+                    "runpod_job_id": f"fake-{index}",
+                    "created_at": now,
+                    "updated_at": now,
+                    "expires_at": now + timedelta(days=7),
+                }
+                for index in range(count)
+            ],
+        )
+        await db.commit()
+
+    monitor = JobMonitor()
+    monitor.client = FakeRunpod(status="IN_PROGRESS").client()
+
+    async def cycle() -> None:
+        await monitor._poll_once()
+        # keep every job active so each repeat polls the same backlog
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(models.Job).values(status="running"))
+            await db.commit()
+
+    samples = await measure(cycle, scale["repeat"])
+    await monitor.client.aclose()
+    return [Result("poll_once", {"active_jobs": count}, samples, {"jobs_per_s": count / min(samples)})]
+
+
+async def bench_persist_output(scale: dict) -> list[Result]:
+    await reset_db()
+    size = scale["persist_bytes"]
+    chunk = os.urandom(1 << 20)
+    payload = chunk * (size // len(chunk))
+    output = {"archives": [{"name": "result.tar", "base64": tar_base64({"ranked_0.pdb": payload})}]}
+    del payload
+    async with AsyncSessionLocal() as db:
+        user, _ = await create_user(db)
+    monitor = JobMonitor()
+
+    async def persist() -> None:
+        async with AsyncSessionLocal() as db:
+            job = models.Job(user_id=user.id, title="persist", pipeline="alphafold", status="completed")
+            db.add(job)
+            await db.flush()
+            await monitor._persist_output(db, job, output)
+            await db.commit()
+
+    samples = await measure(persist, scale["repeat"])
+    return [Result("persist_output", {"archive_bytes": size}, samples, {"mb_per_s": size / 1e6 / min(samples)})]
+
+
+BENCHMARKS = {
+    "poll_once": bench_poll_once,
+    "persist_output": bench_persist_output,
+}
@@ -0,0 +1,76 @@
+﻿"""Response-path benchmarks: list serialization (ORM + pydantic vs lean rows + orjson) and bytes on the wire."""
+
+from __future__ import annotations
+
+import json
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from harness import Result, api_client, create_user, measure, reset_db, seed_jobs
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from app import models
+from app.database import AsyncSessionLocal
+from app.main import app
+from app.schemas import JobRead
+from app.serializers import user_jobs_payload
+
+
+async def bench_serialize_jobs(scale: dict) -> list[Result]:
+    await reset_db()
+    rows = scale["response_rows"]
+    async with AsyncSessionLocal() as db:
+        user, _ = await create_user(db)
+        await seed_jobs(db, user, rows, scale["artifacts_per_job"])
+    size = 0
+
+    async def orm_path() -> None:
+        # what FastAPI did per request before: hydrate ORM rows, validate, jsonable_encoder, json.dumps
+        nonlocal size
+        async with AsyncSessionLocal() as db:
+            jobs = await db.scalars(
+                select(models.Job).options(selectinload(models.Job.artifacts)).where(models.Job.user_id == user.id)
+            )
+            content = jsonable_encoder([JobRead.model_validate(job, from_attributes=True) for job in jobs])
+            size = len(json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode())
+
+    async def lean_path() -> None:
+        nonlocal size
+        async with AsyncSessionLocal() as db:
+            size = len(orjson.dumps(await user_jobs_payload(db, user.id)))
+
+    results = []
+    for label, fn in (("orm_pydantic_json", orm_path), ("lean_orjson", lean_path)):
+        samples = await measure(fn, scale["repeat"])
+        results.append(Result("serialize_jobs", {"rows": rows, "path": label}, samples, {"bytes": size}))
+    return results
+
+
+async def bench_list_jobs_wire(scale: dict) -> list[Result]:
+    await reset_db()
+    rows = scale["response_rows"]
+    async with AsyncSessionLocal() as db:
+        user, headers = await create_user(db)
+        await seed_jobs(db, user, rows, scale["artifacts_per_job"])
+
+    results = []
+    async with api_client(app) as client:
+        for encoding in ("identity", "gzip", "br"):
+            wire = 0
+
+            async def fetch() -> None:
+                nonlocal wire
+                async with client.stream("GET", "/api/jobs", headers={**headers, "Accept-Encoding": encoding}) as response:
+                    response.raise_for_status()
+                    wire = sum([len(chunk) async for chunk in response.aiter_raw()])
+
+            samples = await measure(fetch, scale["repeat"])
+            results.append(Result("list_jobs_wire", {"rows": rows, "encoding": encoding}, samples, {"bytes": wire}))
+    return results
+
+
+BENCHMARKS = {
+    "serialize_jobs": bench_serialize_jobs,
+    "list_jobs_wire": bench_list_jobs_wire,
+}
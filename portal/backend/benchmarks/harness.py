@@ -0,0 +1,249 @@
+﻿"""Shared setup for the offline benchmark suite.
+
+Importing this module points the app at a throwaway storage root and SQLite
+database and fakes every RunPod call, so benchmarks never touch the network
+or the real ``.env``.
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import json
+import os
+import statistics
+import sys
+import tarfile
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+WORKDIR = Path(os.environ.get("BENCH_WORKDIR") or tempfile.mkdtemp(prefix="portal-bench-"))
+WORKDIR.mkdir(parents=True, exist_ok=True)
+
+os.environ.update(
+    {
+        "STORAGE_ROOT": str(WORKDIR / "storage"),
+        "DATABASE_URL": f"sqlite:///{WORKDIR / 'bench.db'}",
+        "RUNPOD_API_KEY": "bench",
+        "ALPHAFOLD_ENDPOINT_ID": "bench-alphafold",
+        "DIFFDOCK_ENDPOINT_ID": "bench-diffdock",
+        "PHASTEST_ENDPOINT_ID": "bench-phastest",
+        "TRACING_ENABLED": "false",
+        "SLOW_REQUEST_MS": "600000",
+    }
+)
+# keep pydantic-settings from picking up the deployment .env in the backend directory
+os.chdir(WORKDIR)
+sys.path.insert(0, str(BACKEND_ROOT))
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import auth, models  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.runpod import RunpodClient  # noqa: E402
+from app.search import search_index  # noqa: E402
+
+SCALES: dict[str, dict[str, Any]] = {
+    "quick": {
+        "upload_sizes": [1 << 10, 1 << 20],
+        "list_jobs": 500,
+        "search_jobs": 10_000,
+        "artifacts_per_job": 10,
+        "poll_jobs": 100,
+        "persist_bytes": 16 << 20,
+        "download_bytes": 16 << 20,
+        "manifest_rows": [1_000, 10_000],
+        "response_rows": 2_000,
+        "archive_inputs": {"alphafold": 8, "diffdock": 20, "phastest": 1},
+        "repeat": 3,
+    },
+    "full": {
+        "upload_sizes": [1 << 10, 1 << 20, 16 << 20, 128 << 20],
+        "list_jobs": 10_000,
+        "search_jobs": 100_000,
+        "artifacts_per_job": 10,
+        "poll_jobs": 1_000,
+        "persist_bytes": 1 << 30,
+        "download_bytes": 256 << 20,
+        "manifest_rows": [10_000, 100_000],
+        "response_rows": 10_000,
+        "archive_inputs": {"alphafold": 64, "diffdock": 200, "phastest": 8},
+        "repeat": 5,
+    },
+}
+
+
+@dataclass
+class Result:
+    name: str
+    params: dict[str, Any]
+    samples: list[float]
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    def summary(self) -> dict[str, Any]:
+        ordered = sorted(self.samples)
+        data = asdict(self)
+        data.update(
+            mean_s=statistics.fmean(ordered),
+            min_s=ordered[0],
+            p50_s=ordered[len(ordered) // 2],
+            p95_s=ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        )
+        return data
+
+
+async def measure(fn: Callable[[], Awaitable[Any]], repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def reset_db() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(search_index.setup)
+    auth.token_cache.clear()
+    auth.user_cache.clear()
+
+
+async def create_user(db, username: str = "bench") -> tuple[models.User, dict[str, str]]:
+    user = models.User(username=username, password_hash=auth.hash_password("benchpass"))
+    db.add(user)
+    await db.commit()
+    token = auth.create_access_token({"sub": username})
+    return user, {"Authorization": f"Bearer {token}"}
+
+
+async def seed_jobs(db, user: models.User, count: int, artifacts_per_job: int) -> list[str]:
+    """Bulk-insert completed AlphaFold jobs with structure artifacts, bypassing the API."""
+    now = datetime.utcnow()
+    job_ids = [str(uuid4()) for _ in range(count)]
+    await db.execute(
+        insert(models.Job),
+        [
+            {
+                "id": job_id,
+                "user_id": user.id,
+                "title": f"job {index}",
+                "pipeline": "alphafold",
+                "status": "completed",
+                "parameters": {"model_preset": "monomer"},
+                "created_at": now,
+                "updated_at": now,
+                "expires_at": now,
+            }
+            for index, job_id in enumerate(job_ids)
+        ],
+    )
+    await db.execute(
+        insert(models.Artifact),
+        [
+            {
+                "id": str(uuid4()),
+                "job_id": job_id,
+                "file_name": f"ranked_{n}.pdb",
+                "file_path": f"/bench/{job_id}/ranked_{n}.pdb",
+                "kind": "structure",
+                "mime_type": "chemical/x-pdb",
+                "size_bytes": 1024,
+                "created_at": now,
+            }
+            for job_id in job_ids
+            for n in range(artifacts_per_job)
+        ],
+    )
+    await db.commit()
+    return job_ids
+
+
+def tar_base64(files: dict[str, bytes]) -> str:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class FakeRunpod:
+    """In-process stand-in for the RunPod serverless API."""
+
+    def __init__(self, output: dict[str, Any] | None = None, status: str = "IN_PROGRESS") -> None:
+        self.output = output
+        self.status = status
+        self.calls: dict[str, int] = {}
+        self._next_id = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        operation = request.url.path.rstrip("/").split("/")[3]
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if operation == "run":
+            self._next_id += 1
+            return httpx.Response(200, json={"id": f"fake-{self._next_id}", "status": "IN_QUEUE"})
+        if operation == "status":
+            body: dict[str, Any] = {"status": self.status, "delayTime": 1000, "executionTime": 1000}
+            if self.output is not None:
+                body["output"] = self.output
+            return httpx.Response(200, json=body)
+        if operation == "stream":
+            return httpx.Response(200, json={"status": self.status, "stream": []})
+        if operation == "health":
+            return httpx.Response(200, json={"jobs": {"inQueue": 0, "inProgress": 0}, "workers": {"idle": 1, "running": 0}})
+        return httpx.Response(200, json={"status": "CANCELLED"})
+
+    def client(self) -> RunpodClient:
+        return RunpodClient(transport=httpx.MockTransport(self.handler))
+
+
+def api_client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+
+def write_results(results: list[Result], scale: str, output: Path | None) -> dict[str, Any]:
+    document = {
+        "meta": {
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "scale": scale,
+        },
+        "results": [result.summary() for result in results],
+    }
+    text = json.dumps(document, indent=2)
+    if output:
+        output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    return document
+
+
+def _git_commit() -> str | None:
+    head = BACKEND_ROOT.parents[1] / ".git" / "HEAD"
+    try:
+        ref = head.read_text().strip()
+        if ref.startswith("ref: "):
+            return (head.parent / ref[5:]).read_text().strip()
+        return ref
+    except OSError:
+        return None
+
+
+def use_fake_runpod(fake: FakeRunpod) -> None:
+    """Point the background workers' RunPod clients at ``fake``."""
+    from app.dispatcher import dispatcher
+    from app.tasks import monitor
+
+    dispatcher.client = fake.client()
+    monitor.client = fake.client()
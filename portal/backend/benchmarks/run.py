@@ -0,0 +1,70 @@
+﻿"""Run the offline backend benchmark suite.
+
+    python benchmarks/run.py --scale quick --output bench.json
+    python benchmarks/run.py --scale quick --compare bench.json
+
+Results are written as JSON (one record per benchmark/parameter set) so runs
+from different commits can be diffed with ``--compare``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from pathlib import Path
+
+import harness  # noqa: F401  (must be imported before any app module)
+import bench_archives
+import bench_auth
+import bench_jobs
+import bench_monitor
+import bench_responses
+
+BENCHMARKS = {
+    **bench_archives.BENCHMARKS,
+    **bench_auth.BENCHMARKS,
+    **bench_jobs.BENCHMARKS,
+    **bench_monitor.BENCHMARKS,
+    **bench_responses.BENCHMARKS,
+}
+
+
+def _key(record: dict) -> str:
+    params = ",".join(f"{key}={value}" for key, value in sorted(record["params"].items()))
+    return f"{record['name']}[{params}]"
+
+
+def compare(current: dict, baseline_path: Path) -> None:
+    baseline = {_key(record): record for record in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    print(f"{'benchmark':60} {'base p50':>12} {'new p50':>12} {'change':>8}")
+    for record in current["results"]:
+        key = _key(record)
+        previous = baseline.get(key)
+        if not previous:
+            print(f"{key:60} {'-':>12} {record['p50_s']:>12.6f} {'new':>8}")
+            continue
+        change = (record["p50_s"] - previous["p50_s"]) / previous["p50_s"] * 100
+        print(f"{key:60} {previous['p50_s']:>12.6f} {record['p50_s']:>12.6f} {change:>+7.1f}%")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the portal backend")
+    parser.add_argument("--scale", choices=sorted(harness.SCALES), default="quick")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="Run a subset (repeatable)")
+    parser.add_argument("--output", type=Path, help="Write results JSON here instead of stdout")
+    parser.add_argument("--compare", type=Path, help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    scale = harness.SCALES[args.scale]
+    results = []
+    for name in args.only or BENCHMARKS:
+        print(f"[bench] {name} ({args.scale})", flush=True)
+        results.extend(await BENCHMARKS[name](scale))
+    document = harness.write_results(results, args.scale, args.output)
+    if args.compare:
+        compare(document, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -13,10 +13,12 @@ import {
   deleteJob,
   downloadArchive,
   downloadArtifact,
+  fetchStructurePreview,
   login,
   register,
 } from "@/lib/api";
 import { triggerDownload } from "@/lib/download";
+import { decodePreview, previewToPdb } from "@/lib/preview";
 import { JobStatusBadge } from "@/components/JobStatusBadge";
 import { NglViewer } from "@/components/NglViewer";
 
@@ -936,19 +938,37 @@ type ResultPanelProps = {
 
 function ResultPanel({ job, token, onArtifactDownload }: ResultPanelProps) {
   const [viewerUrl, setViewerUrl] = useState<string | null>(null);
+  const [viewerLod, setViewerLod] = useState<"trace" | "full">("trace");
   const [htmlPreviewUrl, setHtmlPreviewUrl] = useState<string | null>(null);
 
   useEffect(() => {
     let revoked: string[] = [];
+    let cancelled = false;
+    const showPreview = async (structureId: string, lod: "trace" | "full") => {
+      const buffer = await fetchStructurePreview(job.id, structureId, lod, token);
+      if (cancelled) return;
+      const pdb = previewToPdb(decodePreview(buffer));
+      const url = URL.createObjectURL(new Blob([pdb], { type: "chemical/x-pdb" }));
+      revoked.push(url);
+      setViewerLod(lod);
+      setViewerUrl(url);
+    };
     async function prepare() {
       setViewerUrl(null);
       setHtmlPreviewUrl(null);
       const structure = job.artifacts.find((artifact) => artifact.file_name.endsWith(".pdb"));
       if (structure) {
-        const blob = await downloadArtifact(job.id, structure.id, token);
-        const url = URL.createObjectURL(blob);
-        setViewerUrl(url);
-        revoked.push(url);
+        // CA trace first for a fast first paint, then the full model
+        try {
+          await showPreview(structure.id, "trace");
+          await showPreview(structure.id, "full");
+        } catch {
+          const blob = await downloadArtifact(job.id, structure.id, token);
+          const url = URL.createObjectURL(blob);
+          revoked.push(url);
+          setViewerLod("full");
+          setViewerUrl(url);
+        }
       }
       const html = job.artifacts.find((artifact) => artifact.file_name.endsWith(".html"));
       if (html) {
@@ -960,6 +980,7 @@ function ResultPanel({ job, token, onArtifactDownload }: ResultPanelProps) {
     }
     prepare();
     return () => {
+      cancelled = true;
       revoked.forEach((url) => URL.revokeObjectURL(url));
     };
   }, [job.id, job.artifacts, token]);
@@ -971,7 +992,7 @@ function ResultPanel({ job, token, onArtifactDownload }: ResultPanelProps) {
       {job.pipeline === "alphafold" && (
         <div className="mt-4 space-y-3">
           <p className="text-sm text-slate-600">3D Protein Viewer</p>
-          {viewerUrl ? <NglViewer url={viewerUrl} /> : <p className="text-xs text-slate-400">구조 파일을 준비하는 중입니다.</p>}
+          {viewerUrl ? <NglViewer url={viewerUrl} representation={viewerLod === "trace" ? "backbone" : "cartoon"} /> : <p className="text-xs text-slate-400">구조 파일을 준비하는 중입니다.</p>}
         </div>
       )}
       {job.pipeline === "phastest" && htmlPreviewUrl && (
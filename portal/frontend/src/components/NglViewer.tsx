@@ -4,9 +4,10 @@ import { useEffect, useRef } from "react";
 
 type Props = {
   url: string | null;
+  representation?: string;
 };
 
-export function NglViewer({ url }: Props) {
+export function NglViewer({ url, representation = "cartoon" }: Props) {
   const ref = useRef<HTMLDivElement | null>(null);
 
   useEffect(() => {
@@ -16,7 +17,7 @@ export function NglViewer({ url }: Props) {
       const NGL = await import("ngl");
       stage = new NGL.Stage(ref.current, { backgroundColor: "#050816" });
       const comp = await stage.loadFile(url, { ext: "pdb" });
-      comp.addRepresentation("cartoon", { colorScheme: "chainname" });
+      comp.addRepresentation(representation, { colorScheme: "chainname" });
       comp.autoView();
     }
     init();
@@ -25,7 +26,7 @@ export function NglViewer({ url }: Props) {
         stage.dispose();
       }
     };
-  }, [url]);
+  }, [url, representation]);
 
   return <div ref={ref} className="h-80 w-full rounded-xl border border-slate-800" />;
 }
@@ -11,6 +11,39 @@ type FetchOptions = {
   body?: BodyInit;
 };
 
+type ErrorItem = { row?: number | null; field?: string; message?: string; loc?: (string | number)[]; msg?: string };
+
+function formatErrorItem(item: ErrorItem) {
+  const field = item.field ?? item.loc?.filter((part) => part !== "body").join(".");
+  const location = [item.row ? `${item.row}행` : "", field ?? ""].filter(Boolean).join(" ");
+  const message = item.message ?? item.msg ?? "";
+  return location ? `${location}: ${message}` : message;
+}
+
+function formatErrorDetail(text: string) {
+  let detail: unknown;
+  try {
+    detail = (JSON.parse(text) as { detail?: unknown }).detail;
+  } catch {
+    return text;
+  }
+  if (typeof detail === "string") {
+    return detail;
+  }
+  if (Array.isArray(detail)) {
+    return detail.map((item: ErrorItem) => formatErrorItem(item)).join("\n");
+  }
+  if (detail && typeof detail === "object") {
+    const { message, errors, errorCount } = detail as { message?: string; errors?: ErrorItem[]; errorCount?: number };
+    const lines = (errors ?? []).map((item) => `- ${formatErrorItem(item)}`);
+    if (errorCount !== undefined && errors && errorCount > errors.length) {
+      lines.push(`- 외 ${errorCount - errors.length}건`);
+    }
+    return [message, ...lines].filter(Boolean).join("\n");
+  }
+  return text;
+}
+
 async function apiFetch<T>(path: string, token?: string, options: FetchOptions = {}): Promise<T> {
   const headers: Record<string, string> = options.headers ? { ...options.headers } : {};
   if (!(options.body instanceof FormData)) {
@@ -25,7 +58,7 @@ async function apiFetch<T>(path: string, token?: string, options: FetchOptions =
     body: options.body,
   });
   if (!response.ok) {
-    const message = await response.text();
+    const message = formatErrorDetail(await response.text());
     throw new Error(message || "요청이 실패했습니다.");
   }
   if (response.status === 204) {
@@ -62,6 +95,36 @@ export const fetchPipelines = (token: string) => apiFetch<PipelineResponse>("/ap
 export const fetchJobs = (token: string) => apiFetch<JobResponse[]>("/api/jobs", token);
 export const fetchJob = (jobId: string, token: string) => apiFetch<JobResponse>(`/api/jobs/${jobId}`, token);
 
+export const searchJobs = (query: string, token: string, options: { pipeline?: string; status?: string; limit?: number; offset?: number } = {}) => {
+  const params = new URLSearchParams({ q: query });
+  Object.entries(options).forEach(([key, value]) => value !== undefined && params.set(key, String(value)));
+  return apiFetch<JobSearchResponse>(`/api/jobs/search?${params.toString()}`, token);
+};
+
+export const fetchPoseClusters = (jobId: string, token: string, threshold?: number) =>
+  apiFetch<PoseCluster[]>(
+    `/api/analysis/jobs/${jobId}/pose-clusters${threshold !== undefined ? `?threshold=${threshold}` : ""}`,
+    token,
+  );
+
+export const fetchPhageFeatures = (
+  jobId: string,
+  token: string,
+  window: { sample?: string; start?: number; end?: number; source?: string } = {},
+) => {
+  const query = new URLSearchParams();
+  Object.entries(window).forEach(([key, value]) => value !== undefined && query.set(key, String(value)));
+  return apiFetch<PhageFeatures>(`/api/analysis/jobs/${jobId}/phage/features?${query.toString()}`, token);
+};
+
+export async function compareStructures(artifactIds: string[], references: File[], token: string, match: "numbering" | "order" = "numbering") {
+  const form = new FormData();
+  artifactIds.forEach((id) => form.append("artifact_ids", id));
+  references.forEach((file) => form.append("references", file));
+  form.set("match", match);
+  return apiFetch<StructureComparison>("/api/analysis/compare", token, { method: "POST", body: form });
+}
+
 export async function createJob(form: FormData, token: string) {
   return apiFetch<JobResponse>("/api/jobs", token, {
     method: "POST",
@@ -83,6 +146,16 @@ export async function downloadArtifact(jobId: string, artifactId: string, token:
   return blob;
 }
 
+export async function fetchStructurePreview(jobId: string, artifactId: string, lod: "full" | "trace" | "ligand", token: string) {
+  const response = await fetch(`${API_BASE}/api/jobs/${jobId}/artifacts/${artifactId}/preview?lod=${lod}`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!response.ok) {
+    throw new Error("구조 미리보기를 불러올 수 없습니다.");
+  }
+  return response.arrayBuffer();
+}
+
 export async function downloadArchive(jobId: string, token: string) {
   const response = await fetch(`${API_BASE}/api/jobs/${jobId}/download`, {
     headers: { Authorization: `Bearer ${token}` },
@@ -140,3 +213,49 @@ export interface JobResponse {
   parameters: Record<string, unknown>;
   artifacts: ArtifactMeta[];
 }
+
+export interface JobSearchResponse {
+  total: number;
+  total_capped: boolean;
+  items: Array<{
+    id: string;
+    title: string;
+    pipeline: string;
+    status: string;
+    created_at: string;
+    score: number;
+    snippet: string | null;
+  }>;
+}
+
+export interface PoseCluster {
+  complex_name: string | null;
+  threshold: number;
+  cluster_index: number;
+  size: number;
+  member_ranks: number[];
+  best_confidence: number | null;
+  max_rmsd: number;
+  representative_pose_id: number;
+  representative_artifact_id: string | null;
+  representative_rank: number | null;
+}
+
+export interface StructureComparison {
+  items: Array<{ artifactId: string; jobId: string; fileName: string } | { reference: string }>;
+  labels: string[];
+  residues: number[];
+  aligned: number[][];
+  rmsd: Array<Array<number | null>>;
+  tm: number[][];
+}
+
+export interface PhageFeatures {
+  sample: string;
+  sequenceLength: number | null;
+  start: number | null;
+  end: number | null;
+  count: number;
+  truncated: boolean;
+  columns: Record<"start" | "stop" | "strand", number[]> & Record<"type" | "name" | "source" | "region_label", string[]>;
+}
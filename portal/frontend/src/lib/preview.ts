@@ -0,0 +1,95 @@
+﻿// Decoder for the backend's compact structure previews (RPV1, see app/structures.py).
+
+type ArrayLayout = { dtype: string; offset: number; length: number };
+
+type PreviewHeader = {
+  version: number;
+  lod: string;
+  source: string;
+  atoms: number;
+  tables: Record<"atomName" | "resName" | "chain" | "element", string[]>;
+  arrays: Record<string, ArrayLayout>;
+};
+
+export type StructurePreview = {
+  lod: string;
+  source: string;
+  atoms: number;
+  coords: Float32Array;
+  bFactor: Float32Array;
+  resSeq: Int32Array;
+  atomName: Uint16Array;
+  resName: Uint16Array;
+  chain: Uint16Array;
+  element: Uint8Array;
+  hetero: Uint8Array;
+  tables: PreviewHeader["tables"];
+};
+
+const TYPED: Record<string, { new (buffer: ArrayBuffer, offset: number, length: number): ArrayLike<number> }> = {
+  float32: Float32Array,
+  int32: Int32Array,
+  uint16: Uint16Array,
+  uint8: Uint8Array,
+};
+
+export function decodePreview(buffer: ArrayBuffer): StructurePreview {
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== "RPV1") {
+    throw new Error("Unknown preview format");
+  }
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength))) as PreviewHeader;
+  const bodyStart = 8 + headerLength;
+  const view = (name: string) => {
+    const layout = header.arrays[name];
+    return new TYPED[layout.dtype](buffer, bodyStart + layout.offset, layout.length);
+  };
+  return {
+    lod: header.lod,
+    source: header.source,
+    atoms: header.atoms,
+    coords: view("coords") as Float32Array,
+    bFactor: view("bFactor") as Float32Array,
+    resSeq: view("resSeq") as Int32Array,
+    atomName: view("atomName") as Uint16Array,
+    resName: view("resName") as Uint16Array,
+    chain: view("chain") as Uint16Array,
+    element: view("element") as Uint8Array,
+    hetero: view("hetero") as Uint8Array,
+    tables: header.tables,
+  };
+}
+
+const num = (value: number, width: number, digits: number) => value.toFixed(digits).padStart(width).slice(-width);
+
+// NGL has no loader for our binary format, so rebuild the handful of PDB columns it needs
+export function previewToPdb(preview: StructurePreview): string {
+  const { tables } = preview;
+  const lines: string[] = [];
+  for (let i = 0; i < preview.atoms; i += 1) {
+    const name = tables.atomName[preview.atomName[i]];
+    const element = tables.element[preview.element[i]];
+    lines.push(
+      (preview.hetero[i] ? "HETATM" : "ATOM  ") +
+        String((i + 1) % 100000).padStart(5) +
+        " " +
+        (name.length < 4 ? ` ${name}`.padEnd(4) : name.slice(0, 4)) +
+        " " +
+        tables.resName[preview.resName[i]].padStart(3).slice(0, 3) +
+        " " +
+        (tables.chain[preview.chain[i]] || "A").slice(0, 1) +
+        String(preview.resSeq[i] % 10000).padStart(4) +
+        "    " +
+        num(preview.coords[i * 3], 8, 3) +
+        num(preview.coords[i * 3 + 1], 8, 3) +
+        num(preview.coords[i * 3 + 2], 8, 3) +
+        "  1.00" +
+        num(preview.bFactor[i], 6, 2) +
+        "          " +
+        element.padStart(2).slice(0, 2),
+    );
+  }
+  lines.push("END");
+  return lines.join("\n");
+}